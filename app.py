@@ -2,19 +2,19 @@
 import os
 import warnings
 import logging
-from pathlib import Path
 from send2trash import send2trash
 
 # Third party imports
 from dotenv import load_dotenv
 
 # Local application imports
-import clipper
-import subtitler
-import crew
-from ytdl import main as ytdl_main
+# Stage modules import their heavy dependencies (torch, whisper, crewai, yt_dlp, LLM clients)
+# only when the stage runs, so starting the CLI stays fast; see bench_startup.py
+import pipeline
+from clipper import get_aspect_ratio_choice
 from local_transcribe import local_whisper_process
-import extracts
+import llm_backends
+from workspace import default_workspace
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,107 +24,86 @@ warnings.filterwarnings("ignore")
 # Load environment variables
 load_dotenv()
 
-# List of required environment variables
-required_vars = ['OPENAI_API_KEY', 'GEMINI_API_KEY']
+def check_required_vars():
+    """
+    This function checks if the required environment variables are set.
+    If any of the required environment variables are set to 'None', an EnvironmentError is raised.
+    """
+    # List of required environment variables (none when replaying or stubbing the LLM backends)
+    required_vars = llm_backends.required_api_keys()
 
-"""
-This for loop checks if the required environment variables are set. 
-If any of the required environment variables are set to 'None', an EnvironmentError is raised.
-"""
-for var in required_vars:
-    value = os.getenv(var)
-    if value is None or value == 'None':
-        raise EnvironmentError(f"Required environment variable {var} is not set or is set to 'None'.")
+    for var in required_vars:
+        value = os.getenv(var)
+        if value is None or value == 'None':
+            raise EnvironmentError(f"Required environment variable {var} is not set or is set to 'None'.")
 
-def get_aspect_ratio_choice():
-    while True:
-        choice = input("Choose aspect ratio for all videos: (1) Keep as original, (2) 1:1 (square): ")
-        if choice in ['1', '2']:
-            return choice
-        print("Invalid choice. Please enter 1 or 2.")
-
-def clean_whisper_output():
-    whisper_output_folder = './whisper_output'
+def clean_whisper_output(whisper_output_folder='./whisper_output'):
     for filename in os.listdir(whisper_output_folder):
         file_path = os.path.join(whisper_output_folder, filename)
         try:
-            if os.path.isfile(file_path):
+            # Binary transcripts and their search indexes are folders
+            if os.path.isfile(file_path) or filename.endswith(('.transcript', '.index')):
                 send2trash(file_path)
                 logging.info(f"Moved {file_path} to trash")
         except Exception as e:
             logging.error(f"Error while moving {file_path} to trash: {e}")
 
 def main():
-    input_folder = './input_files'
-    output_video_folder = './clipper_output'
-    crew_output_folder = './crew_output'
-    whisper_output_folder = './whisper_output'
-    subtitler_output_folder = './subtitler_output'
+    check_required_vars()
 
-    # Ensure all necessary directories exist
-    for folder in [input_folder, output_video_folder, crew_output_folder, whisper_output_folder, subtitler_output_folder]:
-        os.makedirs(folder, exist_ok=True)
+    # Set VCC_WORKSPACE to run this job in its own folder tree, e.g. next to other jobs on the same host
+    workspace = default_workspace().ensure()
+    input_folder = str(workspace.input_files)
+    whisper_output_folder = str(workspace.whisper_output)
+
+    # Get aspect ratio choice up front, so that the pipeline can run unattended
+    aspect_ratio_choice = get_aspect_ratio_choice()
+    smart_crop = False
+    if aspect_ratio_choice != '1':
+        smart_crop = input("Follow the action when cropping instead of cropping the center? (y/n): ").lower() == 'y'
+    snap_boundaries = input("Cut clips at the nearest pause instead of exactly on the subtitles? (y/n): ").lower() == 'y'
+    dedupe = input("Reuse clips already rendered on this machine instead of rendering them again? (y/n): ").lower() == 'y'
+    topic = input("Only pick clips about a topic (leave empty for the most viral moments): ").strip() or None
 
     # User selection
     while True:
         logging.info("Please select an option to proceed:")
         logging.info("1: Submit a YouTube Video Link")
         logging.info("2: Use an existing video file")
-        choice = input("Please choose either option 1 or 2: ")
-
-        if choice == '1':
-            logging.info("Submitting a YouTube Video Link")
+        logging.info("3: Submit a YouTube Video Link (download only the selected clips)")
+        choice = input("Please choose option 1, 2 or 3: ")
+
+        if choice in ['1', '3']:
+            sections_only = choice == '3'
+            if sections_only:
+                logging.info("Submitting a YouTube Video Link, downloading only the selected clips")
+            else:
+                logging.info("Submitting a YouTube Video Link")
             url = input("Enter the YouTube URL: ")
-            ytdl_main(url, input_folder, whisper_output_folder, whisper_output_folder)
+            pipeline.run_youtube_pipeline(url, workspace, aspect_ratio_choice, sections_only=sections_only,
+                                          smart_crop=smart_crop, snap_boundaries=snap_boundaries, topic=topic,
+                                          dedupe=dedupe)
             break
         elif choice == '2':
             logging.info("Using an existing video file")
             if not os.listdir(input_folder):
                 logging.error(f"No video files found in the folder: {input_folder}")
                 continue
-            clean_whisper_output()  # Clean whisper_output folder
-            local_whisper_process(input_folder, whisper_output_folder)
+            clean_whisper_output(whisper_output_folder)  # Clean whisper_output folder
+            pipeline.run_local_pipeline(workspace, aspect_ratio_choice,
+                                        transcribe=lambda: local_whisper_process(
+                                            input_folder, whisper_output_folder,
+                                            whisper_output_folder=whisper_output_folder),
+                                        smart_crop=smart_crop, snap_boundaries=snap_boundaries, topic=topic,
+                                        dedupe=dedupe)
             break
         else:
             logging.info("Invalid choice. Please try again.")
 
-    # Get aspect ratio choice
-    aspect_ratio_choice = get_aspect_ratio_choice()
-
-    # After processing with ytdl or local_whisper_process
-    extracts_data = extracts.main()
-    if extracts_data is None:
-        logging.error("Failed to generate extracts. Exiting.")
-        return
-
-    # Process with crew.py
-    crew.main(extracts_data)
-
-    # Process with clipper.py
-    input_folder_path = Path(input_folder)
-    crew_output_folder_path = Path(crew_output_folder)
-    output_video_folder_path = Path(output_video_folder)
-
-    for video_file in input_folder_path.glob('*.mp4'):
-        for srt_file in crew_output_folder_path.glob('*.srt'):
-            clipper.main(str(video_file), str(srt_file), str(output_video_folder_path), aspect_ratio_choice)
-            logging.info(f"Processed {video_file} with {srt_file}")
-
-    # Process with subtitler.py
-    for video_file in output_video_folder_path.glob('*_trimmed.mp4'):
-        base_name = video_file.stem.replace('_trimmed', '')
-        srt_file = crew_output_folder_path / f"{base_name}.srt"
-        if srt_file.exists():
-            subtitler.process_video_and_subtitles(str(video_file), str(srt_file), subtitler_output_folder)
-            logging.info(f"Added subtitles to {video_file}")
-        else:
-            logging.warning(f"No matching subtitle file found for {video_file}")
-
-    logging.info(f"All videos processed. Final output saved in {subtitler_output_folder}")
+    logging.info(f"All videos processed. Final output saved in {workspace.subtitler_output}")
 
 if __name__ == "__main__":
     main()
 
 # TODO: Change the options to: 1. Download YouTube video and transcribe locally 2. Download YouTube video and use remote transcript 3. Use existing video file to transcribe locally
 # TODO: Add an API key validator before proceeding with the execution to avoid discovering that the API key is invalid during later stages of the process.
-# TODO: Request the aspect ratio input before initiating the local transcription process.
\ No newline at end of file
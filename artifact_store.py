@@ -0,0 +1,295 @@
+"""
+Scratch space and garbage collection for intermediate artifacts.
+
+Intermediates (trimmed clips, analysis caches, clip sections and audio-only downloads) are only
+needed while their job runs. Set VCC_SCRATCH to a fast filesystem such as a tmpfs, and each
+workspace keeps its trimmed clips and analysis caches there instead of next to the final
+outputs (see `Workspace.clipper_output`).
+
+Every running job holds a reference to its workspace in a SQLite database shared by the
+processes on the host. The garbage collector never touches a referenced workspace. Otherwise it
+deletes intermediates least recently used first, until they fit in the size cap:
+
+    VCC_SCRATCH             scratch root, e.g. /dev/shm/viral-clips-crew (default: none)
+    VCC_ARTIFACT_MAX_SIZE   size cap, e.g. 20G (default: half of the scratch filesystem, if any)
+    VCC_ARTIFACT_DB         reference database (default ~/.cache/viral-clips-crew/artifacts.db)
+
+Collection runs when a job releases its reference, or on demand:
+
+    python artifact_store.py gc --max-size 20G
+"""
+
+# Standard library imports
+import os
+import time
+import socket
+import shutil
+import hashlib
+import sqlite3
+import logging
+import argparse
+from pathlib import Path
+from contextlib import closing, contextmanager
+
+# Third party imports
+
+# Local application imports
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'viral-clips-crew', 'artifacts.db')
+DEFAULT_JOBS_ROOT = 'jobs'
+
+# Workspace folders (relative to the workspace or its scratch folder) holding intermediates only
+INTERMEDIATE_FOLDERS = ['clipper_output', 'analysis', 'input_files/sections', 'input_files/audio']
+# References from other hosts, whose processes cannot be checked, expire after this long
+STALE_REFERENCE_SECONDS = 24 * 3600
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refs (
+    job_id TEXT NOT NULL,
+    root TEXT NOT NULL,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    acquired REAL NOT NULL,
+    PRIMARY KEY (job_id, host, pid)
+);
+"""
+
+
+def scratch_root():
+    """
+    Returns the scratch root set with VCC_SCRATCH, or None.
+    """
+    root = os.getenv('VCC_SCRATCH')
+    return Path(root) if root else None
+
+
+def scratch_dir(root):
+    """
+    Returns the scratch folder of the workspace at root, or None without a scratch root.
+    The folder name is the job id plus a digest of the workspace path, so it never collides.
+    """
+    scratch = scratch_root()
+    if scratch is None:
+        return None
+    root = Path(root).resolve()
+    digest = hashlib.sha1(str(root).encode('utf-8')).hexdigest()[:8]
+    return scratch / f"{root.name}_{digest}"
+
+
+def parse_size(size):
+    """
+    Parses a size such as '512M' or '20G' into bytes.
+    """
+    size = str(size).strip().upper().rstrip('B')
+    unit = size[-1:] if size[-1:] in SIZE_UNITS else ''
+    return int(float(size[:len(size) - len(unit)]) * SIZE_UNITS[unit])
+
+
+def default_max_size():
+    """
+    Returns the size cap from VCC_ARTIFACT_MAX_SIZE, else half of the scratch filesystem,
+    else None (no automatic collection).
+    """
+    if os.getenv('VCC_ARTIFACT_MAX_SIZE'):
+        return parse_size(os.getenv('VCC_ARTIFACT_MAX_SIZE'))
+    scratch = scratch_root()
+    if scratch is not None and scratch.exists():
+        return shutil.disk_usage(scratch).total // 2
+    return None
+
+
+def _entry_size(path):
+    if path.is_symlink() or not path.is_dir():
+        return path.lstat().st_size
+    return sum(child.lstat().st_size for child in path.rglob('*') if not child.is_dir() or child.is_symlink())
+
+
+def _entry_last_used(path):
+    stat = path.lstat()
+    return max(stat.st_atime, stat.st_mtime)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ArtifactStore:
+    """
+    References held by running jobs, and the size-capped LRU collector of intermediates.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = str(db_path or os.getenv('VCC_ARTIFACT_DB', DEFAULT_DB_PATH))
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def acquire(self, job_id, root):
+        """
+        Records that this process uses the workspace at root, so it is never collected.
+        """
+        with closing(self._connect()) as connection:
+            connection.execute('INSERT OR REPLACE INTO refs (job_id, root, host, pid, acquired) VALUES (?, ?, ?, ?, ?)',
+                               (job_id, str(Path(root).resolve()), socket.gethostname(), os.getpid(), time.time()))
+
+    def release(self, job_id):
+        with closing(self._connect()) as connection:
+            connection.execute('DELETE FROM refs WHERE job_id = ? AND host = ? AND pid = ?',
+                               (job_id, socket.gethostname(), os.getpid()))
+
+    def referenced_roots(self):
+        """
+        Returns the workspace roots referenced by live jobs, and drops references of dead processes.
+        """
+        host = socket.gethostname()
+        now = time.time()
+        roots = set()
+        with closing(self._connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            for job_id, root, ref_host, pid, acquired in connection.execute(
+                    'SELECT job_id, root, host, pid, acquired FROM refs').fetchall():
+                if (ref_host == host and not _pid_alive(pid)) or now - acquired > STALE_REFERENCE_SECONDS:
+                    connection.execute('DELETE FROM refs WHERE job_id = ? AND host = ? AND pid = ?',
+                                       (job_id, ref_host, pid))
+                    continue
+                roots.add(root)
+            connection.execute('COMMIT')
+        return roots
+
+    def collect(self, max_size, workspace_roots):
+        """
+        Deletes unreferenced intermediates of the given workspaces, least recently used first,
+        until all intermediates fit in max_size bytes. Returns the number of bytes freed.
+        """
+        protected = set()
+        for root in self.referenced_roots():
+            protected.add(root)
+            scratch = scratch_dir(root)
+            if scratch is not None:
+                protected.add(str(scratch.resolve()))
+
+        entries = []
+        for root in workspace_roots:
+            locked = str(Path(root).resolve()) in protected
+            for folder in INTERMEDIATE_FOLDERS:
+                folder_path = Path(root) / folder
+                if not folder_path.is_dir():
+                    continue
+                for path in folder_path.iterdir():
+                    if path.name == '.partial':
+                        continue
+                    entries.append((locked, _entry_last_used(path), _entry_size(path), path))
+
+        total = sum(size for _, _, size, _ in entries)
+        freed = 0
+        for locked, _, size, path in sorted(entries, key=lambda entry: entry[1]):
+            if total - freed <= max_size:
+                break
+            if locked:
+                continue
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+            freed += size
+            logging.debug(f"Collected {path} ({size} bytes)")
+        if freed:
+            logging.info(f"Artifact store: freed {freed / 1024 ** 2:.1f} MiB, "
+                         f"{(total - freed) / 1024 ** 2:.1f} MiB of intermediates left")
+        return freed
+
+
+def workspace_roots(jobs_root=DEFAULT_JOBS_ROOT, extra_roots=()):
+    """
+    Returns the workspaces the collector looks at: the classic workspace in the current
+    directory, every job under jobs_root, every scratch folder and extra_roots.
+    """
+    roots = [Path('.'), *map(Path, extra_roots)]
+    for parent in (Path(jobs_root), scratch_root()):
+        if parent is not None and parent.is_dir():
+            roots.extend(path for path in parent.iterdir() if path.is_dir())
+    return list(dict.fromkeys(root.resolve() for root in roots))
+
+
+def remove_intermediates(root):
+    """
+    Deletes every intermediate of the workspace at root and of its scratch folder.
+    """
+    for base in (Path(root), scratch_dir(root)):
+        if base is None:
+            continue
+        for folder in INTERMEDIATE_FOLDERS:
+            folder_path = base / folder
+            if folder_path.is_dir():
+                for path in folder_path.iterdir():
+                    if path.is_dir() and not path.is_symlink():
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        path.unlink(missing_ok=True)
+                    logging.info(f"Deleted: {path}")
+
+
+@contextmanager
+def job_reference(workspace, store=None):
+    """
+    Holds a reference to the workspace while the block runs. Afterwards, the intermediates of
+    all workspaces are collected down to the size cap, if one is configured.
+    """
+    store = store or ArtifactStore()
+    store.acquire(workspace.job_id, workspace.root)
+    try:
+        yield store
+    finally:
+        store.release(workspace.job_id)
+        max_size = default_max_size()
+        if max_size is not None:
+            try:
+                store.collect(max_size, workspace_roots(extra_roots=[workspace.root]))
+            except OSError as e:
+                logging.warning(f"Artifact collection failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scratch space and garbage collection for intermediates")
+    parser.add_argument('--db', default=None, help="Reference database (default VCC_ARTIFACT_DB)")
+    parser.add_argument('--jobs-root', default=DEFAULT_JOBS_ROOT)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gc_parser = subparsers.add_parser('gc', help="Delete unreferenced intermediates down to a size cap")
+    gc_parser.add_argument('--max-size', default=None, help="Size cap such as 20G (default VCC_ARTIFACT_MAX_SIZE)")
+
+    subparsers.add_parser('status', help="Show the size of the intermediates and the referenced workspaces")
+
+    args = parser.parse_args()
+    store = ArtifactStore(args.db)
+    roots = workspace_roots(args.jobs_root)
+
+    if args.command == 'gc':
+        max_size = parse_size(args.max_size) if args.max_size else default_max_size()
+        if max_size is None:
+            parser.error("Set --max-size or VCC_ARTIFACT_MAX_SIZE")
+        store.collect(max_size, roots)
+    else:
+        total = sum(_entry_size(path) for root in roots for folder in INTERMEDIATE_FOLDERS
+                    if (root / folder).is_dir() for path in (root / folder).iterdir())
+        print(f"intermediates  {total / 1024 ** 2:.1f} MiB in {len(roots)} workspaces")
+        for root in sorted(store.referenced_roots()):
+            print(f"referenced     {root}")
+
+
+if __name__ == "__main__":
+    main()
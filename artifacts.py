@@ -0,0 +1,156 @@
+"""
+Artifact readiness for handoffs between stages.
+
+Producers write each artifact to a hidden `.partial` folder next to its final path and
+rename it into place once complete (`atomic_path`, `atomic_write_text`). Because the rename
+is atomic, a file that exists at its final path is always complete.
+
+Consumers in the same process wait on a future that is resolved the instant the artifact
+is committed (`artifact_future`, `wait_for_artifact`). Artifacts committed by other
+processes are picked up by a cheap existence check between waits.
+"""
+
+# Standard library imports
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+
+# Third party imports
+
+# Local application imports
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PARTIAL_DIR_NAME = '.partial'
+# Seconds a consumer waits for an artifact before giving up
+DEFAULT_WAIT_TIMEOUT = 600
+
+_futures = {}
+_futures_lock = threading.Lock()
+
+
+def _key(path):
+    return os.path.abspath(path)
+
+
+def _resolve(future, key):
+    try:
+        future.set_result(key)
+    except InvalidStateError:
+        pass
+
+
+def artifact_future(path):
+    """
+    Returns a Future resolved with the artifact's absolute path once it has been committed.
+    """
+    key = _key(path)
+    with _futures_lock:
+        future = _futures.get(key)
+        if future is None:
+            future = Future()
+            _futures[key] = future
+    if os.path.exists(key):
+        mark_ready(key)
+    return future
+
+
+def _discard(key, future):
+    """
+    Forgets the future of an artifact nobody committed, so abandoned waits do not pile up.
+    """
+    with _futures_lock:
+        if _futures.get(key) is future:
+            del _futures[key]
+
+
+def mark_ready(path):
+    """
+    Resolves the futures waiting on an artifact. Called automatically by `atomic_path`.
+    """
+    key = _key(path)
+    with _futures_lock:
+        future = _futures.pop(key, None)
+    if future is not None:
+        _resolve(future, key)
+
+
+def wait_for_artifact(path, timeout=DEFAULT_WAIT_TIMEOUT, poll_interval=0.05):
+    """
+    Blocks until the artifact at path has been committed. Returns True when it is ready,
+    or False if the timeout (in seconds, None to wait indefinitely) expires first.
+    """
+    future = artifact_future(path)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait = poll_interval
+        if deadline is not None:
+            wait = min(wait, deadline - time.monotonic())
+            if wait <= 0:
+                logging.warning(f"Gave up waiting for {path} after {timeout:g}s")
+                _discard(_key(path), future)
+                return False
+        try:
+            future.result(timeout=wait)
+            return True
+        except FutureTimeoutError:
+            # Committed by another process
+            if os.path.exists(path):
+                mark_ready(path)
+                return True
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yields a temporary path with the same file name as `path`, inside a hidden `.partial`
+    folder on the same filesystem. When the block exits without error the temporary file is
+    renamed onto `path` and waiting consumers are woken; on error it is discarded.
+
+    The temporary path may also be made a directory. A directory already at `path` is moved
+    aside just before the rename and removed afterwards.
+    """
+    final_path = Path(path)
+    partial_dir = final_path.parent / PARTIAL_DIR_NAME / uuid.uuid4().hex
+    partial_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = partial_dir / final_path.name
+    try:
+        yield tmp_path
+        if not tmp_path.exists():
+            raise FileNotFoundError(f"Artifact was not written: {tmp_path}")
+        if tmp_path.is_dir() and final_path.is_dir():
+            os.replace(final_path, partial_dir / f"{final_path.name}.old")
+        os.replace(tmp_path, final_path)
+    finally:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        try:
+            partial_dir.parent.rmdir()
+        except OSError:
+            pass  # Another artifact is still being written
+    mark_ready(final_path)
+    logging.debug(f"Artifact committed: {final_path}")
+
+
+def atomic_write_text(path, text, encoding='utf-8'):
+    """
+    Writes text to path atomically and marks it ready.
+    """
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, 'w', encoding=encoding) as file:
+            file.write(text)
+    return str(path)
+
+
+def source_key(path):
+    """
+    Identifies the current version of a source file for caches derived from it.
+    """
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
@@ -0,0 +1,114 @@
+"""
+Bounded-memory audio streaming for transcription.
+
+Whisper's `model.transcribe(path)` decodes the whole audio track into one float32 array
+(over 600 MB for a 3-hour source). `stream_audio` instead reads 16 kHz mono PCM from an
+ffmpeg pipe on a background thread and hands out chunks of at most a few minutes through a
+bounded queue, so peak memory per job stays flat regardless of input length. Chunks are cut
+at the quietest point near their end, so words are not split between chunks.
+"""
+
+# Standard library imports
+import queue
+import logging
+import threading
+import subprocess
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SAMPLE_RATE = 16000
+CHUNK_SECONDS = 120
+# The chunk is cut at the quietest 100 ms within this many seconds of its end
+SPLIT_SEARCH_SECONDS = 5
+SPLIT_FRAME_SAMPLES = SAMPLE_RATE // 10
+# Chunks decoded ahead of the consumer
+QUEUE_CHUNKS = 2
+
+_END = object()
+
+
+def quiet_split(samples):
+    """
+    Returns the index of the quietest SPLIT_FRAME_SAMPLES frame start within the last
+    SPLIT_SEARCH_SECONDS of samples.
+    """
+    search = min(len(samples), SPLIT_SEARCH_SECONDS * SAMPLE_RATE)
+    frames = search // SPLIT_FRAME_SAMPLES
+    if frames < 2:
+        return len(samples)
+    tail = samples[len(samples) - frames * SPLIT_FRAME_SAMPLES:].reshape(frames, SPLIT_FRAME_SAMPLES)
+    quietest = int(np.argmin(np.mean(tail ** 2, axis=1)))
+    return len(samples) - (frames - quietest) * SPLIT_FRAME_SAMPLES + SPLIT_FRAME_SAMPLES // 2
+
+
+def _read_chunks(process, chunk_seconds, chunks, start=0.0):
+    chunk_bytes = chunk_seconds * SAMPLE_RATE * 2
+    carry = np.zeros(0, dtype=np.float32)
+    offset = int(start * SAMPLE_RATE)
+    try:
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            data = data[:len(data) - len(data) % 2]
+            samples = np.concatenate([carry, np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0])
+            # Hold the tail back until the next read, unless the stream ended
+            split = quiet_split(samples) if len(data) == chunk_bytes else len(samples)
+            chunks.put((offset / SAMPLE_RATE, samples[:split]))
+            offset += split
+            carry = samples[split:]
+        if len(carry):
+            chunks.put((offset / SAMPLE_RATE, carry))
+    except Exception as e:  # pylint: disable=broad-except
+        chunks.put(e)
+    finally:
+        chunks.put(_END)
+
+
+def stream_audio(path, chunk_seconds=CHUNK_SECONDS, queue_chunks=QUEUE_CHUNKS, start=None, duration=None):
+    """
+    Yields (offset_seconds, samples) chunks of the audio of path as 16 kHz mono float32 arrays,
+    the format Whisper expects. At most queue_chunks chunks are decoded ahead of the consumer.
+    With start and/or duration, only that range is read; offsets stay relative to the file.
+    """
+    cmd = ['ffmpeg', '-v', 'error', '-nostdin']
+    if start:
+        cmd += ['-ss', f"{start:.3f}"]
+    if duration is not None:
+        cmd += ['-t', f"{duration:.3f}"]
+    cmd += [
+        '-i', str(path),
+        '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE),
+        '-f', 's16le', '-',
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    chunks = queue.Queue(maxsize=queue_chunks)
+    reader = threading.Thread(target=_read_chunks, args=(process, chunk_seconds, chunks, start or 0.0),
+                              daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if process.poll() is None:
+            process.kill()
+        # Unblock the reader if the consumer stopped early
+        while reader.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        process.wait()
+    if process.returncode not in (0, -9):
+        raise subprocess.CalledProcessError(process.returncode, cmd)
@@ -0,0 +1,206 @@
+"""
+Batched Whisper inference across files.
+
+`model.transcribe` runs one 30 s mel window per forward pass. Here 30 s windows from many files
+(or many parts of one long file) are stacked into batches, so every encoder and decoder pass
+works on batch_size windows at once. The timestamp tokens of each result are parsed into
+segments, which are routed back to the file they came from. Results have the same shape as
+`model.transcribe`.
+
+Windows are cut at the quietest point near their 30 s limit instead of continuing from the
+last decoded timestamp the way `model.transcribe` does. Every window can then be decoded
+independently.
+
+    python batch_transcribe.py --output whisper_output --batch-size 8 input_files/*.mp4
+"""
+
+# Standard library imports
+import logging
+import argparse
+
+# Third party imports (numpy, torch and whisper are imported when a batch runs)
+
+# Local application imports
+import transcription_engines
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_BATCH_SIZE = 8
+WINDOW_SECONDS = 30
+# Seconds per timestamp token
+TIMESTAMP_RESOLUTION = 0.02
+# Same fallback rules as whisper.transcribe
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+
+def iter_windows(files):
+    """
+    Yields (file_index, offset_seconds, samples) windows of at most WINDOW_SECONDS, cut at the
+    quietest point near the limit, streaming each file through `audio_stream`.
+    """
+    import numpy as np
+    from audio_stream import SAMPLE_RATE, stream_audio, quiet_split
+
+    window_samples = WINDOW_SECONDS * SAMPLE_RATE
+    for file_index, file in enumerate(files):
+        for chunk_offset, samples in stream_audio(file):
+            position = 0
+            while position < len(samples):
+                window = samples[position:position + window_samples]
+                if len(window) == window_samples and position + window_samples < len(samples):
+                    window = window[:quiet_split(window)]
+                yield file_index, chunk_offset + position / SAMPLE_RATE, np.ascontiguousarray(window)
+                position += len(window)
+
+
+def parse_segments(tokens, tokenizer, offset, window_seconds):
+    """
+    Splits decoded tokens at their timestamp tokens into result segments, shifted by offset.
+    Text after the last timestamp is closed at the end of the window.
+    """
+    segments = []
+    start = None
+    text_tokens = []
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            time = (token - tokenizer.timestamp_begin) * TIMESTAMP_RESOLUTION
+            if start is not None and text_tokens:
+                segments.append((start, time, text_tokens))
+                start, text_tokens = None, []
+            else:
+                start = time
+        elif token < tokenizer.eot:
+            text_tokens.append(token)
+    if text_tokens:
+        segments.append((start or 0.0, window_seconds, text_tokens))
+
+    return [{
+        "seek": int(offset * 100),
+        "start": offset + segment_start,
+        "end": offset + min(segment_end, window_seconds),
+        "text": tokenizer.decode(segment_tokens),
+        "tokens": segment_tokens,
+    } for segment_start, segment_end, segment_tokens in segments]
+
+
+class BatchTranscriber:
+    """
+    Transcribes many files with one openai-whisper engine, batch_size windows per pass.
+    """
+
+    def __init__(self, engine, batch_size=DEFAULT_BATCH_SIZE, language="en", word_timestamps=False):
+        if not isinstance(engine, transcription_engines.WhisperEngine):
+            raise ValueError(f"Batched inference needs an openai-whisper engine, not {engine.name}")
+        self.engine = engine
+        self.batch_size = batch_size
+        self.language = language
+        self.word_timestamps = word_timestamps
+
+    def _decode(self, model, windows, temperature):
+        import torch
+        import whisper
+
+        mel = torch.stack([whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(samples)),
+                                                       n_mels=model.dims.n_mels)
+                           for _, _, samples in windows]).to(model.device)
+        options = whisper.DecodingOptions(language=self.language, temperature=temperature,
+                                          without_timestamps=False,
+                                          fp16=self.engine.decode_options().get("fp16", False))
+        return whisper.decode(model, mel, options)
+
+    def _decode_with_fallback(self, model, windows):
+        """
+        Decodes a batch greedily, re-decoding only the windows that fail whisper's quality
+        checks at increasing temperatures.
+        """
+        results = [None] * len(windows)
+        pending = list(range(len(windows)))
+        for temperature in TEMPERATURES:
+            decoded = self._decode(model, [windows[index] for index in pending], temperature)
+            retry = []
+            for index, result in zip(pending, decoded):
+                results[index] = result
+                failed = (result.compression_ratio > COMPRESSION_RATIO_THRESHOLD
+                          or result.avg_logprob < LOGPROB_THRESHOLD)
+                silent = result.no_speech_prob > NO_SPEECH_THRESHOLD
+                if failed and not silent:
+                    retry.append(index)
+            if not retry:
+                break
+            pending = retry
+        return results
+
+    def _add_word_timestamps(self, model, tokenizer, samples, segments):
+        """
+        Aligns the words of one window's segments with whisper's cross-attention timing.
+        """
+        import torch
+        import whisper
+        from whisper.timing import add_word_timestamps
+
+        mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(samples)),
+                                          n_mels=model.dims.n_mels).to(model.device)
+        add_word_timestamps(segments=segments, model=model, tokenizer=tokenizer, mel=mel,
+                            num_frames=len(samples) // whisper.audio.HOP_LENGTH)
+
+    def _process(self, model, tokenizer, windows, file_segments):
+        from audio_stream import SAMPLE_RATE
+
+        for (file_index, offset, samples), result in zip(windows, self._decode_with_fallback(model, windows)):
+            if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+                continue
+            segments = parse_segments(result.tokens, tokenizer, offset, len(samples) / SAMPLE_RATE)
+            if self.word_timestamps and segments:
+                self._add_word_timestamps(model, tokenizer, samples, segments)
+            file_segments[file_index].extend(segments)
+
+    def transcribe_files(self, files):
+        """
+        Returns one `model.transcribe`-shaped result per file, in the order of files.
+        """
+        from whisper.tokenizer import get_tokenizer
+
+        model = self.engine.model
+        tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                                  language=self.language, task="transcribe")
+        file_segments = [[] for _ in files]
+        with self.engine.transcribe_lock:
+            batch = []
+            for window in iter_windows(files):
+                batch.append(window)
+                if len(batch) == self.batch_size:
+                    self._process(model, tokenizer, batch, file_segments)
+                    batch = []
+            if batch:
+                self._process(model, tokenizer, batch, file_segments)
+
+        results = []
+        for segments in file_segments:
+            segments = [dict(segment, id=index) for index, segment in enumerate(segments)]
+            results.append({"text": "".join(segment["text"] for segment in segments),
+                            "segments": segments, "language": self.language})
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe many files with batched Whisper inference.")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--output', default='whisper_output', help="Folder for the .txt and .srt transcripts")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--model', default=transcription_engines.DEFAULT_MODEL)
+    parser.add_argument('--language', default="en")
+    args = parser.parse_args()
+
+    from local_transcribe import transcribe_batch
+
+    for file, (transcript, _) in transcribe_batch(args.files, args.output, args.batch_size, args.model,
+                                                          args.language).items():
+        logging.info(f"Transcribed {file}: {len(transcript)} characters")
+
+
+if __name__ == "__main__":
+    main()
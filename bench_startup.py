@@ -0,0 +1,90 @@
+"""
+Startup-time guard for the CLI.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter, then fails if importing
+`app` takes longer than the budget or pulls in any heavy dependency that should only load
+when its stage runs.
+"""
+
+# Standard library imports
+import os
+import re
+import sys
+import argparse
+import subprocess
+import logging
+
+# Third party imports
+
+# Local application imports
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_BUDGET_MS = 500
+
+# Modules that must not be imported just to start the CLI
+HEAVY_MODULES = [
+    'torch',
+    'whisper',
+    'crewai',
+    'langchain',
+    'langchain_core',
+    'langchain_google_genai',
+    'openai',
+    'yt_dlp',
+    'youtube_transcript_api',
+]
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure_imports(module='app'):
+    """
+    Returns {module name: cumulative import time in microseconds} for a fresh `import module`.
+    """
+    env = dict(os.environ)
+    # Importing must not depend on API keys or network access
+    env.setdefault('LLM_BACKEND', 'replay')
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                               capture_output=True, text=True, check=False)
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+
+    imports = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            imports[match.group(4)] = int(match.group(2))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the CLI starts within its import-time budget.")
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('STARTUP_BUDGET_MS', str(DEFAULT_BUDGET_MS))),
+                        help="Maximum cumulative import time of app.py in milliseconds")
+    parser.add_argument('--top', type=int, default=10, help="Number of slowest imports to report")
+    args = parser.parse_args()
+
+    imports = measure_imports('app')
+    total_ms = imports.get('app', 0) / 1000
+
+    logging.info(f"import app: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    for name, cumulative in sorted(imports.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        logging.info(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    heavy = sorted(name for name in imports if name.split('.')[0] in HEAVY_MODULES)
+    failed = False
+    if heavy:
+        logging.error(f"Heavy modules imported at startup: {', '.join(heavy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        logging.error(f"Startup import time {total_ms:.1f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Speed and accuracy benchmark of the transcription engines.
+
+Transcribes every sample in the samples folder (audio or video files, each with a reference
+transcript `<name>.txt` next to it) with each engine, then reports the model load time, the
+real-time factor (processing seconds per audio second) and the word error rate against the
+references.
+
+The repository ships the reference transcripts of public-domain samples (see PUBLIC_SAMPLES) but
+not their audio; fetch it once with:
+
+    python bench_transcribe.py --fetch
+"""
+
+# Standard library imports
+import re
+import time
+import logging
+import argparse
+import urllib.request
+from pathlib import Path
+
+# Third party imports
+
+# Local application imports
+import media_info
+import transcription_engines
+from artifacts import atomic_path
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_SAMPLES_DIR = 'samples'
+SAMPLE_EXTENSIONS = ('.mp4', '.wav', '.mp3', '.m4a', '.flac')
+# Public-domain speech whose reference transcript is in samples/: {file name: download URL}
+PUBLIC_SAMPLES = {
+    # John F. Kennedy, inaugural address (1961), 11 s, 16 kHz mono; the sample whisper.cpp uses
+    'jfk.wav': 'https://github.com/ggml-org/whisper.cpp/raw/master/samples/jfk.wav',
+}
+
+
+def normalize_words(text):
+    return re.sub(r"[^a-z0-9' ]+", ' ', text.lower()).split()
+
+
+def word_error_rate(reference, hypothesis):
+    """
+    Returns the word-level edit distance between two texts divided by the reference length.
+    """
+    reference_words, hypothesis_words = normalize_words(reference), normalize_words(hypothesis)
+    if not reference_words:
+        return 0.0 if not hypothesis_words else 1.0
+    previous = list(range(len(hypothesis_words) + 1))
+    for i, reference_word in enumerate(reference_words, 1):
+        current = [i]
+        for j, hypothesis_word in enumerate(hypothesis_words, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (reference_word != hypothesis_word)))
+        previous = current
+    return previous[-1] / len(reference_words)
+
+
+def find_samples(samples_dir):
+    """
+    Returns (media file, reference text) pairs for the samples that have a reference transcript.
+    """
+    samples = []
+    for media_file in sorted(Path(samples_dir).iterdir()):
+        if media_file.suffix.lower() not in SAMPLE_EXTENSIONS:
+            continue
+        reference_file = media_file.with_suffix('.txt')
+        if not reference_file.exists():
+            logging.warning(f"Skipping {media_file.name}: no reference transcript {reference_file.name}")
+            continue
+        samples.append((media_file, reference_file.read_text(encoding='utf-8')))
+    return samples
+
+
+def fetch_samples(samples_dir):
+    """
+    Downloads the audio of the PUBLIC_SAMPLES that are not in samples_dir yet.
+    """
+    for name, url in PUBLIC_SAMPLES.items():
+        path = Path(samples_dir) / name
+        if path.exists():
+            continue
+        logging.info(f"Downloading {url}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_path(path) as partial_path:
+            urllib.request.urlretrieve(url, partial_path)
+
+
+def benchmark_engine(name, model_name, samples):
+    """
+    Returns the benchmark row of one engine, or None if it is not available on this host.
+    """
+    engine = transcription_engines.get_engine(name, model_name)
+    load_started = time.perf_counter()
+    try:
+        engine.load()
+    except ImportError as e:
+        logging.warning(f"Skipping {name}: {e}")
+        return None
+    load_seconds = time.perf_counter() - load_started
+
+    audio_seconds = processing_seconds = 0.0
+    errors = []
+    for media_file, reference in samples:
+        started = time.perf_counter()
+        result = engine.transcribe(media_file, language="en")
+        elapsed = time.perf_counter() - started
+        duration = media_info.duration(media_file) or 0.0
+        wer = word_error_rate(reference, result["text"])
+        logging.info(f"{name} {media_file.name}: {elapsed:.1f}s for {duration:.1f}s of audio, WER {wer:.1%}")
+        audio_seconds += duration
+        processing_seconds += elapsed
+        errors.append(wer)
+
+    return {
+        'engine': name,
+        'load_seconds': load_seconds,
+        'rtf': processing_seconds / audio_seconds if audio_seconds else float('nan'),
+        'wer': sum(errors) / len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare transcription engines on speed and word error rate.")
+    parser.add_argument('--samples', default=DEFAULT_SAMPLES_DIR, help="Folder of samples with <name>.txt references")
+    parser.add_argument('--engines', default=','.join(transcription_engines.ENGINES),
+                        help="Comma-separated engines to compare")
+    parser.add_argument('--model', default=transcription_engines.DEFAULT_MODEL)
+    parser.add_argument('--fetch', action='store_true', help="Download the public-domain sample audio first")
+    args = parser.parse_args()
+
+    if args.fetch:
+        fetch_samples(args.samples)
+    samples = find_samples(args.samples)
+    if not samples:
+        parser.error(f"No samples with reference transcripts found in {args.samples} (try --fetch)")
+
+    rows = [benchmark_engine(name.strip(), args.model, samples) for name in args.engines.split(',') if name.strip()]
+
+    print(f"{'engine':16} {'load s':>8} {'RTF':>8} {'WER':>8}")
+    for row in filter(None, rows):
+        print(f"{row['engine']:16} {row['load_seconds']:8.1f} {row['rtf']:8.3f} {row['wer']:8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Snapping of clip boundaries to pauses and scene cuts.
+
+Each source's audio is decoded once to mono PCM and reduced to an RMS envelope (one value
+per 10 ms) that is cached as a .npy file next to the analysis proxy. Refining a clip then
+only slices the memory-mapped envelope around its start and end, so it costs milliseconds
+and never decodes the source again.
+"""
+
+# Standard library imports
+import json
+import logging
+import subprocess
+from pathlib import Path
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from artifacts import atomic_path, source_key
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SAMPLE_RATE = 16000
+HOP_SAMPLES = 160  # 10 ms per envelope value
+ENVELOPE_RATE = SAMPLE_RATE / HOP_SAMPLES
+READ_HOPS = 6000  # one minute of audio per read from ffmpeg
+
+# A frame is quiet below this fraction of the source's median loudness
+QUIET_RATIO = 0.1
+# Shortest pause worth cutting in
+MIN_GAP_SECONDS = 0.15
+# Seconds of a pause kept before the first word or after the last one
+LEAD_SECONDS = 0.2
+# How far a boundary may move outwards (extending the clip) and inwards (into the clip)
+DEFAULT_TOLERANCE = 1.5
+INSIDE_TOLERANCE = 0.3
+
+
+class Envelope:
+    def __init__(self, rms, quiet_threshold):
+        self.rms = rms
+        self.quiet_threshold = quiet_threshold
+
+    def quiet_gaps(self, start, end, min_gap=MIN_GAP_SECONDS):
+        """
+        Returns the (gap_start, gap_end) pauses of at least min_gap seconds within [start, end).
+        """
+        first = max(0, int(start * ENVELOPE_RATE))
+        last = min(len(self.rms), int(np.ceil(end * ENVELOPE_RATE)))
+        if last <= first:
+            return []
+        quiet = (np.asarray(self.rms[first:last]) < self.quiet_threshold).astype(np.int8)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], quiet, [0]))))
+        return [((first + run_start) / ENVELOPE_RATE, (first + run_end) / ENVELOPE_RATE)
+                for run_start, run_end in edges.reshape(-1, 2)
+                if (run_end - run_start) / ENVELOPE_RATE >= min_gap]
+
+
+def _envelope_paths(input_video, cache_dir):
+    stem = Path(input_video).stem
+    return Path(cache_dir) / f"{stem}.rms.npy", Path(cache_dir) / f"{stem}.rms.json"
+
+
+def cached_envelope(input_video, cache_dir):
+    """
+    Returns the Envelope of input_video cached in cache_dir, or None if there is no cached
+    envelope of the current source file. Never decodes any audio.
+    """
+    rms_path, meta_path = _envelope_paths(input_video, cache_dir)
+    if not (meta_path.exists() and rms_path.exists()):
+        return None
+    with open(meta_path, 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    if meta['source'] != source_key(input_video):
+        return None
+    return load_envelope(rms_path, meta)
+
+
+def build_envelope(input_video, cache_dir):
+    """
+    Decodes the audio of input_video once into an RMS envelope cached in cache_dir and returns it
+    as an Envelope. The envelope is reused as long as the source file is unchanged.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    envelope = cached_envelope(input_video, cache_dir)
+    if envelope is not None:
+        return envelope
+    rms_path, meta_path = _envelope_paths(input_video, cache_dir)
+    key = source_key(input_video)
+
+    logging.info(f"Building audio envelope for {input_video}")
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-i', str(input_video),
+        '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE),
+        '-f', 's16le', '-',
+    ]
+    chunks = []
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as process:
+        remainder = b''
+        while True:
+            data = process.stdout.read(READ_HOPS * HOP_SAMPLES * 2)
+            if not data:
+                break
+            data = remainder + data
+            usable = len(data) - len(data) % (HOP_SAMPLES * 2)
+            remainder = data[usable:]
+            samples = np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32) / 32768.0
+            chunks.append(np.sqrt(np.mean(samples.reshape(-1, HOP_SAMPLES) ** 2, axis=1)))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+
+    rms = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+    voiced = rms[rms > 0]
+    meta = {'source': key, 'rate': ENVELOPE_RATE,
+            'quiet_threshold': float(np.median(voiced) * QUIET_RATIO) if len(voiced) else 0.0}
+    with atomic_path(rms_path) as partial_rms_path:
+        with open(partial_rms_path, 'wb') as file:
+            np.save(file, rms.astype(np.float32))
+    with atomic_path(meta_path) as partial_meta_path:
+        with open(partial_meta_path, 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+    return load_envelope(rms_path, meta)
+
+
+def load_envelope(rms_path, meta):
+    return Envelope(np.load(rms_path, mmap_mode='r'), meta['quiet_threshold'])
+
+
+def _snap(time, candidates, scene_cuts):
+    """
+    Picks the candidate closest to time, preferring scene cuts inside a pause, then pauses,
+    then bare scene cuts. candidates are (point, gap) pairs; gap is None for bare cuts.
+    """
+    def rank(candidate):
+        point, gap = candidate
+        if gap is None:
+            priority = 2
+        elif any(gap[0] <= cut <= gap[1] for cut in scene_cuts):
+            priority = 0
+        else:
+            priority = 1
+        return priority, abs(point - time)
+
+    if not candidates:
+        return time
+    point, gap = min(candidates, key=rank)
+    if gap is not None:
+        # Cut on the scene change when there is one in the pause
+        cuts = [cut for cut in scene_cuts if gap[0] <= cut <= gap[1]]
+        if cuts:
+            point = min(cuts, key=lambda cut: abs(cut - point))
+    return point
+
+
+def snap_start(envelope, time, scene_cuts=(), tolerance=DEFAULT_TOLERANCE):
+    """
+    Moves a clip start into the nearest pause (keeping LEAD_SECONDS before the first word)
+    or onto a scene cut, at most tolerance seconds earlier or INSIDE_TOLERANCE seconds later.
+    """
+    window_start, window_end = max(0.0, time - tolerance), time + INSIDE_TOLERANCE
+    candidates = [(max(gap_start, gap_end - LEAD_SECONDS), (gap_start, gap_end))
+                  for gap_start, gap_end in envelope.quiet_gaps(window_start, window_end)]
+    candidates += [(cut, None) for cut in scene_cuts if window_start <= cut <= window_end]
+    return _snap(time, candidates, scene_cuts)
+
+
+def snap_end(envelope, time, scene_cuts=(), tolerance=DEFAULT_TOLERANCE):
+    """
+    Moves a clip end into the nearest pause (keeping LEAD_SECONDS after the last word)
+    or onto a scene cut, at most tolerance seconds later or INSIDE_TOLERANCE seconds earlier.
+    """
+    window_start, window_end = max(0.0, time - INSIDE_TOLERANCE), time + tolerance
+    candidates = [(min(gap_end, gap_start + LEAD_SECONDS), (gap_start, gap_end))
+                  for gap_start, gap_end in envelope.quiet_gaps(window_start, window_end)]
+    candidates += [(cut, None) for cut in scene_cuts if window_start <= cut <= window_end]
+    return _snap(time, candidates, scene_cuts)
+
+
+def refine_interval(envelope, start, end, scene_cuts=None, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns (start, end) of a clip snapped to pauses and/or scene cuts, or the original
+    interval if snapping would leave nothing.
+    """
+    scene_cuts = scene_cuts or []
+    refined_start = snap_start(envelope, start, scene_cuts, tolerance)
+    refined_end = snap_end(envelope, end, scene_cuts, tolerance)
+    if refined_end <= refined_start:
+        return start, end
+    return float(refined_start), float(refined_end)
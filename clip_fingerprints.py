@@ -0,0 +1,286 @@
+"""
+Near-duplicate clip suppression across runs and sources.
+
+Every rendered clip is recorded in a host-wide SQLite store with two fingerprints:
+
+- a MinHash signature of the word shingles of its subtitles, indexed with LSH bands, so
+  clips with mostly the same text are found without comparing against every stored clip;
+- a coarse audio fingerprint: the rise/fall pattern of the loudness of the clip in
+  half-second bins, taken from the RMS envelope cached by `boundaries`.
+
+Before clipping, each candidate is looked up in the store. A candidate is a duplicate when its
+text is similar enough to a stored clip and, if both have one, its audio fingerprint matches
+too. This way the same quote in two different recordings still gets rendered. The stored clip
+must also have outputs in every render profile the new job asks for, so a clip rendered as 9:16
+is not reused for a 1:1 job. Duplicates are not encoded again. Their existing outputs are
+linked into the new job instead.
+
+    python clip_fingerprints.py stats
+"""
+
+# Standard library imports
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from contextlib import closing
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'viral-clips-crew', 'fingerprints.db')
+
+SHINGLE_WORDS = 3
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+# Minimum estimated Jaccard similarity of the shingles for a duplicate
+TEXT_THRESHOLD = 0.7
+
+AUDIO_BIN_SECONDS = 0.5
+# Bins the audio fingerprints may be offset by, e.g. after boundary snapping
+AUDIO_MAX_SHIFT = 4
+# Minimum fraction of matching rise/fall bits for a duplicate
+AUDIO_THRESHOLD = 0.8
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+SRT_TIMING_LINE = re.compile(r'^\d+$|-->')
+
+# Multiply-add hashing modulo 2**64 with odd multipliers: one bijective permutation per row
+_permutation_rng = np.random.default_rng(20240601)
+_UINT64_MAX = np.iinfo(np.uint64).max
+PERMUTATION_A = _permutation_rng.integers(0, _UINT64_MAX, NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+PERMUTATION_B = _permutation_rng.integers(0, _UINT64_MAX, NUM_PERMUTATIONS, dtype=np.uint64)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    base_name TEXT NOT NULL,
+    start REAL,
+    end REAL,
+    signature BLOB NOT NULL,
+    audio BLOB,
+    audio_bits INTEGER,
+    -- JSON {render profile: output path}
+    outputs TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clip_bands (
+    band INTEGER NOT NULL,
+    hash INTEGER NOT NULL,
+    clip_id INTEGER NOT NULL REFERENCES clips (id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS clip_bands_lookup ON clip_bands (band, hash);
+"""
+
+
+def store_path():
+    return os.getenv('VCC_FINGERPRINTS', DEFAULT_STORE_PATH)
+
+
+def srt_text(srt_content):
+    """
+    Returns the spoken text of an SRT document, without cue numbers and timings.
+    """
+    return ' '.join(line.strip() for line in srt_content.splitlines()
+                    if line.strip() and not SRT_TIMING_LINE.search(line.strip()))
+
+
+def minhash(text):
+    """
+    Returns the MinHash signature (NUM_PERMUTATIONS uint64 values) of the word shingles of text.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    shingles = {' '.join(words[index:index + SHINGLE_WORDS])
+                for index in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+                       for shingle in shingles], dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        permuted = np.outer(hashes, PERMUTATION_A) + PERMUTATION_B
+    return permuted.min(axis=0)
+
+
+def text_similarity(signature, other):
+    """
+    Estimated Jaccard similarity of the shingles behind two MinHash signatures.
+    """
+    return float(np.mean(signature == other))
+
+
+def band_hashes(signature):
+    return [int.from_bytes(hashlib.blake2b(signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes(),
+                                           digest_size=8).digest(), 'big', signed=True)
+            for band in range(LSH_BANDS)]
+
+
+def audio_fingerprint(envelope, start, end):
+    """
+    Returns the rise/fall bits of the loudness of [start, end) in AUDIO_BIN_SECONDS bins, from a
+    `boundaries.Envelope`, or None if the range holds too little audio.
+    """
+    from boundaries import ENVELOPE_RATE
+
+    bin_values = int(AUDIO_BIN_SECONDS * ENVELOPE_RATE)
+    first, last = int(start * ENVELOPE_RATE), min(len(envelope.rms), int(end * ENVELOPE_RATE))
+    bins = (last - first) // bin_values
+    if bins < 2 * AUDIO_MAX_SHIFT + 2:
+        return None
+    rms = np.asarray(envelope.rms[first:first + bins * bin_values], dtype=np.float32).reshape(bins, bin_values)
+    loudness = np.log(np.mean(rms, axis=1) + 1e-6)
+    return np.diff(loudness) > 0
+
+
+def audio_similarity(bits, other):
+    """
+    Fraction of matching bits of two audio fingerprints at their best offset.
+    """
+    best = 0.0
+    for shift in range(-AUDIO_MAX_SHIFT, AUDIO_MAX_SHIFT + 1):
+        first, second = (bits[shift:], other) if shift >= 0 else (bits, other[-shift:])
+        length = min(len(first), len(second))
+        if length:
+            best = max(best, float(np.mean(first[:length] == second[:length])))
+    return best
+
+
+def clip_fingerprint(srt_content, envelope=None, interval=None):
+    """
+    Returns the {'signature', 'audio'} fingerprint of a clip from its SRT and, when given, the
+    audio envelope of its source and its (start, end) interval.
+    """
+    audio = audio_fingerprint(envelope, *interval) if envelope is not None and interval else None
+    return {'signature': minhash(srt_text(srt_content)), 'audio': audio}
+
+
+def is_duplicate(fingerprint, other):
+    if text_similarity(fingerprint['signature'], other['signature']) < TEXT_THRESHOLD:
+        return False
+    if fingerprint['audio'] is not None and other['audio'] is not None:
+        return audio_similarity(fingerprint['audio'], other['audio']) >= AUDIO_THRESHOLD
+    return True
+
+
+class FingerprintStore:
+    """
+    Fingerprints of rendered clips in a SQLite database shared by every job on the host.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = str(db_path or store_path())
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA foreign_keys = ON')
+        return connection
+
+    @staticmethod
+    def _fingerprint(row):
+        audio = None
+        if row['audio'] is not None:
+            audio = np.unpackbits(np.frombuffer(row['audio'], dtype=np.uint8))[:row['audio_bits']].astype(bool)
+        return {'signature': np.frombuffer(row['signature'], dtype=np.uint64), 'audio': audio}
+
+    def find_duplicate(self, fingerprint, profiles):
+        """
+        Returns the stored clip that fingerprint duplicates and that has existing outputs in all
+        the given render profiles, as {'id', 'source', 'base_name', 'outputs'} with outputs
+        {profile: path} for those profiles, or None.
+        """
+        bands = band_hashes(fingerprint['signature'])
+        clauses = ' OR '.join('(band = ? AND hash = ?)' for _ in bands)
+        parameters = [value for band, band_hash in enumerate(bands) for value in (band, band_hash)]
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                f'SELECT * FROM clips WHERE id IN (SELECT clip_id FROM clip_bands WHERE {clauses}) '
+                'ORDER BY id DESC', parameters).fetchall()
+        for row in rows:
+            outputs = json.loads(row['outputs'])
+            # Clips recorded without their render profiles can't be matched to the requested ones
+            if not isinstance(outputs, dict):
+                continue
+            outputs = {profile: outputs.get(profile) for profile in profiles}
+            if not all(output and os.path.exists(output) for output in outputs.values()):
+                continue
+            if is_duplicate(fingerprint, self._fingerprint(row)):
+                return {'id': row['id'], 'source': row['source'], 'base_name': row['base_name'], 'outputs': outputs}
+        return None
+
+    def add(self, fingerprint, source, base_name, interval, outputs):
+        """
+        Records a rendered clip and its output files, {render profile: path}.
+        """
+        audio = fingerprint['audio']
+        with closing(self._connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            cursor = connection.execute(
+                'INSERT INTO clips (source, base_name, start, end, signature, audio, audio_bits, outputs, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (str(source), base_name, interval[0] if interval else None, interval[1] if interval else None,
+                 fingerprint['signature'].astype(np.uint64).tobytes(),
+                 np.packbits(audio).tobytes() if audio is not None else None,
+                 len(audio) if audio is not None else None,
+                 json.dumps({profile: str(output) for profile, output in outputs.items()}), time.time()))
+            connection.executemany('INSERT INTO clip_bands (band, hash, clip_id) VALUES (?, ?, ?)',
+                                   [(band, band_hash, cursor.lastrowid)
+                                    for band, band_hash in enumerate(band_hashes(fingerprint['signature']))])
+            connection.execute('COMMIT')
+            return cursor.lastrowid
+
+    def stats(self):
+        with closing(self._connect()) as connection:
+            return {'clips': connection.execute('SELECT COUNT(*) FROM clips').fetchone()[0]}
+
+
+def link_outputs(duplicate, targets):
+    """
+    Links the outputs of a stored duplicate (see `FingerprintStore.find_duplicate`) to targets,
+    {render profile: path} of the files the clip would have been rendered as, and returns the
+    new paths.
+    """
+    links = []
+    for profile, link in targets.items():
+        output = duplicate['outputs'][profile]
+        link = str(link)
+        os.makedirs(os.path.dirname(link) or '.', exist_ok=True)
+        if os.path.exists(link) and os.path.samefile(link, output):
+            links.append(link)
+            continue
+        if os.path.lexists(link):
+            os.remove(link)
+        try:
+            os.link(output, link)
+        except OSError:
+            # Different filesystem
+            os.symlink(os.path.abspath(output), link)
+        links.append(link)
+    return links
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the store of rendered clip fingerprints.")
+    parser.add_argument('--db', default=None, help="Fingerprint database (default: VCC_FINGERPRINTS)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help="Show the number of stored clips")
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        print(json.dumps(FingerprintStore(args.db).stats()))
+
+
+if __name__ == "__main__":
+    main()
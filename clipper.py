@@ -1,14 +1,22 @@
 # Standard library imports
 import os
+import json
 import warnings
 import re
 from datetime import datetime
 import glob
 import logging
+from contextlib import ExitStack
 
 # Third party imports
 import ffmpeg
 
+# Local application imports
+import media_info
+from artifacts import atomic_path, atomic_write_text
+from utils import seconds_to_srt_timestamp
+from workspace import default_workspace
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -23,15 +31,159 @@ def parse_timestamp(timestamp):
     return datetime.strptime(timestamp, '%H:%M:%S.%f')
 
 
+# Render profiles: target aspect ratio (None keeps the source framing) and the maximum output size.
+# Crops are centered and only ever scaled down, never up.
+RENDER_PROFILES = {
+    'original': {'aspect': None, 'max_size': None},
+    '1:1': {'aspect': (1, 1), 'max_size': (1080, 1080)},
+    '9:16': {'aspect': (9, 16), 'max_size': (1080, 1920)},
+    '16:9': {'aspect': (16, 9), 'max_size': (1920, 1080)},
+}
+
+# Menu choices offered by get_aspect_ratio_choice and the profiles they render
+ASPECT_RATIO_CHOICES = {
+    '1': ['original'],
+    '2': ['1:1'],
+    '3': ['9:16'],
+    '4': ['16:9'],
+    '5': ['9:16', '1:1', '16:9'],
+}
+
+# Clips outside these durations (in seconds) are skipped
+MIN_CLIP_SECONDS = 30
+MAX_CLIP_SECONDS = 150
+
+
 def get_aspect_ratio_choice():
     while True:
-        choice = input("Choose aspect ratio for all videos: (1) Keep as original, (2) 1:1 (square): ")
-        if choice in ['1', '2']:
+        choice = input("Choose aspect ratio for all videos: (1) Keep as original, (2) 1:1 (square), "
+                       "(3) 9:16 (vertical), (4) 16:9 (landscape), (5) 9:16 + 1:1 + 16:9: ")
+        if choice in ASPECT_RATIO_CHOICES:
             return choice
-        print("Invalid choice. Please enter 1 or 2.")
-
-
-def process_video(input_video, subtitle_file_path, output_folder, aspect_ratio_choice):
+        print("Invalid choice. Please enter a number from 1 to 5.")
+
+
+def resolve_profiles(aspect_ratio_choice):
+    """
+    Returns the render profile names for a menu choice ('1'-'5') or a comma-separated
+    list of profile names such as '9:16,1:1'.
+    """
+    if aspect_ratio_choice in ASPECT_RATIO_CHOICES:
+        return ASPECT_RATIO_CHOICES[aspect_ratio_choice]
+    profiles = [name.strip() for name in str(aspect_ratio_choice).split(',') if name.strip()]
+    unknown = [name for name in profiles if name not in RENDER_PROFILES]
+    if not profiles or unknown:
+        raise ValueError(f"Unknown render profile(s): {aspect_ratio_choice}")
+    return profiles
+
+
+def required_source_height(aspect_ratio_choice):
+    """
+    Returns the source height needed to render every selected profile without upscaling, or None
+    if a profile keeps the source size. Crops of landscape sources use the full source height,
+    so this is the tallest output.
+    """
+    heights = []
+    for profile in resolve_profiles(aspect_ratio_choice):
+        max_size = RENDER_PROFILES[profile]['max_size']
+        if max_size is None:
+            return None
+        heights.append(max_size[1])
+    return max(heights)
+
+
+def profile_tag(profile):
+    """
+    File name tag of a profile, e.g. '9:16' -> '9x16'.
+    """
+    return profile.replace(':', 'x')
+
+
+def clip_base_name(video_stem):
+    """
+    Returns the subtitle base name of a trimmed clip, removing the '_trimmed' suffix and,
+    for multi-format renders, the profile tag.
+    """
+    base_name = video_stem.replace('_trimmed', '')
+    for profile in RENDER_PROFILES:
+        suffix = f"_{profile_tag(profile)}"
+        if base_name.endswith(suffix):
+            return base_name[:-len(suffix)]
+    return base_name
+
+
+def trimmed_video_paths(output_folder, base_name, aspect_ratio_choice):
+    """
+    Paths of the trimmed videos rendered for a clip SRT, one per render profile.
+    """
+    profiles = resolve_profiles(aspect_ratio_choice)
+    if len(profiles) == 1:
+        return [os.path.join(output_folder, f"{base_name}_trimmed.mp4")]
+    return [os.path.join(output_folder, f"{base_name}_{profile_tag(profile)}_trimmed.mp4") for profile in profiles]
+
+
+def clip_interval_path(output_folder, base_name):
+    """
+    Path of the sidecar recording the (start, end) a clip was actually trimmed at, when it
+    differs from its SRT timestamps (see `boundaries`).
+    """
+    return os.path.join(output_folder, f"{base_name}.interval.json")
+
+
+def read_clip_lead(video_path):
+    """
+    Returns the seconds between the start of a trimmed clip and its first subtitle, or None if
+    the clip starts on its first subtitle.
+    """
+    base_name = clip_base_name(os.path.splitext(os.path.basename(video_path))[0])
+    interval_path = clip_interval_path(os.path.dirname(video_path), base_name)
+    if not os.path.exists(interval_path):
+        return None
+    with open(interval_path, 'r', encoding='utf-8') as file:
+        return json.load(file)['lead']
+
+
+def crop_box(width, height, aspect, center=None):
+    """
+    Returns the largest (crop_width, crop_height, x_offset, y_offset) with the given aspect ratio
+    that fits in a width x height frame. Dimensions are even for libx264. The crop is centered
+    on the frame, or on `center` (x, y as fractions of the frame size) kept inside the frame.
+    """
+    aspect_width, aspect_height = aspect
+    if width * aspect_height > height * aspect_width:
+        crop_height = height - height % 2
+        crop_width = int(crop_height * aspect_width / aspect_height)
+    else:
+        crop_width = width - width % 2
+        crop_height = int(crop_width * aspect_height / aspect_width)
+    crop_width -= crop_width % 2
+    crop_height -= crop_height % 2
+    if center is None:
+        return crop_width, crop_height, (width - crop_width) // 2, (height - crop_height) // 2
+    x_offset = min(max(0, int(round(center[0] * width - crop_width / 2))), width - crop_width)
+    y_offset = min(max(0, int(round(center[1] * height - crop_height / 2))), height - crop_height)
+    return crop_width, crop_height, x_offset, y_offset
+
+
+def apply_profile(video, profile, width, height, crop_center=None):
+    """
+    Adds the crop and scale filters of a render profile to an ffmpeg video stream.
+    """
+    settings = RENDER_PROFILES[profile]
+    if settings['aspect'] is None:
+        return video
+
+    crop_width, crop_height, x_offset, y_offset = crop_box(width, height, settings['aspect'], crop_center)
+    video = video.filter('crop', crop_width, crop_height, x_offset, y_offset)
+
+    max_width, max_height = settings['max_size']
+    if crop_width > max_width or crop_height > max_height:
+        video = video.filter('scale', max_width, max_height)
+    return video
+
+
+def process_video(input_video, subtitle_file_path, output_folder, aspect_ratio_choice, crop_center=None,
+                  interval=None, probe_cache=None):
     logging.info('~~~CLIPPER: PROCESSING VIDEO~~~')
 
     if not os.path.exists(output_folder):
@@ -45,10 +197,14 @@ def process_video(input_video, subtitle_file_path, output_folder, aspect_ratio_c
     timestamps = re.findall(r'\d{2}:\d{2}:\d{2},\d{3}', subtitles_content)
     if not timestamps:
         logging.warning("No timestamps found in the subtitles.")
-        return
+        return []
 
     start_time = convert_timestamp(timestamps[0])
     end_time = convert_timestamp(timestamps[-1])
+    if interval is not None:
+        # Refined boundaries replace the first and last SRT timestamps
+        start_time = convert_timestamp(seconds_to_srt_timestamp(interval[0]))
+        end_time = convert_timestamp(seconds_to_srt_timestamp(interval[1]))
 
     # Log the extracted start and end times
     logging.info(f"Extracted Start Time: {start_time}")
@@ -64,75 +220,81 @@ def process_video(input_video, subtitle_file_path, output_folder, aspect_ratio_c
     logging.info(f"Calculated Duration: {duration_seconds:.2f} seconds")
 
     # Check if duration is less than 30 seconds or exceeds 2 minutes and 30 seconds
-    if duration_seconds < 30:
+    if duration_seconds < MIN_CLIP_SECONDS:
         logging.warning(
             f"Video fragment duration ({duration_seconds:.2f} seconds) is less than 30 seconds. Skipping this subtitle file.")
-        return
-    if duration_seconds > 150:  # 150 seconds = 2 minutes 30 seconds
+        return []
+    if duration_seconds > MAX_CLIP_SECONDS:
         logging.warning(
             f"Video fragment duration ({duration_seconds:.2f} seconds) exceeds 2 minutes 30 seconds. Skipping this subtitle file.")
-        return
+        return []
 
-    # Construct the output video path using the subtitle file name as a prefix
+    # Construct the output video paths using the subtitle file name as a prefix
     subtitle_base_name = os.path.splitext(os.path.basename(subtitle_file_path))[0]
-    output_video_path = os.path.join(output_folder, f"{subtitle_base_name}_trimmed.mp4")
+    profiles = resolve_profiles(aspect_ratio_choice)
+    output_video_paths = trimmed_video_paths(output_folder, subtitle_base_name, aspect_ratio_choice)
 
-    logging.info(f"Output path: {output_video_path}")
+    logging.info(f"Output paths: {', '.join(output_video_paths)}")
 
     try:
-        # Get video dimensions
-        probe = ffmpeg.probe(input_video)
-        video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-        width = int(video_stream['width'])
-        height = int(video_stream['height'])
+        # Get video dimensions (probed once per source, see media_info)
+        width, height = media_info.video_size(input_video, probe_cache)
 
         # Log video dimensions
         logging.info(f"Video Width: {width}, Video Height: {height}")
+        if crop_center is not None:
+            logging.info(f"Crop Center: x={crop_center[0]:.2f}, y={crop_center[1]:.2f}")
 
-        # Initialize ffmpeg input
+        # Initialize ffmpeg input; the clip is decoded once and split into one branch per profile
         input_stream = ffmpeg.input(input_video, ss=start_time, t=duration_seconds)
-
-        if aspect_ratio_choice == '2':  # 1:1 (square)
-            # Calculate crop dimensions for 1:1 aspect ratio
-            if width > height:
-                crop_size = height
-                x_offset = (width - crop_size) // 2
-                y_offset = 0
-            else:
-                crop_size = width
-                x_offset = 0
-                y_offset = (height - crop_size) // 2
-
-            # Apply crop filter
-            video = input_stream.video.filter('crop', crop_size, crop_size, x_offset, y_offset)
+        if len(profiles) == 1:
+            branches = [input_stream.video]
         else:
-            video = input_stream.video
+            split = input_stream.video.filter_multi_output('split', len(profiles))
+            branches = [split.stream(index) for index in range(len(profiles))]
 
         audio = input_stream.audio
 
-        # Re-encode the video
-        output = ffmpeg.output(video, audio, output_video_path,
-                               vcodec='libx264', acodec='aac',
-                               audio_bitrate='192k',
-                               **{'vsync': 'vfr'})
-
-        ffmpeg.run(output, overwrite_output=True)
-        logging.info(f"Trimmed video saved to {output_video_path}")
+        # Re-encode every branch in a single ffmpeg run, committing the files only once ffmpeg has finished
+        with ExitStack() as stack:
+            outputs = []
+            for profile, branch, output_video_path in zip(profiles, branches, output_video_paths):
+                partial_video_path = stack.enter_context(atomic_path(output_video_path))
+                video = apply_profile(branch, profile, width, height, crop_center)
+                outputs.append(ffmpeg.output(video, audio, str(partial_video_path),
+                                             vcodec='libx264', acodec='aac',
+                                             audio_bitrate='192k',
+                                             **{'vsync': 'vfr'}))
+
+            ffmpeg.run(ffmpeg.merge_outputs(*outputs), overwrite_output=True)
+        interval_path = clip_interval_path(output_folder, subtitle_base_name)
+        if interval is not None:
+            lead = (parse_timestamp(convert_timestamp(timestamps[0])) - parse_timestamp(start_time)).total_seconds()
+            atomic_write_text(interval_path, json.dumps({'start': interval[0], 'end': interval[1], 'lead': lead}))
+        elif os.path.exists(interval_path):
+            os.remove(interval_path)
+        for output_video_path in output_video_paths:
+            logging.info(f"Trimmed video saved to {output_video_path}")
+        return output_video_paths
 
     except ffmpeg.Error as e:
         logging.error(f"ffmpeg error: {str(e)}")
+        return []
 
 
-def main(input_video, subtitle_file_path, output_folder, aspect_ratio_choice=None):
+def main(input_video, subtitle_file_path, output_folder, aspect_ratio_choice=None, crop_center=None,
+         interval=None, probe_cache=None):
     if aspect_ratio_choice is None:
         aspect_ratio_choice = get_aspect_ratio_choice()
-    process_video(input_video, subtitle_file_path, output_folder, aspect_ratio_choice)
+    return process_video(input_video, subtitle_file_path, output_folder, aspect_ratio_choice, crop_center,
+                         interval, probe_cache)
 
 
 if __name__ == "__main__":
-    video_files = glob.glob('input_files/*.mp4')
-    subtitle_files = glob.glob('crew_output/*.srt')
-    output_folder = "clipper_output"
+    workspace = default_workspace()
+    video_files = glob.glob(str(workspace.input_files / '*.mp4'))
+    subtitle_files = glob.glob(str(workspace.crew_output / '*.srt'))
+    output_folder = str(workspace.clipper_output)
 
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
@@ -142,4 +304,5 @@ if __name__ == "__main__":
 
     for video_file_path in video_files:
         for subtitle_file in subtitle_files:
-            process_video(video_file_path, subtitle_file, output_folder, aspect_ratio_choice)
\ No newline at end of file
+            process_video(video_file_path, subtitle_file, output_folder, aspect_ratio_choice,
+                          probe_cache=workspace.probe_cache)
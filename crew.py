@@ -1,18 +1,22 @@
 # Standard library imports
 import os
-import sys
 import logging
 from pathlib import Path
 from textwrap import dedent
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Third party imports
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from crewai import Agent, Task, Crew, Process
 
 # Local application imports
 import extracts  # Ensure this module is available and correctly imported
+import llm_backends
+import prompt_prep
+from artifacts import atomic_write_text
+from resilience import complete_validated
+from utils import validate_srt
+from workspace import default_workspace
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,88 +24,103 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Load environment variables
 load_dotenv()
 
-gemini_api_key = os.getenv('GEMINI_API_KEY')
-
-# Ensure the Path is correctly imported
-if 'Path' not in globals():
-    from pathlib import Path
-
-def get_subtitles():
-    whisper_output_dir = Path('whisper_output')
+GEMINI_MODEL = "gemini-1.5-pro-exp-0801"
+SUBTITLES_FILE_PREFIX = 'new_file_return_subtitles_'
+# Input tokens of the subtitle cues per extract (see prompt_prep)
+CUES_TOKEN_BUDGET = 8000
+
+def get_subtitles(workspace=None):
+    """
+    Returns the subtitles of the workspace transcript: the cues of its binary artifact (see
+    transcript_store), or the SRT document when there is none.
+    """
+    workspace = workspace or default_workspace()
+    whisper_output_dir = workspace.whisper_output
     if not whisper_output_dir.exists():
         logging.error(f"Directory not found: {whisper_output_dir}")
         return None
 
-    srt_files = list(whisper_output_dir.glob('*.srt'))
-    if not srt_files:
-        logging.warning("No .srt files found in the whisper_output directory.")
+    _, srt_file = workspace.transcript_files()
+    if srt_file is None:
+        logging.warning(f"No .srt files found in {whisper_output_dir}.")
         return None
 
-    with open(srt_files[0], 'r') as file:
-        subtitles = file.read()
+    artifact = workspace.transcript_artifact(srt_file.stem)
+    if artifact is not None:
+        import transcript_store
 
-    return subtitles
+        return transcript_store.load_transcript(artifact).cues()
 
-def main(extracts):
-    # Create the crew_output directory if it doesn't exist
-    os.makedirs("crew_output", exist_ok=True)
-
-    # Read subtitles
-    subtitles = get_subtitles()
-    if subtitles is None:
-        logging.error("Failed to read subtitles. Exiting.")
-        return
-
-    subtitler_agent_1 = Agent(
-        role=dedent((
-            f"""
-            Segment 1 Subtitler
-            """)),
-        backstory=dedent((
-            f"""
-            Experienced subtitler who writes captions or subtitles that accurately represent the audio, including dialogue, sound effects, and music. The subtitles need to be properly timed with the video using correct time codes.
-            """)),
-        goal=dedent((
-            f"""
-            Match a list of extracts from a video clip with the corresponding timed subtitles. Given the segments found by the Digital Producer, find the segment timings within the `.srt` file and return each segment as an `.srt` subtitle segment.
-            """)),
-        allow_delegation=False,
-        verbose=True,
-        max_iter=1,
-        max_rpm=1,
-        llm=ChatGoogleGenerativeAI(model="gemini-1.5-pro-exp-0801",
-                                   verbose=True,
-                                   temperature=0.0,
-                                   google_api_key=gemini_api_key)
-    )
+    with open(srt_file, 'r', encoding='utf-8') as file:
+        subtitles = file.read()
 
-    subtitler_agent_2 = Agent(
-        role=dedent((
-            f"""
-            Segment 2 Subtitler
-            """)),
-        backstory=dedent((
-            f"""
-            Experienced subtitler who writes captions or subtitles that accurately represent the audio, including dialogue, sound effects, and music. The subtitles need to be properly timed with the video using correct time codes.
-            """)),
-        goal=dedent((
-            f"""
-            Match a list of extracts from a video clip with the corresponding timed subtitles. Given the segments found by the Digital Producer, find the segment timings within the `.srt` file and return each segment as an `.srt` subtitle segment.
-            """)),
-        allow_delegation=False,
-        verbose=True,
-        max_iter=1,
-        max_rpm=1,
-        llm=ChatGoogleGenerativeAI(model="gemini-1.5-pro-exp-0801",
-                                   verbose=True,
-                                   temperature=0.0,
-                                   google_api_key=gemini_api_key)
-    )
+    return subtitles
 
-    subtitler_agent_3 = Agent(
+def repair_subtitle_outputs(tasks, backend, to_srt=None):
+    """
+    Validates the output file of each subtitler task, converted with to_srt if given, and
+    writes it as an .srt file next to it. Invalid outputs are re-asked with the validation
+    error, and dropped if they are still invalid, so no clip is encoded from a broken or
+    out-of-range subtitle file. Returns the paths of the valid .srt files.
+    """
+    from clipper import MIN_CLIP_SECONDS, MAX_CLIP_SECONDS
+
+    def validate(content):
+        return validate_srt(to_srt(content) if to_srt else content, MIN_CLIP_SECONDS, MAX_CLIP_SECONDS)
+
+    valid = []
+    for task in tasks:
+        output_path = Path(task.output_file)
+        srt_path = output_path.with_suffix('.srt')
+        content = output_path.read_text(encoding='utf-8') if output_path.exists() else ''
+        try:
+            subtitles = validate(content)
+        except ValueError as e:
+            logging.warning(f"Invalid subtitles in {output_path.name} ({e}); asking for a correction")
+            messages = [
+                {'role': 'user', 'content': f"{task.description}\n\n{task.expected_output}"},
+                {'role': 'assistant', 'content': content},
+                {'role': 'user', 'content': f"Your answer is invalid: {e}\n"
+                                            f"Reply again with the complete corrected answer only, "
+                                            f"in exactly the format requested above."},
+            ]
+            try:
+                subtitles = complete_validated(backend, messages, validate, temperature=0.0)
+            except ValueError as e:
+                logging.error(f"Discarding {output_path.name}: the subtitles are still invalid ({e})")
+                output_path.unlink(missing_ok=True)
+                continue
+        if subtitles != content or srt_path != output_path:
+            atomic_write_text(srt_path, subtitles)
+        if srt_path != output_path:
+            output_path.unlink(missing_ok=True)
+        valid.append(srt_path)
+    return valid
+
+def extract_number(srt_file):
+    """
+    Returns the number of the extract an aligned .srt file (see `align_extract`) belongs to.
+    """
+    return int(Path(srt_file).name[len(SUBTITLES_FILE_PREFIX):].split('_', 1)[0])
+
+def align_extract(number, extract, subtitles, workspace, subtitler_backend):
+    """
+    Runs a one-agent crew that matches one extract to the subtitle cues. The agent sees compact
+    cue lines (see `prompt_prep`) and answers with a cue id range, which is expanded into the
+    original SRT cues and validated (see `repair_subtitle_outputs`). Returns the path of the
+    valid .srt file, or None.
+    """
+    # crewAI pulls in LangChain and friends, so it is only imported when the crew actually runs
+    from crewai import Agent, Task, Crew, Process
+
+    subtitler_llm = llm_backends.as_chat_model(subtitler_backend, temperature=0.0)
+    cues, cue_lines = prompt_prep.prepare_cues(f"crew extract {number}", subtitles, extract,
+                                               prompt_prep.token_budget('crew', CUES_TOKEN_BUDGET))
+
+    agent = Agent(
         role=dedent((
             f"""
-            Segment 3 Subtitler
+            Segment {number} Subtitler
             """)),
         backstory=dedent((
             f"""
@@ -109,237 +128,109 @@ def main(extracts):
             """)),
         goal=dedent((
             f"""
-            Match a list of extracts from a video clip with the corresponding timed subtitles. Given the segments found by the Digital Producer, find the segment timings within the `.srt` file and return each segment as an `.srt` subtitle segment.
+            Match a list of extracts from a video clip with the corresponding timed subtitles. Given the segments found by the Digital Producer, find the subtitle cues that contain each segment and return their cue ids.
             """)),
         allow_delegation=False,
         verbose=True,
         max_iter=1,
-        max_rpm=1,
-        llm=ChatGoogleGenerativeAI(model="gemini-1.5-pro-exp-0801",
-                                   verbose=True,
-                                   temperature=0.0,
-                                   google_api_key=gemini_api_key)
-    )
-
-    return_subtitles_1 = Task(
-        description=dedent((
-            f"""
-            You will be provided with a transcription extract from a video clip and the full content of an .srt subtitle file corresponding to that clip. Your task is to match the transcription extract to the subtitle segment it best aligns with and return the results in a specific format.
-        
-            Here is the transcription extract:
-            <segments>
-            {extracts[0]}
-            </segments>
-        
-            Here is the full content of the .srt subtitle file:
-            <srt_file>
-            {subtitles}
-            </srt_file>
-        
-            Please follow these steps:
-            1. Carefully read through the transcription excerpt within the <segments> tags.
-            2. Given the extract, search through the <srt_file> content to find the subtitle segment that best matches the extract. To determine the best match, look for segments that contain the most overlapping words or phrases with the extract.
-            3. Once you've found the best matching subtitle segment for the excerpt, format the match as follows:
-            [segment number]
-            [start time] --> [end time] 
-            [matched transcription extract]
-            5. After processing the extract, combine the formatted matches into a single block of text. This should resemble a valid .srt subtitle file, with each match separated by a blank line.
-        
-            Please note: .srt files have a specific format that must be followed exactly in order for them to be readable. Therefore, it is crucial that you do not include any extra content beyond the raw subtitle data itself. This means:
-            - No comments explaining your work
-            - No notes about which extracts matched which segments
-            - No additional text that isn't part of the subtitle segments
-        
-            Simply return the matches, properly formatted, as the entire contents of your response.
-            """)),
-        expected_output=dedent((
-            f"""
-            Format each match exactly as follows, and include only these details:
-        
-            [segment number]
-            [start time] --> [end time]
-            [matched transcription extract]
-        
-            Compile all the matches and return them without any additional text or commentary.
-        
-            Example of the expected output:
-        
-            26
-            00:01:57,000 --> 00:02:00,400
-            Sight turned into insight.
-            
-            27
-            00:02:00,400 --> 00:02:03,240
-            Seeing became understanding.
-            
-            28
-            00:02:03,240 --> 00:02:05,680
-            Understanding led to actions,
-
-        
-            Please note: .srt files have a specific format that must be followed exactly in order for them to be readable. Therefore, it is crucial that you DO NOT INCLUDE any extra content beyond the raw subtitle data itself. This means:
-            - No comments explaining your work
-            - No comments introducing your work
-            - No comments ending your work
-            - No notes about which extracts matched which segments
-            - No additional text that isn't part of the subtitle segments
-            - No comments like: "Here is the output with the matched segments in the requested format:"
-            """)),
-        agent=subtitler_agent_1,
-        output_file=f'crew_output/new_file_return_subtitles_1_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}.srt'
+        llm=subtitler_llm
     )
 
-    return_subtitles_2 = Task(
+    task = Task(
         description=dedent((
             f"""
-            You will be provided with a transcription extract from a video clip and the full content of an .srt subtitle file corresponding to that clip. Your task is to match the transcription extract to the subtitle segment it best aligns with and return the results in a specific format.
+            You will be provided with a transcription extract from a video clip and the subtitle cues of that clip. Each cue is on its own line: its id, its start time and its text, e.g. `#26 [01:57] Sight turned into insight.` Your task is to find the consecutive cues that the transcription extract best aligns with and return their ids in a specific format.
 
             Here is the transcription extract:
             <segments>
-            {extracts[1]}
+            {extract}
             </segments>
 
-            Here is the full content of the .srt subtitle file:
-            <srt_file>
-            {subtitles}
-            </srt_file>
+            Here are the subtitle cues:
+            <cues>
+            {cue_lines}
+            </cues>
 
             Please follow these steps:
             1. Carefully read through the transcription excerpt within the <segments> tags.
-            2. Given the extract, search through the <srt_file> content to find the subtitle segment that best matches the extract. To determine the best match, look for segments that contain the most overlapping words or phrases with the extract.
-            3. Once you've found the best matching subtitle segment for the excerpt, format the match as follows:
-            [segment number]
-            [start time] --> [end time] 
-            [matched transcription extract]
-            5. After processing the extract, combine the formatted matches into a single block of text. This should resemble a valid .srt subtitle file, with each match separated by a blank line.
-
-            Please note: .srt files have a specific format that must be followed exactly in order for them to be readable. Therefore, it is crucial that you do not include any extra content beyond the raw subtitle data itself. This means:
-            - No comments explaining your work
-            - No notes about which extracts matched which segments
-            - No additional text that isn't part of the subtitle segments
+            2. Given the extract, search through the <cues> to find the consecutive cues that best match the extract. To determine the best match, look for cues that contain the most overlapping words or phrases with the extract.
+            3. Return the id of the first matching cue and the id of the last matching cue, separated by a dash.
 
-            Simply return the matches, properly formatted, as the entire contents of your response.
+            Simply return the two ids as the entire contents of your response.
             """)),
         expected_output=dedent((
             f"""
-            Format each match exactly as follows, and include only these details:
-
-            [segment number]
-            [start time] --> [end time]
-            [matched transcription extract]
-
-            Compile all the matches and return them without any additional text or commentary.
+            The id of the first and of the last matching cue, separated by a dash.
 
             Example of the expected output:
 
-            26
-            00:01:57,000 --> 00:02:00,400
-            Sight turned into insight.
-
-            27
-            00:02:00,400 --> 00:02:03,240
-            Seeing became understanding.
-
-            28
-            00:02:03,240 --> 00:02:05,680
-            Understanding led to actions,
-
+            26-28
 
-            Please note: .srt files have a specific format that must be followed exactly in order for them to be readable. Therefore, it is crucial that you DO NOT INCLUDE any extra content beyond the raw subtitle data itself. This means:
+            It is crucial that you DO NOT INCLUDE any extra content beyond the two ids. This means:
             - No comments explaining your work
             - No comments introducing your work
             - No comments ending your work
-            - No notes about which extracts matched which segments
-            - No additional text that isn't part of the subtitle segments
-            - No comments like: "Here is the output with the matched segments in the requested format:"
+            - No cue text or time codes
             """)),
-            agent=subtitler_agent_2,
-            # ↑ specify which task's output should be used as context for subsequent tasks
-            output_file=f'crew_output/new_file_return_subtitles_2_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}.srt'
-        )
-
-    return_subtitles_3 = Task(
-        description=dedent((
-            f"""
-            You will be provided with a transcription extract from a video clip and the full content of an .srt subtitle file corresponding to that clip. Your task is to match the transcription extract to the subtitle segment it best aligns with and return the results in a specific format.
-
-            Here is the transcription extract:
-            <segments>
-            {extracts[2]}
-            </segments>
-
-            Here is the full content of the .srt subtitle file:
-            <srt_file>
-            {subtitles}
-            </srt_file>
-
-            Please follow these steps:
-            1. Carefully read through the transcription excerpt within the <segments> tags.
-            2. Given the extract, search through the <srt_file> content to find the subtitle segment that best matches the extract. To determine the best match, look for segments that contain the most overlapping words or phrases with the extract.
-            3. Once you've found the best matching subtitle segment for the excerpt, format the match as follows:
-            [segment number]
-            [start time] --> [end time] 
-            [matched transcription extract]
-            5. After processing the extract, combine the formatted matches into a single block of text. This should resemble a valid .srt subtitle file, with each match separated by a blank line.
-
-            Please note: .srt files have a specific format that must be followed exactly in order for them to be readable. Therefore, it is crucial that you do not include any extra content beyond the raw subtitle data itself. This means:
-            - No comments explaining your work
-            - No notes about which extracts matched which segments
-            - No additional text that isn't part of the subtitle segments
-
-            Simply return the matches, properly formatted, as the entire contents of your response.
-            """)),
-        expected_output=dedent((
-            f"""
-            Format each match exactly as follows, and include only these details:
-
-            [segment number]
-            [start time] --> [end time]
-            [matched transcription extract]
-
-            Compile all the matches and return them without any additional text or commentary.
-
-            Example of the expected output:
-
-            26
-            00:01:57,000 --> 00:02:00,400
-            Sight turned into insight.
-
-            27
-            00:02:00,400 --> 00:02:03,240
-            Seeing became understanding.
-
-            28
-            00:02:03,240 --> 00:02:05,680
-            Understanding led to actions,
-
-
-            Please note: .srt files have a specific format that must be followed exactly in order for them to be readable. Therefore, it is crucial that you DO NOT INCLUDE any extra content beyond the raw subtitle data itself. This means:
-            - No comments explaining your work
-            - No comments introducing your work
-            - No comments ending your work
-            - No notes about which extracts matched which segments
-            - No additional text that isn't part of the subtitle segments
-            - No comments like: "Here is the output with the matched segments in the requested format:"
-            """)),
-        agent=subtitler_agent_3,
-        output_file=f'crew_output/new_file_return_subtitles_3_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}.srt'
+        agent=agent,
+        output_file=str(workspace.crew_output / f'{SUBTITLES_FILE_PREFIX}{number}_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}.cues')
     )
 
+
     crew = Crew(
-        agents=[subtitler_agent_1, subtitler_agent_2, subtitler_agent_3],
-        tasks=[return_subtitles_1, return_subtitles_2, return_subtitles_3],
+        agents=[agent],
+        tasks=[task],
         verbose=2,
         process=Process.sequential,
     )
 
     result = crew.kickoff()
     logging.info(dedent(f"""\n\n########################"""))
-    logging.info(dedent(f"""## Here is your custom crew run result:"""))
+    logging.info(dedent(f"""## Here is your custom crew run result for extract {number}:"""))
     logging.info(dedent(f"""########################\n"""))
     logging.info(result)
 
-    return result
+    valid = repair_subtitle_outputs([task], subtitler_backend,
+                                    to_srt=lambda answer: prompt_prep.expand_cue_range(answer, cues))
+    return valid[0] if valid else None
+
+def main(extracts, workspace=None, on_aligned=None):
+    """
+    Aligns every extract in its own crew. The crews run concurrently and on_aligned(srt_file) is
+    called as soon as each valid .srt file is written, so a clip can be rendered without waiting
+    for the slowest extract. Returns the paths of the valid .srt files.
+    """
+    workspace = workspace or default_workspace()
+
+    # Create the crew_output directory if it doesn't exist
+    os.makedirs(workspace.crew_output, exist_ok=True)
+
+    # Read subtitles
+    subtitles = get_subtitles(workspace)
+    if subtitles is None:
+        logging.error("Failed to read subtitles. Exiting.")
+        return []
+
+    # All subtitler crews share one backend, selected by LLM_BACKEND (live, record, replay or stub).
+    # Its calls are paced by the shared rate limiter of the provider (see rate_limits)
+    subtitler_backend = llm_backends.get_backend('gemini', GEMINI_MODEL)
+
+    aligned = []
+    with ThreadPoolExecutor(max_workers=max(1, len(extracts))) as executor:
+        futures = {executor.submit(align_extract, number, extract, subtitles, workspace, subtitler_backend): number
+                   for number, extract in enumerate(extracts, 1)}
+        for future in as_completed(futures):
+            try:
+                srt_file = future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                logging.error(f"Aligning extract {futures[future]} failed: {e}")
+                continue
+            if srt_file is None:
+                continue
+            aligned.append(srt_file)
+            if on_aligned is not None:
+                on_aligned(srt_file)
+    return aligned
 
 if __name__ == "__main__":
     extracts_data = extracts.main()
@@ -347,6 +238,3 @@ if __name__ == "__main__":
         main(extracts_data)
     else:
         logging.error("Failed to generate extracts. Exiting.")
-
-# TO-DO: Change it so that `subtitler_agents` instead of returning entire subtitle files as .srt, they return the first and final time codes of when the quote would start and end (e.g., 00:02:51,400 --> 00:02:56,560).
-# TO-DO: After implementing this, a script copies and pastes the returned chunks of the script into an .srt file that will be used to burn in the subtitles.
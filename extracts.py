@@ -1,56 +1,157 @@
 # Standard library imports
-import sys
 import json
 import os
 from textwrap import dedent
 import logging
-from pathlib import Path
 import traceback
 
 # Third party imports
-from openai import OpenAI
 from dotenv import load_dotenv
 
 # Local application imports
+import llm_backends
+import prompt_prep
+import rate_limits
+from resilience import InvalidResponseError, complete_validated
+from artifacts import atomic_write_text
+from workspace import default_workspace
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 load_dotenv()
 
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("API key not found. Please set the OPENAI_API_KEY environment variable.")
+OPENAI_MODEL = "gpt-4o-2024-08-06"
+# Passages sent to the LLM when clips are targeted at a topic
+TOPIC_PASSAGES = 8
+CLIP_COUNT = 3
+# Input tokens of the transcript per call (see prompt_prep), and tokens reserved for the clips JSON
+TRANSCRIPT_TOKEN_BUDGET = 100000
+MAX_RESPONSE_TOKENS = 2048
+# Tokens of the prompt around the transcript, kept free when the budget is clamped to the rate limit
+PROMPT_OVERHEAD_TOKENS = 1500
+FILLER_TEXT = "This is filler content to ensure there are exactly three clips."
 
-client = OpenAI(api_key=api_key)
 
+def parse_clips_response(response_text):
+    """
+    Parses the clips JSON returned by the LLM, raising ValueError unless it holds at least
+    CLIP_COUNT clips that each have text. Extra clips are dropped rather than re-asked for, since
+    a repair request resends the whole transcript.
+    """
+    response_data = json.loads(response_text or '')
+    clips = response_data.get('clips') if isinstance(response_data, dict) else None
+    if not isinstance(clips, list):
+        raise ValueError('The response must be a JSON object with a "clips" list')
+    if len(clips) < CLIP_COUNT:
+        raise ValueError(f"The response contains {len(clips)} clips instead of exactly {CLIP_COUNT}")
+    for number, clip in enumerate(clips[:CLIP_COUNT], 1):
+        if not isinstance(clip, dict) or not str(clip.get('text') or '').strip():
+            raise ValueError(f"Clip {number} has no text")
+    if len(clips) > CLIP_COUNT:
+        logging.warning(f"The response contains {len(clips)} clips; keeping the first {CLIP_COUNT}")
+        response_data['clips'] = clips[:CLIP_COUNT]
+    return response_data
 
-def get_whisper_output():
-    whisper_output_dir = Path('whisper_output')
+
+def pad_clips_response(response_text):
+    """
+    Last resort for a response that is still invalid after the repair requests: keeps the clips
+    that have text and pads them with filler, or returns None if there are none.
+    """
+    try:
+        response_data = json.loads(response_text)
+        clips = [clip for clip in response_data.get('clips', [])
+                 if isinstance(clip, dict) and str(clip.get('text') or '').strip()][:CLIP_COUNT]
+    except (TypeError, ValueError, AttributeError):
+        return None
+    if not clips:
+        return None
+    logging.error(f"Padding {CLIP_COUNT - len(clips)} missing clips with filler content.")
+    while len(clips) < CLIP_COUNT:
+        clips.append({"rank": len(clips) + 1, "text": FILLER_TEXT})
+    response_data['clips'] = clips
+    return response_data
+
+
+def get_whisper_output(workspace=None):
+    """
+    Returns (transcript, subtitles) of the workspace. The subtitles are the cues of the binary
+    transcript artifact (see transcript_store), or the SRT document when there is none.
+    """
+    workspace = workspace or default_workspace()
+    whisper_output_dir = workspace.whisper_output
     if not whisper_output_dir.exists():
         logging.error(f"Directory not found: {whisper_output_dir}")
         return None, None
 
-    srt_files = list(whisper_output_dir.glob('*.srt'))
-    txt_files = list(whisper_output_dir.glob('*.txt'))
+    txt_file, srt_file = workspace.transcript_files()
 
-    if not srt_files or not txt_files:
-        logging.warning("No .srt or .txt files found in the whisper_output directory.")
+    if txt_file is None or srt_file is None:
+        logging.warning(f"No matching .srt and .txt files found in {whisper_output_dir}.")
         return None, None
 
-    with open(txt_files[0], 'r') as file:
+    artifact = workspace.transcript_artifact(srt_file.stem)
+    if artifact is not None:
+        import transcript_store
+
+        stored = transcript_store.load_transcript(artifact)
+        return stored.text, stored.cues()
+
+    with open(txt_file, 'r', encoding='utf-8') as file:
         transcript = file.read()
 
-    with open(srt_files[0], 'r') as file:
+    with open(srt_file, 'r', encoding='utf-8') as file:
         subtitles = file.read()
 
     return transcript, subtitles
 
 
-def call_openai_api(transcript):
+def topic_passages(workspace, topic, limit=TOPIC_PASSAGES):
+    """
+    Returns the transcript passages that best match topic, in playback order, or None when the
+    workspace has no binary transcript to search.
+    """
+    _, srt_file = workspace.transcript_files()
+    artifact = workspace.transcript_artifact(srt_file.stem) if srt_file else None
+    if artifact is None:
+        return None
+
+    import transcript_index
+
+    matches = transcript_index.find_clips(artifact, topic, limit)
+    logging.info(f"Found {len(matches)} passages about {topic!r}")
+    return '\n\n'.join(match['text'] for match in sorted(matches, key=lambda match: match['start_ms']))
+
+
+def transcript_budget(backend):
+    """
+    Returns the transcript token budget of a call on backend. The transcript is not cut to fit the
+    rate limit by default: an oversized call is logged by rate_limits and waits for the quota.
+    With LLM_CLAMP_TO_QUOTA=1 the budget is clamped so the whole call fits in the per-minute token
+    quota of the model instead.
+    """
+    budget = prompt_prep.token_budget('extracts', TRANSCRIPT_TOKEN_BUDGET)
+    if os.getenv('LLM_CLAMP_TO_QUOTA', '0') != '1':
+        return budget
+    capacity = rate_limits.token_capacity(backend.provider, backend.model)
+    if capacity is not None and budget > capacity - MAX_RESPONSE_TOKENS - PROMPT_OVERHEAD_TOKENS:
+        budget = max(0, capacity - MAX_RESPONSE_TOKENS - PROMPT_OVERHEAD_TOKENS)
+        logging.info(f"Transcript budget clamped to {budget:,} tokens by the {backend.provider}/{backend.model} "
+                     f"quota of {capacity:,} tokens per minute")
+    return budget
+
+
+def call_openai_api(transcript, backend=None, topic=None):
     logging.info("STARTING call_openai_api")
 
+    if backend is None:
+        backend = llm_backends.get_backend('openai', OPENAI_MODEL)
+
+    transcript = prompt_prep.prepare_text('extracts', transcript, transcript_budget(backend), backend.model)
+
+    topic_instruction = f"Only choose clips about this topic: {topic}." if topic else ""
     prompt = dedent(f"""
-        You will be given a complete transcript from a video. Your task is to identify four 1-minute long clips from this video that have the highest potential to become popular on social media. 
+        You will be given a complete transcript from a video. Your task is to identify three 1-minute long clips from this video that have the highest potential to become popular on social media. {topic_instruction}
         
         Follow these steps to complete the task:
         
@@ -58,11 +159,11 @@ def call_openai_api(transcript):
         
         2. For each standout moment you identify, extract a 1-minute segment of text from the transcript, centered around that moment. Ensure each segment is approximately 1 minute long when spoken (about 125 words or 10 spoken sentences).
         
-        3. From these segments, choose the top four that you believe have the highest potential to go viral on social media.
+        3. From these segments, choose the top three that you believe have the highest potential to go viral on social media.
         
-        4. Rank these four clips from most to least viral potential based on your assessment.
+        4. Rank these three clips from most to least viral potential based on your assessment.
         
-        5. Determine the word count for each of the four selected clips.
+        5. Determine the word count for each of the three selected clips.
         
         6. Format your final output as a JSON object containing an ordered list of the selected clips, each with its extracted text. The JSON object should look like this:
         
@@ -82,11 +183,6 @@ def call_openai_api(transcript):
                 "rank": 3,
                 "text": "<extracted text for clip 3>",
                 "wordcount": <length of the extracted text in words>
-            }},
-            {{
-                "rank": 4,
-                "text": "<extracted text for clip 4>",
-                "wordcount": <length of the extracted text in words>
             }}
             ]
         }}
@@ -107,14 +203,15 @@ def call_openai_api(transcript):
     """)
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-2024-08-06",
-            messages=[
+        return complete_validated(
+            backend,
+            [
                 {"role": "system", "content": "You are a helpful assistant."},
                 {"role": "user", "content": prompt}
             ],
+            parse_clips_response,
             temperature=0.8,
-            max_tokens=4095,
+            max_tokens=MAX_RESPONSE_TOKENS,
             top_p=1,
             frequency_penalty=0,
             presence_penalty=0,
@@ -146,31 +243,11 @@ def call_openai_api(transcript):
                 }
             }
         )
-
-        if not response or not response.choices:
-            logging.error("No response or choices from OpenAI API")
-            return None
-
-        response_text = response.choices[0].message.content
-        logging.info(f"Raw API response: {response_text}")
-
-        try:
-            response_data = json.loads(response_text)
-            # Ensure there are exactly four clips
-            if len(response_data.get('clips', [])) != 3:
-                logging.error("The response does not contain exactly four clips. Generating filler content.")
-                while len(response_data['clips']) < 3:
-                    response_data['clips'].append({
-                        "rank": len(response_data['clips']) + 1,
-                        "text": "This is filler content to ensure there are exactly four clips."
-                    })
-            return response_data
-        except json.JSONDecodeError as e:
-            logging.error(f"JSON Decode Error: {str(e)}")
-            logging.error(f"Problematic JSON string: {response_text}")
-            # Log the first 500 characters of the response for debugging
-            logging.error(f"First 500 characters of response: {response_text[:500]}")
-            return None
+    except InvalidResponseError as e:
+        logging.error(f"Invalid API response after repair attempts: {e}")
+        # Log the first 500 characters of the response for debugging
+        logging.error(f"First 500 characters of response: {(e.response_text or '')[:500]}")
+        return pad_clips_response(e.response_text)
     except Exception as e:
         logging.error(f"Error calling OpenAI API: {str(e)}")
         logging.error(traceback.format_exc())
@@ -179,25 +256,36 @@ def call_openai_api(transcript):
 
 def save_response_to_file(response, output_path):
     try:
-        with open(output_path, 'w') as f:
-            json.dump(response, f, indent=4)
+        atomic_write_text(output_path, json.dumps(response, indent=4))
         logging.info(f"Response saved to {output_path}")
     except Exception as e:
         logging.error(f"Error saving response to file: {e}")
 
 
-def main():
+def main(workspace=None, topic=None):
+    """
+    Asks the LLM for the clips with the most viral potential. With a topic, only the transcript
+    passages that best match it (see transcript_index) are sent, and the clips must be about it.
+    """
     logging.info('STARTING extracts.py')
 
-    transcript, subtitles = get_whisper_output()
+    workspace = workspace or default_workspace()
+    transcript, subtitles = get_whisper_output(workspace)
     if transcript is None or subtitles is None:
         logging.error("Failed to get whisper output")
         return None
 
-    response = call_openai_api(transcript)
+    if topic:
+        passages = topic_passages(workspace, topic)
+        if passages:
+            transcript = passages
+        else:
+            logging.warning(f"No passages about {topic!r} found; sending the whole transcript")
+
+    response = call_openai_api(transcript, topic=topic)
     if response and 'clips' in response:
-        output_dir = Path('crew_output')
-        output_dir.mkdir(exist_ok=True)
+        output_dir = workspace.crew_output
+        output_dir.mkdir(parents=True, exist_ok=True)
         output_path = output_dir / 'api_response.json'
         save_response_to_file(response, output_path)
 
@@ -217,5 +305,5 @@ if __name__ == "__main__":
 # TODO: Split the below tasks into separate API queries for different large language model (LLM) calls or agents to implement a divide-and-conquer approach.
 # 1. Read the entire transcript carefully, identifying key moments that stand out as particularly impactful or shareable.
 # 2. For each of these moments, extract a 1-minute segment of text from the transcript, centered around that moment. Ensure each segment is approximately 1 minute long when spoken (about 8 sentences).
-# 3. From these segments, choose the top four that you believe have the highest potential to go viral.
-# 4. Rank these four clips from most to least viral potential based on your assessment.
\ No newline at end of file
+# 3. From these segments, choose the top three that you believe have the highest potential to go viral.
+# 4. Rank these three clips from most to least viral potential based on your assessment.
@@ -0,0 +1,547 @@
+"""
+LLM backends shared by `extracts.py` and `crew.py`.
+
+The backend is selected with the LLM_BACKEND environment variable:
+    live    - call the real provider APIs (default)
+    record  - call the real provider APIs and save every response to the cassette file
+    replay  - answer from the cassette file, never touching the network
+    stub    - send requests to a local HTTP stub server (see `serve_stub`)
+
+Replay and stub backends can inject latency and failures, so concurrency, caching and
+retry behaviour can be load-tested offline without paying for tokens.
+
+Live, record and stub backends go through the shared rate limiters of `rate_limits`, and reuse
+pooled keep-alive HTTP connections. Every backend retries failed calls with backoff under a
+deadline, and can hedge slow calls (see `resilience`).
+"""
+
+# Standard library imports
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+import http.client
+import urllib.parse
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Third party imports
+from dotenv import load_dotenv
+
+# Local application imports
+import rate_limits
+import resilience
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_CASSETTE_PATH = 'llm_cassettes/cassette.json'
+DEFAULT_STUB_URL = 'http://127.0.0.1:8765'
+# Keep-alive connections per provider client
+HTTP_POOL_SIZE = 32
+HTTP_TIMEOUT = 600
+
+PROVIDER_API_KEYS = {
+    'openai': 'OPENAI_API_KEY',
+    'gemini': 'GEMINI_API_KEY',
+}
+
+
+class LLMBackendError(Exception):
+    """Raised when a backend cannot produce a response."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MissingRecordingError(LLMBackendError):
+    """Raised when a replayed request is not in the cassette; retrying cannot help."""
+    retryable = False
+
+
+class ProviderRateLimitError(LLMBackendError):
+    """Raised when the provider rejects a call with HTTP 429."""
+
+
+class InjectedFailure(LLMBackendError):
+    """Raised by a FaultInjector to simulate a provider failure."""
+
+
+class FaultInjector:
+    """
+    Adds configurable latency and failures to offline backends.
+
+    :param latency: Fixed delay in seconds added to every call, or 'recorded' to replay
+                    the latency that was measured when the cassette entry was recorded.
+    :param jitter: Maximum random delay in seconds added on top of the latency.
+    :param failure_rate: Probability (0-1) that a call raises InjectedFailure.
+    :param seed: Seed for the random generator, so that runs are repeatable.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, prefix='LLM_STUB'):
+        latency = os.getenv(f'{prefix}_LATENCY', '0')
+        seed = os.getenv(f'{prefix}_SEED')
+        return cls(
+            latency=latency if latency == 'recorded' else float(latency),
+            jitter=float(os.getenv(f'{prefix}_JITTER', '0')),
+            failure_rate=float(os.getenv(f'{prefix}_FAILURE_RATE', '0')),
+            seed=int(seed) if seed is not None else None,
+        )
+
+    def apply(self, recorded_latency=None):
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+            fail = self._random.random() < self.failure_rate
+        if self.latency == 'recorded':
+            delay = (recorded_latency or 0.0) + jitter
+        else:
+            delay = self.latency + jitter
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise InjectedFailure("Injected LLM backend failure")
+
+
+def request_key(provider, model, messages, params):
+    """
+    Returns a stable hash identifying a request, used to index the cassette.
+    """
+    payload = json.dumps({'provider': provider, 'model': model, 'messages': messages, 'params': params},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class Cassette:
+    """
+    A JSON file of recorded responses keyed by `request_key`.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            if self.path.exists():
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    self._entries = json.load(file)
+            else:
+                self._entries = {}
+        return self._entries
+
+    def get(self, key):
+        with self._lock:
+            return self._load().get(key)
+
+    def put(self, key, entry):
+        with self._lock:
+            entries = self._load()
+            entries[key] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(entries, file, indent=4, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+
+class LLMBackend:
+    """
+    Base class for all backends. Messages use the OpenAI chat format:
+    a list of {"role": ..., "content": ...} dictionaries.
+    """
+
+    def __init__(self, provider, model):
+        self.provider = provider
+        self.model = model
+
+    def complete(self, messages, **params):
+        """
+        Sends the messages to the model and returns the response text.
+        """
+        raise NotImplementedError
+
+    def key(self, messages, params):
+        return request_key(self.provider, self.model, messages, params)
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def shared_http_client():
+    """
+    Returns the httpx client shared by every OpenAI client in the process, so all models reuse
+    one pool of keep-alive connections.
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            import httpx
+            _http_client = httpx.Client(limits=httpx.Limits(max_connections=HTTP_POOL_SIZE,
+                                                            max_keepalive_connections=HTTP_POOL_SIZE),
+                                        timeout=HTTP_TIMEOUT)
+        return _http_client
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Live OpenAI chat completions. Set OPENAI_BASE_URL to point it at any
+    OpenAI-compatible server, including the local stub.
+    """
+
+    def __init__(self, model, api_key=None, base_url=None):
+        super().__init__('openai', model)
+        self.api_key = api_key or os.getenv(PROVIDER_API_KEYS['openai'])
+        self.base_url = base_url or os.getenv('OPENAI_BASE_URL')
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                if not self.api_key:
+                    raise ValueError("API key not found. Please set the OPENAI_API_KEY environment variable.")
+                from openai import OpenAI
+                # Retries are handled by ResilientBackend, under the call deadline
+                self._client = OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                      http_client=shared_http_client(), max_retries=0)
+            return self._client
+
+    def complete(self, messages, **params):
+        response = self.client.chat.completions.create(model=self.model, messages=messages, **params)
+        if not response or not response.choices:
+            raise LLMBackendError("No response or choices from OpenAI API")
+        return response.choices[0].message.content
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Live Google Gemini chat model through langchain_google_genai.
+    """
+
+    def __init__(self, model, api_key=None):
+        super().__init__('gemini', model)
+        self.api_key = api_key or os.getenv(PROVIDER_API_KEYS['gemini'])
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, temperature):
+        with self._lock:
+            if temperature not in self._clients:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                self._clients[temperature] = ChatGoogleGenerativeAI(model=self.model,
+                                                                    verbose=True,
+                                                                    temperature=temperature,
+                                                                    convert_system_message_to_human=True,
+                                                                    google_api_key=self.api_key)
+            return self._clients[temperature]
+
+    def complete(self, messages, **params):
+        client = self._client(params.get('temperature', 0.0))
+        stop = params.get('stop')
+        response = client.invoke([(message['role'], message['content']) for message in messages], stop=stop)
+        return response.content
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Wraps a live backend and saves every response, with its measured latency, to a cassette.
+    """
+
+    def __init__(self, inner, cassette):
+        super().__init__(inner.provider, inner.model)
+        self.inner = inner
+        self.cassette = cassette
+
+    def complete(self, messages, **params):
+        started = time.monotonic()
+        response_text = self.inner.complete(messages, **params)
+        latency = time.monotonic() - started
+        self.cassette.put(self.key(messages, params), {
+            'provider': self.provider,
+            'model': self.model,
+            'response': response_text,
+            'latency': round(latency, 3),
+        })
+        return response_text
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Answers from a cassette recorded by RecordingBackend, with optional fault injection.
+    """
+
+    def __init__(self, provider, model, cassette, faults=None):
+        super().__init__(provider, model)
+        self.cassette = cassette
+        self.faults = faults or FaultInjector()
+
+    def complete(self, messages, **params):
+        entry = self.cassette.get(self.key(messages, params))
+        if entry is None:
+            raise MissingRecordingError(f"No recorded response for this {self.provider}/{self.model} request "
+                                        f"in {self.cassette.path}")
+        self.faults.apply(entry.get('latency'))
+        return entry['response']
+
+
+class StubHTTPBackend(LLMBackend):
+    """
+    Sends OpenAI-style chat completion requests to the local stub server started by `serve_stub`.
+    Each thread keeps its own keep-alive connection to the stub.
+    """
+
+    def __init__(self, provider, model, url=DEFAULT_STUB_URL, timeout=60):
+        super().__init__(provider, model)
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._connections = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            parts = urllib.parse.urlsplit(self.url)
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=self.timeout)
+            self._connections.connection = connection
+        return connection
+
+    def _request(self, body):
+        connection = self._connection()
+        try:
+            connection.request('POST', '/v1/chat/completions', body=body,
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._connections.connection = None
+            raise
+
+    def _post(self, body):
+        try:
+            return self._request(body)
+        except (http.client.HTTPException, ConnectionError):
+            # A kept-alive connection may have been closed by the server since the last call
+            pass
+        except OSError as e:
+            raise LLMBackendError(f"Stub server unreachable at {self.url}: {e}") from e
+        try:
+            return self._request(body)
+        except (http.client.HTTPException, OSError) as e:
+            raise LLMBackendError(f"Stub server unreachable at {self.url}: {e}") from e
+
+    def complete(self, messages, **params):
+        body = json.dumps({'provider': self.provider, 'model': self.model,
+                           'messages': messages, 'params': params}).encode('utf-8')
+        status, payload = self._post(body)
+        if status == 429:
+            raise ProviderRateLimitError(f"Stub server returned HTTP 429: {payload.decode('utf-8', 'replace')}",
+                                         status_code=status)
+        if status != 200:
+            raise LLMBackendError(f"Stub server returned HTTP {status}: {payload.decode('utf-8', 'replace')}",
+                                  status_code=status)
+        data = json.loads(payload.decode('utf-8'))
+        return data['choices'][0]['message']['content']
+
+
+def is_rate_limit_error(error):
+    return isinstance(error, ProviderRateLimitError) or getattr(error, 'status_code', None) == 429
+
+
+class RateLimitedBackend(LLMBackend):
+    """
+    Wraps a backend so every call first waits for the shared quota of its provider/model.
+    """
+
+    def __init__(self, inner, limiter):
+        super().__init__(inner.provider, inner.model)
+        self.inner = inner
+        self.limiter = limiter
+
+    def complete(self, messages, **params):
+        self.limiter.acquire(rate_limits.estimate_tokens(messages, params))
+        try:
+            return self.inner.complete(messages, **params)
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self.limiter.throttle()
+            raise
+
+
+class ResilientBackend(LLMBackend):
+    """
+    Wraps a backend so every call is retried with backoff under a deadline, and slow calls are
+    hedged against the recent latencies of the provider/model.
+    """
+
+    def __init__(self, inner):
+        super().__init__(inner.provider, inner.model)
+        self.inner = inner
+        self.latencies = resilience.LatencyTracker()
+
+    def complete(self, messages, **params):
+        return resilience.call_with_resilience(lambda: self.inner.complete(messages, **params),
+                                               tracker=self.latencies)
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def backend_mode():
+    return os.getenv('LLM_BACKEND', 'live').lower()
+
+
+def required_api_keys():
+    """
+    Returns the environment variables that must be set for the selected backend mode.
+    """
+    if backend_mode() in ('live', 'record'):
+        return list(PROVIDER_API_KEYS.values())
+    return []
+
+
+def _live_backend(provider, model):
+    if provider == 'openai':
+        return OpenAIBackend(model)
+    if provider == 'gemini':
+        return GeminiBackend(model)
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+def get_backend(provider, model):
+    """
+    Returns the backend for a provider and model according to LLM_BACKEND.
+    Backends are cached, so every stage in the process shares the same clients.
+    """
+    mode = backend_mode()
+    with _backends_lock:
+        key = (mode, provider, model)
+        if key not in _backends:
+            cassette = Cassette(os.getenv('LLM_CASSETTE', DEFAULT_CASSETTE_PATH))
+            if mode == 'live':
+                backend = _live_backend(provider, model)
+            elif mode == 'record':
+                backend = RecordingBackend(_live_backend(provider, model), cassette)
+            elif mode == 'replay':
+                backend = ReplayBackend(provider, model, cassette, FaultInjector.from_env())
+            elif mode == 'stub':
+                backend = StubHTTPBackend(provider, model, os.getenv('LLM_STUB_URL', DEFAULT_STUB_URL))
+            else:
+                raise ValueError(f"Unknown LLM_BACKEND mode: {mode}")
+            limiter = rate_limits.get_limiter(provider, model) if mode != 'replay' else None
+            if limiter is not None:
+                backend = RateLimitedBackend(backend, limiter)
+            backend = ResilientBackend(backend)
+            logging.info(f"Using {mode} LLM backend for {provider}/{model}")
+            _backends[key] = backend
+        return _backends[key]
+
+
+_ROLES = {'system': 'system', 'human': 'user', 'ai': 'assistant'}
+
+
+def as_chat_model(backend, **params):
+    """
+    Wraps a backend in a LangChain chat model so it can be handed to crewAI agents.
+    """
+    from langchain_core.language_models.chat_models import SimpleChatModel
+
+    class BackendChatModel(SimpleChatModel):
+        @property
+        def _llm_type(self):
+            return f"viral-clips-crew-{backend.provider}"
+
+        def _call(self, messages, stop=None, run_manager=None, **kwargs):
+            converted = [{'role': _ROLES.get(message.type, 'user'), 'content': message.content}
+                         for message in messages]
+            response_text = backend.complete(converted, **params)
+            for token in stop or []:
+                if token in response_text:
+                    response_text = response_text[:response_text.index(token)]
+            return response_text
+
+    return BackendChatModel()
+
+
+def serve_stub(host='127.0.0.1', port=8765, cassette_path=None, default_response=None, faults=None):
+    """
+    Runs a local OpenAI-compatible HTTP stub. Requests are answered from the cassette when possible,
+    otherwise with `default_response`; unknown requests without a default get a 404.
+    Latency and failures (returned as HTTP 500) are injected with `faults`.
+    """
+    cassette = Cassette(cassette_path or os.getenv('LLM_CASSETTE', DEFAULT_CASSETTE_PATH))
+    faults = faults or FaultInjector.from_env()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        # Keep connections alive between requests, like the real providers
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            params = request.get('params')
+            if params is None:
+                # Plain OpenAI client request: everything except model/messages is a parameter
+                params = {k: v for k, v in request.items() if k not in ('model', 'messages')}
+            key = request_key(request.get('provider', 'openai'), request['model'], request['messages'], params)
+            entry = cassette.get(key)
+            try:
+                faults.apply(entry.get('latency') if entry else None)
+            except InjectedFailure as e:
+                self._reply(500, {'error': {'message': str(e)}})
+                return
+            if entry is None and default_response is None:
+                self._reply(404, {'error': {'message': f"No recorded response for request {key}"}})
+                return
+            content = entry['response'] if entry else default_response
+            self._reply(200, {
+                'id': f"stub-{key[:12]}",
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': request['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': content}}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+
+        def log_message(self, format, *args):
+            logging.debug(f"LLM stub: {format % args}")
+
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    logging.info(f"LLM stub server listening on http://{host}:{port}")
+    return server
+
+
+if __name__ == "__main__":
+    stub_server = serve_stub(port=int(os.getenv('LLM_STUB_PORT', '8765')),
+                             default_response=os.getenv('LLM_STUB_DEFAULT_RESPONSE'))
+    try:
+        stub_server.serve_forever()
+    except KeyboardInterrupt:
+        stub_server.server_close()
@@ -1,80 +1,150 @@
 # Standard library imports
 from pathlib import Path
 import os
+import time
 import warnings
 import logging
 
-# Third party imports
-import torch
-import whisper
-from whisper.utils import get_writer
+# Third party imports (torch and whisper are imported when a transcription actually runs)
 
 # Local application imports
+import media_info
+import model_selection
+from transcription_engines import default_model_name, engine_name, get_engine, loaded_engines
+from artifacts import atomic_path, atomic_write_text
 from utils import wait_for_file
+from workspace import default_workspace
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 warnings.filterwarnings("ignore")
 
 
-def transcribe_file(model, srt, plain, file):
+def transcribe_file(engine, srt, plain, file, output_dir="whisper_output", language="en"):
     input_file_path = Path(file)
     logging.info(f"Transcribing file: {input_file_path}\n")
 
+    # Run the transcription engine (see transcription_engines)
+    result = engine.transcribe(input_file_path, language=language, word_timestamps=True)
+
+    transcript, subtitles = write_transcript_files(result, srt, plain, input_file_path, output_dir)
+    return result, transcript, subtitles
+
+
+def write_transcript_files(result, srt, plain, file, output_dir="whisper_output"):
+    input_file_path = Path(file)
+    transcript = subtitles = None
+
     # Ensure the output directory exists
-    output_dir = Path("whisper_output")
+    output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    # Run Whisper
-    result = model.transcribe(str(input_file_path), fp16=False, verbose=False, language="en")
-
     output_file_name = input_file_path.stem
 
     if plain:
         txt_path = output_dir / f"{output_file_name}.txt"
         logging.info(f"Creating text file: {txt_path}")
 
-        with open(txt_path, "w", encoding="utf-8") as txt:
-            txt.write(result["text"])
+        atomic_write_text(txt_path, result["text"])
 
         transcript = result["text"]
 
     if srt:
         logging.info(f"Creating SRT file")
-        srt_writer = get_writer("srt", str(output_dir))
-        srt_writer(result, output_file_name)
 
         # Construct the SRT file path manually
         srt_path = output_dir / f"{output_file_name}.srt"
 
+        # Write into a partial folder and rename into place, so readers never see half a file
+        from whisper.utils import get_writer
+
+        with atomic_path(srt_path) as partial_srt_path:
+            srt_writer = get_writer("srt", str(partial_srt_path.parent))
+            srt_writer(result, output_file_name)
+
         # Read the SRT subtitles from the generated file
         with open(srt_path, "r", encoding="utf-8") as srt_file:
             subtitles = srt_file.read()
 
-    return result, transcript, subtitles
+    # Columnar copy of the same transcript, loaded memory-mapped by later stages
+    import transcript_store
+    transcript_store.write_whisper_result(transcript_store.artifact_path(output_dir, output_file_name), result)
+
+    return transcript, subtitles
 
 
-def transcribe_main(file):
+def transcribe_main(file, output_dir="whisper_output", model_name=None, language=None, deadline=None):
+    """
+    Transcribes file into output_dir. model_name and language default to TRANSCRIBE_MODEL and
+    TRANSCRIBE_LANGUAGE. With a deadline in seconds (or TRANSCRIBE_DEADLINE), the model and the
+    number of parallel workers are chosen to finish in time (see model_selection).
+    """
 
     # specify the type of file outputs you need from Whisper
     plain = True
     srt = True
 
-    # Whisper configuration
+    language = language or os.getenv('TRANSCRIBE_LANGUAGE', 'en')
+    model_name = model_name or default_model_name()
+    deadline = deadline or (float(os.getenv('TRANSCRIBE_DEADLINE')) if os.getenv('TRANSCRIBE_DEADLINE') else None)
+
+    audio_seconds = media_info.duration(file)
+    workers = 1
+    if deadline and audio_seconds:
+        loaded_models = [model for (name, model), engine in loaded_engines() if name == engine_name()]
+        model_name, workers = model_selection.plan_transcription(audio_seconds, deadline, language=language,
+                                                                 loaded_models=loaded_models)
+
+    if workers > 1:
+        result = model_selection.transcribe_parallel(file, model_name, workers, language=language,
+                                                     audio_seconds=audio_seconds, word_timestamps=True)
+        transcript, subtitles = write_transcript_files(result, srt, plain, file, output_dir)
+        return transcript, subtitles
+
+    # Get the engine; its model is loaded on first use and kept warm
+    engine = get_engine(model_name=model_name)
+    load_seconds = None
+    if not engine.loaded:
+        started = time.perf_counter()
+        engine.load()
+        load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result, transcript, subtitles = transcribe_file(engine, srt, plain, file, output_dir, language)
+    if audio_seconds:
+        # Every run refines this host's calibration for deadline planning
+        model_selection.record_measurement(engine.name, model_name, audio_seconds,
+                                           time.perf_counter() - started, load_seconds)
 
-    # Use CUDA, if available
-    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    return transcript, subtitles
 
-    # Load the desired model
-    model = whisper.load_model("medium.en").to(DEVICE)
 
-    result, transcript, subtitles = transcribe_file(model, srt, plain, file)
+def transcribe_batch(files, output_dir="whisper_output", batch_size=None, model_name=None, language=None):
+    """
+    Transcribes several files with batched inference (see batch_transcribe) and returns
+    {file: (transcript, subtitles)}.
+    """
+    from batch_transcribe import BatchTranscriber, DEFAULT_BATCH_SIZE
 
-    return transcript, subtitles
+    language = language or os.getenv('TRANSCRIBE_LANGUAGE', 'en')
+    engine = get_engine(model_name=model_name or default_model_name())
+    transcriber = BatchTranscriber(engine, batch_size or DEFAULT_BATCH_SIZE, language, word_timestamps=True)
+    outputs = {}
+    for file, result in zip(files, transcriber.transcribe_files(files)):
+        outputs[file] = write_transcript_files(result, True, True, file, output_dir)
+    return outputs
 
 
 def local_whisper_process(input_folder, crew_output_folder, transcript=None, subtitles=None,
-                          transcribe_flag=True):
+                          transcribe_flag=True, whisper_output_folder="whisper_output", deadline=None):
+    # With TRANSCRIBE_BATCH_SIZE > 1, all videos are transcribed together in batched passes
+    batch_size = int(os.getenv('TRANSCRIBE_BATCH_SIZE', '1'))
+    batched = {}
+    video_paths = [os.path.join(input_folder, filename) for filename in os.listdir(input_folder)
+                   if filename.endswith(".mp4")]
+    if transcribe_flag and not (transcript and subtitles) and batch_size > 1 and len(video_paths) > 1:
+        batched = transcribe_batch(video_paths, whisper_output_folder, batch_size)
+
     for filename in os.listdir(input_folder):
         if filename.endswith(".mp4"):
             input_video_path = os.path.join(input_folder, filename)
@@ -84,32 +154,35 @@ def local_whisper_process(input_folder, crew_output_folder, transcript=None, sub
                 if transcript and subtitles:
                     initial_srt_path = os.path.join(crew_output_folder,
                                                     f"{os.path.splitext(filename)[0]}_subtitles.srt")
-                    with open(initial_srt_path, 'w') as srt_file:
-                        srt_file.write(subtitles)
+                    atomic_write_text(initial_srt_path, subtitles)
                 else:
-                    full_transcript, full_subtitles = transcribe_main(input_video_path)
+                    _, full_subtitles = batched.get(input_video_path) or transcribe_main(
+                        input_video_path, whisper_output_folder, deadline=deadline)
                     initial_srt_path = os.path.join(crew_output_folder,
                                                     f"{os.path.splitext(filename)[0]}_subtitles.srt")
-                    with open(initial_srt_path, 'w') as srt_file:
-                        srt_file.write(full_subtitles)
+                    atomic_write_text(initial_srt_path, full_subtitles)
             else:
                 initial_srt_path = os.path.join(crew_output_folder, f"{os.path.splitext(filename)[0]}.srt")
 
             if wait_for_file(initial_srt_path):
-                whisper_output_dir = 'whisper_output'
+                whisper_output_dir = whisper_output_folder
                 srt_files = [f for f in os.listdir(whisper_output_dir) if f.endswith('.srt')]
                 txt_files = [f for f in os.listdir(whisper_output_dir) if f.endswith('.txt')]
 
                 if srt_files and txt_files:
                     subtitles_file = os.path.join(whisper_output_dir, srt_files[0])
                     transcript_file = os.path.join(whisper_output_dir, txt_files[0])
-                    with open(transcript_file, 'r') as file:
-                        transcript = file.read()
-                    with open(subtitles_file, 'r') as file:
-                        subtitles = file.read()
-                    for srt_filename in sorted(os.listdir(crew_output_folder)):
-                        if srt_filename.startswith("new_file_return_subtitles") and srt_filename.endswith(".srt"):
-                            subtitle_file_path = os.path.join(crew_output_folder, srt_filename)
+                    artifact = os.path.join(whisper_output_dir, f"{Path(subtitles_file).stem}.transcript")
+                    import transcript_store
+
+                    if transcript_store.is_current(artifact):
+                        stored = transcript_store.load_transcript(artifact)
+                        transcript, subtitles = stored.text, stored.cues()
+                    else:
+                        with open(transcript_file, 'r', encoding='utf-8') as file:
+                            transcript = file.read()
+                        with open(subtitles_file, 'r', encoding='utf-8') as file:
+                            subtitles = file.read()
                 else:
                     logging.error("No .srt or .txt files found in the whisper_output directory.")
             else:
@@ -119,10 +192,11 @@ def local_whisper_process(input_folder, crew_output_folder, transcript=None, sub
 
 
 if __name__ == "__main__":
-    input_folder = 'input_files'
-    crew_output_folder = 'crew_output'
+    workspace = default_workspace()
+    input_folder = str(workspace.input_files)
+    crew_output_folder = str(workspace.crew_output)
 
     if os.path.exists(input_folder):
-        local_whisper_process(input_folder, crew_output_folder)
+        local_whisper_process(input_folder, crew_output_folder, whisper_output_folder=str(workspace.whisper_output))
     else:
         logging.error(f"Input folder not found: {input_folder}")
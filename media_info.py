@@ -0,0 +1,114 @@
+"""
+Cached ffprobe metadata of media files.
+
+Probing spawns ffprobe and parses the container headers, which is slow on multi-GB sources
+that every clip of a job probes again. Results are cached in memory and, when a cache file
+is given (see `Workspace.probe_cache`), persisted as JSON so other processes and later runs
+reuse them. Entries are keyed by path, size and modification time, so a replaced file is
+probed again. Writers merge their entry into the file under an exclusive lock on a
+`<cache file>.lock` next to it, so concurrent jobs never drop each other's entries.
+"""
+
+# Standard library imports
+import os
+import json
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+
+# Third party imports
+import ffmpeg
+
+# Local application imports
+from artifacts import atomic_write_text, source_key
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PROBE_CACHE_NAME = 'probes.json'
+
+_probes = {}
+_probes_lock = threading.Lock()
+
+
+def _memory_key(key):
+    return key['path'], key['size'], key['mtime_ns']
+
+
+def _load_cache_file(cache_file):
+    if cache_file is None or not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        logging.warning(f"Ignoring unreadable probe cache: {cache_file}")
+        return {}
+
+
+@contextmanager
+def _cache_file_lock(cache_file):
+    """
+    Holds an exclusive lock on cache_file across processes for a read-modify-write.
+    """
+    with open(f"{cache_file}.lock", 'a', encoding='utf-8') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def probe(path, cache_file=None):
+    """
+    Returns the `ffmpeg.probe` result for path, from the in-memory or on-disk cache when the
+    file is unchanged.
+    """
+    key = source_key(path)
+    with _probes_lock:
+        if _memory_key(key) in _probes:
+            return _probes[_memory_key(key)]
+
+        entry = _load_cache_file(cache_file).get(key['path'])
+        if entry is not None and entry['source'] == key:
+            _probes[_memory_key(key)] = entry['probe']
+            return entry['probe']
+
+    result = ffmpeg.probe(path)
+
+    with _probes_lock:
+        _probes[_memory_key(key)] = result
+        if cache_file is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+            # Merge with entries other stages wrote since we read the file
+            with _cache_file_lock(cache_file):
+                entries = _load_cache_file(cache_file)
+                entries[key['path']] = {'source': key, 'probe': result}
+                atomic_write_text(cache_file, json.dumps(entries))
+    return result
+
+
+def video_stream(path, cache_file=None):
+    """
+    Returns the first video stream of path, or None if it has none.
+    """
+    return next((stream for stream in probe(path, cache_file)['streams'] if stream['codec_type'] == 'video'), None)
+
+
+def video_size(path, cache_file=None):
+    """
+    Returns the (width, height) of the first video stream of path.
+    """
+    stream = video_stream(path, cache_file)
+    if stream is None:
+        raise ValueError(f"No video stream in {path}")
+    return int(stream['width']), int(stream['height'])
+
+
+def duration(path, cache_file=None):
+    """
+    Returns the duration of path in seconds, or None if the container does not report one.
+    """
+    value = probe(path, cache_file).get('format', {}).get('duration')
+    return float(value) if value is not None else None
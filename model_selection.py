@@ -0,0 +1,215 @@
+"""
+Deadline-aware choice of the transcription model.
+
+Each host keeps a calibration of the real-time factor (RTF: processing seconds per audio
+second) and load time of every engine/model it has run, refined after each transcription.
+Given the audio duration and a turnaround deadline, `plan_transcription` picks the largest
+model that finishes in time. If none does on one worker, it plans the chunked-parallel path:
+the audio is split into contiguous ranges that are transcribed by several model instances at
+once (`transcribe_parallel`).
+
+    python model_selection.py calibrate --sample samples/talk.wav --models tiny.en,base.en,small.en
+    python model_selection.py plan --audio input_files/talk.mp4 --deadline 600
+"""
+
+# Standard library imports
+import os
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party imports
+
+# Local application imports
+import media_info
+import transcription_engines
+from artifacts import atomic_write_text
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_CALIBRATION_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'viral-clips-crew', 'calibration.json')
+
+# Models from largest to smallest; `.en` variants are used for English
+MODEL_LADDER = ['large-v3', 'medium', 'small', 'base', 'tiny']
+ENGLISH_MODELS = {'medium', 'small', 'base', 'tiny'}
+
+# CPU real-time factors and load times assumed until a model has been measured on this host
+DEFAULT_RTF = {'large-v3': 2.0, 'medium': 1.0, 'small': 0.35, 'base': 0.12, 'tiny': 0.06}
+DEFAULT_LOAD_SECONDS = {'large-v3': 30.0, 'medium': 15.0, 'small': 5.0, 'base': 2.0, 'tiny': 1.0}
+
+# Plans only use this fraction of the deadline, to absorb measurement noise
+SAFETY_FACTOR = 0.8
+# Weight of a new measurement in the running RTF estimate
+MEASUREMENT_WEIGHT = 0.3
+# Parallel transcriptions share the CPU, so each one is slower than a lone run by this factor
+PARALLEL_SLOWDOWN = 1.3
+
+_calibration_lock = threading.Lock()
+
+
+def calibration_path():
+    return os.getenv('VCC_CALIBRATION', DEFAULT_CALIBRATION_PATH)
+
+
+def _host_key(engine_name, model_name):
+    return f"{socket.gethostname()}/{engine_name}/{model_name}"
+
+
+def load_calibration():
+    path = calibration_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def record_measurement(engine_name, model_name, audio_seconds, processing_seconds, load_seconds=None):
+    """
+    Folds one measured transcription into this host's calibration.
+    """
+    if audio_seconds <= 0:
+        return
+    rtf = processing_seconds / audio_seconds
+    with _calibration_lock:
+        calibration = load_calibration()
+        entry = calibration.get(_host_key(engine_name, model_name), {})
+        if 'rtf' in entry:
+            entry['rtf'] = (1 - MEASUREMENT_WEIGHT) * entry['rtf'] + MEASUREMENT_WEIGHT * rtf
+        else:
+            entry['rtf'] = rtf
+        if load_seconds is not None:
+            entry['load_seconds'] = load_seconds
+        entry['measurements'] = entry.get('measurements', 0) + 1
+        calibration[_host_key(engine_name, model_name)] = entry
+        os.makedirs(os.path.dirname(calibration_path()), exist_ok=True)
+        atomic_write_text(calibration_path(), json.dumps(calibration, indent=2))
+    logging.info(f"Calibrated {engine_name}/{model_name}: RTF {entry['rtf']:.3f}")
+
+
+def model_names(language="en"):
+    """
+    Returns the model ladder for a language, largest first.
+    """
+    return [f"{name}.en" if language == "en" and name in ENGLISH_MODELS else name for name in MODEL_LADDER]
+
+
+def estimate(engine_name, model_name, calibration=None):
+    """
+    Returns (rtf, load_seconds) for a model on this host, from the calibration or the defaults.
+    """
+    calibration = load_calibration() if calibration is None else calibration
+    entry = calibration.get(_host_key(engine_name, model_name), {})
+    base_name = model_name.replace('.en', '')
+    return (entry.get('rtf', DEFAULT_RTF.get(base_name, 1.0)),
+            entry.get('load_seconds', DEFAULT_LOAD_SECONDS.get(base_name, 10.0)))
+
+
+def max_parallel_workers():
+    return max(1, (os.cpu_count() or 2) // 4)
+
+
+def plan_transcription(audio_seconds, deadline_seconds, engine_name=None, language="en", loaded_models=()):
+    """
+    Returns (model_name, workers): the largest model that transcribes audio_seconds within the
+    deadline, on one worker if possible, else split across up to `max_parallel_workers` model
+    instances. Falls back to the smallest model on all workers when nothing fits.
+    """
+    engine_name = engine_name or transcription_engines.engine_name()
+    calibration = load_calibration()
+    budget = deadline_seconds * SAFETY_FACTOR
+
+    def predicted(model_name, workers):
+        rtf, load_seconds = estimate(engine_name, model_name, calibration)
+        if model_name in loaded_models and workers == 1:
+            load_seconds = 0.0
+        slowdown = PARALLEL_SLOWDOWN if workers > 1 else 1.0
+        return load_seconds + audio_seconds * rtf * slowdown / workers
+
+    candidates = model_names(language)
+    for workers in range(1, max_parallel_workers() + 1):
+        for model_name in candidates:
+            if predicted(model_name, workers) <= budget:
+                logging.info(f"Transcription plan: {model_name} on {workers} worker(s), "
+                             f"~{predicted(model_name, workers):.0f}s for a {deadline_seconds:.0f}s deadline")
+                return model_name, workers
+
+    workers = max_parallel_workers()
+    logging.warning(f"No model meets the {deadline_seconds:.0f}s deadline for {audio_seconds:.0f}s of audio; "
+                    f"using {candidates[-1]} on {workers} worker(s) (~{predicted(candidates[-1], workers):.0f}s)")
+    return candidates[-1], workers
+
+
+def transcribe_parallel(file, model_name, workers, engine_name=None, language="en", audio_seconds=None,
+                        word_timestamps=False):
+    """
+    Splits file into `workers` contiguous ranges, transcribes them concurrently on separate model
+    instances and returns the merged result, shaped like a single transcription.
+    """
+    engine_class = transcription_engines.ENGINES[engine_name or transcription_engines.engine_name()]
+    audio_seconds = audio_seconds or media_info.duration(file)
+    range_seconds = audio_seconds / workers
+
+    def transcribe_range(index):
+        engine = engine_class(model_name)
+        return engine.transcribe(file, language=language, word_timestamps=word_timestamps,
+                                 start=index * range_seconds,
+                                 duration=range_seconds if index < workers - 1 else None)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='transcribe') as pool:
+        results = list(pool.map(transcribe_range, range(workers)))
+
+    segments = []
+    for result in results:
+        for segment in result["segments"]:
+            segments.append(transcription_engines.shift_segment(segment, 0.0, len(segments)))
+    return {"text": "".join(result["text"] for result in results), "segments": segments,
+            "language": results[0]["language"]}
+
+
+def calibrate(sample, model_names_to_measure, engine_name=None, language="en"):
+    """
+    Transcribes sample with each model and records its load time and RTF on this host.
+    """
+    engine_name = engine_name or transcription_engines.engine_name()
+    audio_seconds = media_info.duration(sample)
+    for model_name in model_names_to_measure:
+        engine = transcription_engines.ENGINES[engine_name](model_name)
+        started = time.perf_counter()
+        engine.load()
+        load_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        engine.transcribe(sample, language=language)
+        record_measurement(engine_name, model_name, audio_seconds, time.perf_counter() - started, load_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate transcription speed and plan deadline-aware runs.")
+    parser.add_argument('--engine', default=None, help="Transcription engine (default: TRANSCRIBE_ENGINE)")
+    parser.add_argument('--language', default="en")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    calibrate_parser = subparsers.add_parser('calibrate', help="Measure models on a sample")
+    calibrate_parser.add_argument('--sample', required=True)
+    calibrate_parser.add_argument('--models', default=None, help="Comma-separated models (default: the whole ladder)")
+
+    plan_parser = subparsers.add_parser('plan', help="Show the model chosen for a file and a deadline")
+    plan_parser.add_argument('--audio', required=True)
+    plan_parser.add_argument('--deadline', type=float, required=True, help="Target turnaround in seconds")
+
+    args = parser.parse_args()
+    if args.command == 'calibrate':
+        models = args.models.split(',') if args.models else model_names(args.language)
+        calibrate(args.sample, models, args.engine, args.language)
+    else:
+        model_name, workers = plan_transcription(media_info.duration(args.audio), args.deadline, args.engine,
+                                                 args.language)
+        print(f"{model_name} on {workers} worker(s)")
+
+
+if __name__ == "__main__":
+    main()
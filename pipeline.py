@@ -0,0 +1,525 @@
+# Standard library imports
+import time
+import queue
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party imports
+
+# Local application imports
+import clipper
+import subtitler
+import crew
+import extracts
+import ytdl
+import utils
+import local_transcribe
+import artifact_store
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Aligned clips waiting to be rendered, and clips rendered at once
+STREAM_QUEUE_SIZE = 4
+STREAM_WORKERS = 3
+
+
+class TaskGraph:
+    """
+    A small dependency graph of pipeline stages executed concurrently.
+
+    Each task is a callable that receives the results of its dependencies as keyword
+    arguments named after them. A task starts as soon as all of its dependencies have
+    finished, so independent stages (e.g. the video download and the LLM calls) overlap
+    and the critical path is the longest chain rather than the sum of all stages.
+
+    on_failure, if given, is called as soon as a task fails, e.g. to release tasks that are
+    blocked waiting on the failed one.
+    """
+
+    def __init__(self, max_workers=4, on_failure=None):
+        self.max_workers = max_workers
+        self.on_failure = on_failure
+        self.tasks = {}
+
+    def add(self, name, func, deps=()):
+        if name in self.tasks:
+            raise ValueError(f"Task already defined: {name}")
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+        self.tasks[name] = (func, tuple(deps))
+        return name
+
+    def run(self):
+        """
+        Runs every task and returns a dictionary of results keyed by task name.
+        If a task fails, its dependents are not started and the first error is re-raised
+        once the tasks already running have finished.
+        """
+        results = {}
+        errors = {}
+        pending = dict(self.tasks)
+        running = set()
+        condition = threading.Condition()
+
+        def execute(name, func, deps):
+            started = time.monotonic()
+            logging.info(f"PIPELINE: starting {name}")
+            try:
+                result = func(**{dep: results[dep] for dep in deps})
+            except Exception as e:  # pylint: disable=broad-except
+                logging.error(f"PIPELINE: {name} failed: {e}")
+                if self.on_failure is not None:
+                    self.on_failure()
+                with condition:
+                    errors[name] = e
+                    running.discard(name)
+                    condition.notify_all()
+                return
+            logging.info(f"PIPELINE: finished {name} in {time.monotonic() - started:.1f}s")
+            with condition:
+                results[name] = result
+                running.discard(name)
+                condition.notify_all()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            with condition:
+                while pending or running:
+                    if errors:
+                        # Do not start anything new once a stage has failed
+                        for name in list(pending):
+                            logging.warning(f"PIPELINE: skipping {name} after an upstream failure")
+                            del pending[name]
+                    for name, (func, deps) in list(pending.items()):
+                        if all(dep in results for dep in deps):
+                            del pending[name]
+                            running.add(name)
+                            executor.submit(execute, name, func, deps)
+                    if running:
+                        condition.wait()
+                    elif pending:
+                        raise RuntimeError(f"Unsatisfiable dependencies for tasks: {sorted(pending)}")
+
+        if errors:
+            raise next(iter(errors.values()))
+        return results
+
+
+class ClipStream:
+    """
+    A bounded queue of aligned clip SRT files, from the alignment stage to the render stage.
+    The producer blocks while the queue is full; `cancel` releases both sides after a failure.
+    """
+
+    _END = object()
+
+    def __init__(self, maxsize=STREAM_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize)
+        self._cancelled = threading.Event()
+
+    def put(self, srt_file):
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(srt_file, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def produce(self, func):
+        """
+        Runs func(put) and ends the stream afterwards, even if func fails.
+        """
+        try:
+            return func(self.put)
+        finally:
+            self.put(self._END)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def __iter__(self):
+        while not self._cancelled.is_set():
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item is self._END:
+                return
+            yield item
+
+
+def stream_clips(stream, render, workers=STREAM_WORKERS):
+    """
+    Calls render(srt_file) for every SRT file of the stream as soon as it arrives, on up to
+    `workers` threads. Returns the results once the stream has ended and every render has
+    finished, or re-raises the first render error.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(render, srt_file) for srt_file in stream]
+    return [future.result() for future in futures]
+
+
+def run_encodes(jobs, encode_pool=None):
+    """
+    Runs (func, args) encode jobs inline, or concurrently on a shared ffmpeg worker pool,
+    and returns once all of them have finished.
+    """
+    if encode_pool is None:
+        return [func(*args) for func, args in jobs]
+    futures = [encode_pool.submit(func, *args) for func, args in jobs]
+    return [future.result() for future in futures]
+
+
+def _clip(video_file, srt_file, output_video_folder, aspect_ratio_choice, crop_center=None, interval=None,
+          probe_cache=None):
+    clipper.main(str(video_file), str(srt_file), str(output_video_folder), aspect_ratio_choice, crop_center,
+                 interval, probe_cache)
+    logging.info(f"Processed {video_file} with {srt_file}")
+
+
+def _crops(aspect_ratio_choice):
+    return any(clipper.RENDER_PROFILES[profile]['aspect'] is not None
+               for profile in clipper.resolve_profiles(aspect_ratio_choice))
+
+
+def prepare_sources(video_files, aspect_ratio_choice, analysis_dir, smart_crop=False, snap_boundaries=False):
+    """
+    Decodes each source once into the analysis data the selected options need (a low-resolution
+    proxy and its scene cuts for smart_crop, an audio envelope for snap_boundaries), cached in
+    analysis_dir.
+    Running this while the LLM calls are in flight keeps it off the critical path.
+    """
+    for video_file in video_files:
+        if smart_crop and _crops(aspect_ratio_choice):
+            import proxy
+            proxy.scene_cuts(video_file, proxy.build_proxy(video_file, analysis_dir), analysis_dir)
+        if snap_boundaries:
+            import boundaries
+            boundaries.build_envelope(video_file, analysis_dir)
+
+
+def analyse_clips(pairs, aspect_ratio_choice, analysis_dir, smart_crop=False, snap_boundaries=False):
+    """
+    Returns {(video_file, srt_file): clipper keyword arguments} for the given pairs. With
+    smart_crop, crops follow the motion of each clip's longest shot; with snap_boundaries, clip
+    boundaries move to the nearest pause or scene cut (see `boundaries`). The per-source analysis
+    data is read from analysis_dir, computing it first if `prepare_sources` has not.
+    """
+    smart_crop = smart_crop and _crops(aspect_ratio_choice)
+    analysis = {}
+    if not smart_crop and not snap_boundaries:
+        return analysis
+    import proxy
+    import boundaries
+
+    for video_file in dict.fromkeys(video_file for video_file, _ in pairs):
+        video_proxy = proxy.build_proxy(video_file, analysis_dir) if smart_crop else None
+        scene_cuts = proxy.scene_cuts(video_file, video_proxy, analysis_dir) if video_proxy is not None else []
+        envelope = boundaries.build_envelope(video_file, analysis_dir) if snap_boundaries else None
+        for srt_file in (srt_file for source, srt_file in pairs if source == video_file):
+            with open(srt_file, 'r', encoding='utf-8') as file:
+                interval = utils.srt_interval(file.read())
+            if interval is None:
+                continue
+            options = {}
+            if envelope is not None:
+                interval = boundaries.refine_interval(envelope, *interval, scene_cuts)
+                options['interval'] = interval
+            if video_proxy is not None:
+                options['crop_center'] = proxy.clip_crop_center(video_proxy, *interval, scene_cuts)
+            analysis[(video_file, srt_file)] = options
+    return analysis
+
+
+def _clip_interval(srt_file, options):
+    if options.get('interval'):
+        return tuple(options['interval'])
+    with open(srt_file, 'r', encoding='utf-8') as file:
+        return utils.srt_interval(file.read())
+
+
+def fingerprint_clip(video_file, srt_file, analysis_dir, options=None):
+    """
+    Returns the `clip_fingerprints` fingerprint of a clip. The audio part comes from the cached
+    envelope of its source, which exists when boundaries were snapped; the audio is never decoded
+    just for the fingerprint, so without an envelope the fingerprint is text-only.
+    """
+    import boundaries
+    import clip_fingerprints
+
+    with open(srt_file, 'r', encoding='utf-8') as file:
+        subtitles = file.read()
+    return clip_fingerprints.clip_fingerprint(subtitles, boundaries.cached_envelope(video_file, analysis_dir),
+                                              _clip_interval(srt_file, options or {}))
+
+
+def rendered_outputs(base_name, aspect_ratio_choice, subtitler_output_folder):
+    """
+    Returns {render profile: subtitled video} of a clip SRT rendered with aspect_ratio_choice.
+    """
+    return {profile: Path(subtitler_output_folder) / f"{Path(trimmed).stem}_subtitled.mp4"
+            for profile, trimmed in zip(clipper.resolve_profiles(aspect_ratio_choice),
+                                        clipper.trimmed_video_paths('', base_name, aspect_ratio_choice))}
+
+
+def dedupe_clips(pairs, analysis, analysis_dir, subtitler_output_folder, aspect_ratio_choice, store=None,
+                 earlier=()):
+    """
+    Returns {(video_file, srt_file): fingerprint} for the pairs that are not near-duplicates of a
+    clip already rendered on this host in the same render profiles, or of a clip of the same video
+    earlier in this run (see `clip_fingerprints`). The outputs of clips rendered by earlier runs
+    are linked into subtitler_output_folder instead. earlier holds the (video_file, fingerprint)
+    pairs of clips kept by previous calls in the same run.
+    """
+    import clip_fingerprints
+
+    store = store or clip_fingerprints.FingerprintStore()
+    analysis = analysis or {}
+    kept = {}
+    for video_file, srt_file in pairs:
+        fingerprint = fingerprint_clip(video_file, srt_file, analysis_dir, analysis.get((video_file, srt_file)))
+        base_name = Path(srt_file).stem
+        duplicate = store.find_duplicate(fingerprint, clipper.resolve_profiles(aspect_ratio_choice))
+        if duplicate is not None:
+            links = clip_fingerprints.link_outputs(
+                duplicate, rendered_outputs(base_name, aspect_ratio_choice, subtitler_output_folder))
+            logging.info(f"Skipping {srt_file}: duplicate of {duplicate['base_name']} from {duplicate['source']}, "
+                         f"linked {len(links)} output(s)")
+        elif any(source == video_file and clip_fingerprints.is_duplicate(fingerprint, other)
+                 for source, other in [*earlier, *((pair[0], other) for pair, other in kept.items())]):
+            logging.info(f"Skipping {srt_file}: duplicate of a clip earlier in this run")
+        else:
+            kept[(video_file, srt_file)] = fingerprint
+    return kept
+
+
+def register_clips(fingerprints, aspect_ratio_choice, subtitler_output_folder, analysis=None, store=None):
+    """
+    Records the rendered outputs of the pairs kept by `dedupe_clips`, so later runs can skip them.
+    """
+    import clip_fingerprints
+
+    store = store or clip_fingerprints.FingerprintStore()
+    analysis = analysis or {}
+    for (video_file, srt_file), fingerprint in fingerprints.items():
+        base_name = Path(srt_file).stem
+        outputs = {profile: output.resolve() for profile, output
+                   in rendered_outputs(base_name, aspect_ratio_choice, subtitler_output_folder).items()
+                   if output.exists()}
+        if outputs:
+            store.add(fingerprint, Path(video_file).resolve(), base_name,
+                      _clip_interval(srt_file, analysis.get((video_file, srt_file), {})), outputs)
+
+
+def _register(fingerprints, analysis, workspace, aspect_ratio_choice):
+    fingerprints = {pair: fingerprint for pair, fingerprint in fingerprints.items() if fingerprint is not None}
+    if fingerprints:
+        register_clips(fingerprints, aspect_ratio_choice, workspace.subtitler_output, analysis)
+
+
+def stream_deduper(workspace, enabled, aspect_ratio_choice):
+    """
+    Returns dedupe(pair, analysis) -> (keep, fingerprint) for clips that arrive one at a time,
+    comparing each clip with those kept earlier in the run (see `dedupe_clips`).
+    """
+    lock = threading.Lock()
+    kept = []
+
+    def dedupe(pair, analysis):
+        if not enabled:
+            return True, None
+        with lock:
+            result = dedupe_clips([pair], analysis, workspace.analysis, workspace.subtitler_output,
+                                  aspect_ratio_choice, earlier=kept)
+            kept.extend((video_file, fingerprint) for (video_file, _), fingerprint in result.items())
+        return pair in result, result.get(pair)
+
+    return dedupe
+
+
+def clip_pairs(pairs, output_video_folder, aspect_ratio_choice, encode_pool=None, analysis=None,
+               probe_cache=None):
+    """
+    Runs the clipper for (video, clip SRT) pairs, with the per-clip options from `analyse_clips`.
+    Sources are probed once and the result is shared through probe_cache (see `media_info`).
+    """
+    analysis = analysis or {}
+    jobs = []
+    for video_file, srt_file in pairs:
+        options = analysis.get((video_file, srt_file), {})
+        jobs.append((_clip, (video_file, srt_file, output_video_folder, aspect_ratio_choice,
+                             options.get('crop_center'), options.get('interval'), probe_cache)))
+    run_encodes(jobs, encode_pool)
+
+
+def clip_videos(video_files, srt_files, output_video_folder, aspect_ratio_choice, encode_pool=None, analysis=None,
+                probe_cache=None):
+    """
+    Runs the clipper for every video against every selected clip SRT.
+    """
+    clip_pairs([(video_file, srt_file) for video_file in video_files for srt_file in srt_files],
+               output_video_folder, aspect_ratio_choice, encode_pool, analysis, probe_cache)
+
+
+def clip_sections(sections, output_video_folder, aspect_ratio_choice, encode_pool=None, analysis=None,
+                  probe_cache=None):
+    """
+    Runs the clipper for (section video, rebased SRT) pairs from `ytdl.download_clip_sections`.
+    """
+    clip_pairs(list(sections), output_video_folder, aspect_ratio_choice, encode_pool, analysis, probe_cache)
+
+
+def _subtitle(video_file, srt_file, subtitler_output_folder, probe_cache=None):
+    subtitler.process_video_and_subtitles(str(video_file), str(srt_file), str(subtitler_output_folder),
+                                          probe_cache)
+    logging.info(f"Added subtitles to {video_file}")
+
+
+def subtitle_clips(output_video_folder, crew_output_folder, subtitler_output_folder, encode_pool=None,
+                   probe_cache=None):
+    """
+    Burns the matching crew subtitles into every trimmed clip.
+    """
+    jobs = []
+    for video_file in Path(output_video_folder).glob('*_trimmed.mp4'):
+        base_name = clipper.clip_base_name(video_file.stem)
+        srt_file = Path(crew_output_folder) / f"{base_name}.srt"
+        if srt_file.exists():
+            jobs.append((_subtitle, (video_file, srt_file, subtitler_output_folder, probe_cache)))
+        else:
+            logging.warning(f"No matching subtitle file found for {video_file}")
+    run_encodes(jobs, encode_pool)
+
+
+def write_source_transcript(transcript, audio_file, yt_video_id, workspace):
+    """
+    Writes the YouTube transcript into the workspace's whisper_output, or the local
+    transcription of the audio-only download when the video has no transcript.
+    """
+    if transcript is None:
+        return local_transcribe.transcribe_main(audio_file, str(workspace.whisper_output))
+    return ytdl.write_transcript(transcript, yt_video_id, workspace.whisper_output, workspace.whisper_output)
+
+
+def render_clip(pair, workspace, aspect_ratio_choice, deduper, encode_pool=None, smart_crop=False,
+                snap_boundaries=False):
+    """
+    Takes one (video, clip SRT) pair through analysis, dedupe, trimming, subtitling and
+    registration, without waiting for any other clip. deduper comes from `stream_deduper`.
+    Returns the subtitled videos.
+    """
+    video_file, srt_file = pair
+    analysis = analyse_clips([pair], aspect_ratio_choice, workspace.analysis, smart_crop, snap_boundaries)
+    keep, fingerprint = deduper(pair, analysis)
+    if not keep:
+        return []
+    options = analysis.get(pair, {})
+    trimmed_videos = run_encodes([(clipper.main, (str(video_file), str(srt_file), str(workspace.clipper_output),
+                                                  aspect_ratio_choice, options.get('crop_center'),
+                                                  options.get('interval'), workspace.probe_cache))],
+                                 encode_pool)[0] or []
+
+    # Subtitles are burnt in from the crew output, also for section clips with rebased SRTs
+    crew_srt = workspace.crew_output / f"{Path(srt_file).stem}.srt"
+    run_encodes([(_subtitle, (trimmed_video, crew_srt, workspace.subtitler_output, workspace.probe_cache))
+                 for trimmed_video in trimmed_videos], encode_pool)
+    _register({pair: fingerprint}, analysis, workspace, aspect_ratio_choice)
+    videos = [workspace.subtitler_output / f"{Path(trimmed_video).stem}_subtitled.mp4"
+              for trimmed_video in trimmed_videos]
+    logging.info(f"PIPELINE: published {len(videos)} video(s) for {Path(srt_file).name}")
+    return videos
+
+
+def select_and_align(workspace, topic=None, on_aligned=None):
+    """
+    Runs extract selection and crew alignment on the transcript in the workspace's whisper_output.
+    With a topic, only clips about it are selected. on_aligned(srt_file) is called for each clip
+    as soon as its own alignment is done (see `crew.main`).
+    """
+    extracts_data = extracts.main(workspace, topic)
+    if extracts_data is None:
+        raise RuntimeError("Failed to generate extracts.")
+    aligned = crew.main(extracts_data, workspace, on_aligned)
+    if not aligned:
+        raise RuntimeError("Failed to align any extract.")
+    return aligned
+
+
+def run_youtube_pipeline(yt_vid_url, workspace, aspect_ratio_choice, sections_only=False, encode_pool=None,
+                         smart_crop=False, snap_boundaries=False, topic=None, dedupe=False):
+    """
+    Runs the YouTube pipeline as a task graph inside a job workspace. The extract and alignment
+    LLM calls start as soon as the transcript is written, while the video download and its
+    analysis run in parallel. Each clip is then rendered as soon as both its alignment and the
+    download are done, through a `ClipStream`, so the first clip does not wait for the slowest one.
+
+    Videos without a YouTube transcript, and plain media URLs, are transcribed locally from an
+    audio-only download; the video download waits until the audio is in. Videos are downloaded
+    no taller than the selected render profiles need (see `clipper.required_source_height`).
+
+    With sections_only, each clip downloads only its own time range once it is aligned.
+    Clipping and subtitling run on encode_pool when one is given. smart_crop and
+    snap_boundaries are the `analyse_clips` options, and topic restricts the selected clips to
+    one subject. With dedupe, clips already rendered on this host in the same render profiles are
+    linked instead of encoded again (see `dedupe_clips`).
+    """
+    workspace.ensure()
+    yt_video_id = ytdl.media_id(yt_vid_url)
+    max_height = clipper.required_source_height(aspect_ratio_choice)
+    stream = ClipStream()
+    deduper = stream_deduper(workspace, dedupe, aspect_ratio_choice)
+    graph = TaskGraph(on_failure=stream.cancel)
+
+    graph.add('transcript', lambda: ytdl.fetch_transcript(ytdl.extract_video_id(yt_vid_url)))
+    graph.add('audio', lambda transcript: None if transcript is not None else ytdl.yt_vid_url_to_audio(
+        yt_vid_url, workspace.audio, yt_video_id), deps=['transcript'])
+    graph.add('subtitles', lambda transcript, audio: write_source_transcript(
+        transcript, audio, yt_video_id, workspace), deps=['transcript', 'audio'])
+    graph.add('align', lambda subtitles: stream.produce(
+        lambda on_aligned: select_and_align(workspace, topic, on_aligned)), deps=['subtitles'])
+
+    def render_pairs(pairs):
+        return [video for pair in pairs
+                for video in render_clip(pair, workspace, aspect_ratio_choice, deduper, encode_pool,
+                                         smart_crop, snap_boundaries)]
+
+    if sections_only:
+        graph.add('render', lambda: stream_clips(stream, lambda srt_file: render_pairs(
+            ytdl.download_clip_sections(yt_vid_url, [srt_file], workspace.sections, max_height=max_height))))
+    else:
+        graph.add('download', lambda audio: ytdl.yt_vid_url_to_mp4(yt_vid_url, workspace.input_files, max_height),
+                  deps=['audio'])
+        graph.add('prepare', lambda download: prepare_sources(
+            [download], aspect_ratio_choice, workspace.analysis, smart_crop, snap_boundaries), deps=['download'])
+        graph.add('render', lambda download, prepare: stream_clips(
+            stream, lambda srt_file: render_pairs([(download, srt_file)])), deps=['download', 'prepare'])
+    with artifact_store.job_reference(workspace):
+        return graph.run()
+
+
+def run_local_pipeline(workspace, aspect_ratio_choice, transcribe, encode_pool=None, smart_crop=False,
+                       snap_boundaries=False, topic=None, dedupe=False):
+    """
+    Runs the pipeline for video files already in the workspace's input_files. `transcribe` is
+    the callable that writes the local Whisper transcript into the workspace's whisper_output.
+    Each clip is rendered as soon as it is aligned, as in `run_youtube_pipeline`.
+    """
+    workspace.ensure()
+    video_files = sorted(workspace.input_files.glob('*.mp4'))
+    stream = ClipStream()
+    deduper = stream_deduper(workspace, dedupe, aspect_ratio_choice)
+    graph = TaskGraph(on_failure=stream.cancel)
+    graph.add('transcribe', transcribe)
+    graph.add('prepare', lambda: prepare_sources(video_files, aspect_ratio_choice, workspace.analysis,
+                                                 smart_crop, snap_boundaries))
+    graph.add('align', lambda transcribe: stream.produce(
+        lambda on_aligned: select_and_align(workspace, topic, on_aligned)), deps=['transcribe'])
+    graph.add('render', lambda prepare: stream_clips(stream, lambda srt_file: [
+        video for video_file in video_files
+        for video in render_clip((video_file, Path(srt_file)), workspace, aspect_ratio_choice, deduper,
+                                 encode_pool, smart_crop, snap_boundaries)]), deps=['prepare'])
+    with artifact_store.job_reference(workspace):
+        return graph.run()
@@ -0,0 +1,240 @@
+"""
+Prompt preparation for the LLM calls: token counting, transcript compression and token budgets.
+
+Transcripts lose their filler words and disfluencies ("um", "uh", stutters such as "I I",
+caption tags such as "[Music]"). Subtitles are sent as compact cue lines instead of raw SRT:
+
+    #26 [01:57] Sight turned into insight.
+
+so the model can answer with cue ids, which are expanded back into the original SRT cues
+locally. Every call has an input token budget; whatever does not fit is cut, and the savings
+are logged. Budgets default to the values passed by the caller and can be overridden:
+
+    LLM_TOKEN_BUDGETS='{"extracts": 50000, "crew": 4000}'
+
+Tokens are counted with tiktoken when it is installed, otherwise estimated from the length.
+"""
+
+# Standard library imports
+import os
+import re
+import json
+import logging
+import threading
+from collections import namedtuple
+
+# Third party imports (tiktoken is optional and imported on first use)
+
+# Local application imports
+from utils import SRT_TIMING_PATTERN, srt_timestamp_to_seconds
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Same estimate as rate_limits, used when tiktoken is not available
+CHARS_PER_TOKEN = 4
+FALLBACK_ENCODING = 'cl100k_base'
+
+FILLER_PATTERN = re.compile(r"(?:,\s*)?\b(?:m+-?h+m+|u+h+-h+u+h+|u+m+|u+h+|e+r+m+|h+m+|m+h*m+|a+h+)\b[,.]?",
+                            re.IGNORECASE)
+# Phrases that are only filler when set off by commas
+HEDGE_PATTERN = re.compile(r",\s*(?:you know|I mean)\s*,", re.IGNORECASE)
+# Repeats separated by spaces or commas, never hyphens ("bye-bye"). A word said three or more
+# times is a stutter; twice only for words whose doubling is never meant ("had had" and
+# "that that" are grammatical, "I I" is not)
+_REPEAT = r"(?<![\w'-])({word})(?:(?:\s+|\s*,\s*)\1(?![\w'-])){{{times},}}"
+STUTTER_PATTERN = re.compile(_REPEAT.format(word=r"\w+(?:'\w+)?", times=2), re.IGNORECASE)
+STUTTER_WORDS = ['i', "i'm", 'a', 'an', 'the', 'and', 'but', 'we', 'it', "it's", 'you', 'they', 'to', 'of']
+DOUBLED_STUTTER_PATTERN = re.compile(_REPEAT.format(word='|'.join(STUTTER_WORDS), times=1), re.IGNORECASE)
+CAPTION_TAG_PATTERN = re.compile(r"\[(?:music|applause|laughter|laughs|inaudible|silence|noise)\]", re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r"[ \t]+")
+SPACE_BEFORE_PUNCTUATION = re.compile(r"\s+([,.!?;:])")
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+CUE_RANGE_PATTERN = re.compile(r"#?(\d+)\s*(?:-|–|—|to)\s*#?(\d+)")
+SINGLE_CUE_PATTERN = re.compile(r"^\s*#?(\d+)\s*$")
+
+Cue = namedtuple('Cue', ['index', 'start', 'end', 'timing', 'text'])
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _encoding(model):
+    """
+    Returns the tiktoken encoding of model, or None if tiktoken (or its data) is unavailable.
+    """
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                import tiktoken
+
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encodings[model] = tiktoken.get_encoding(FALLBACK_ENCODING)
+            except Exception as e:  # pylint: disable=broad-except
+                logging.debug(f"Estimating tokens without tiktoken: {e}")
+                _encodings[model] = None
+        return _encodings[model]
+
+
+def count_tokens(text, model=None):
+    """
+    Returns the number of tokens of text for model, exact with tiktoken, else estimated.
+    """
+    encoding = _encoding(model or '')
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def token_budget(name, default):
+    """
+    Returns the input token budget of the named call (e.g. 'extracts'), from LLM_TOKEN_BUDGETS or default.
+    """
+    return int(json.loads(os.getenv('LLM_TOKEN_BUDGETS', '{}')).get(name, default))
+
+
+def strip_fillers(text):
+    """
+    Removes filler words, comma-delimited hedges, stutters and caption tags from text.
+    """
+    text = CAPTION_TAG_PATTERN.sub(' ', text)
+    text = HEDGE_PATTERN.sub(' ', text)
+    text = FILLER_PATTERN.sub('', text)
+    text = STUTTER_PATTERN.sub(r'\1', text)
+    text = DOUBLED_STUTTER_PATTERN.sub(r'\1', text)
+    text = SPACE_BEFORE_PUNCTUATION.sub(r'\1', text)
+    text = re.sub(r"^[,.\s]+", '', text, flags=re.MULTILINE)
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def fit_text(text, budget, model=None):
+    """
+    Cuts text at a word boundary so it fits in budget tokens.
+    """
+    if count_tokens(text, model) <= budget:
+        return text
+    # Shrink proportionally until it fits; the token/character ratio is nearly constant
+    while count_tokens(text, model) > budget:
+        text = text[:int(len(text) * budget / count_tokens(text, model) * 0.98)].rsplit(' ', 1)[0]
+    return text
+
+
+def log_savings(name, tokens_before, tokens_after):
+    saved = tokens_before - tokens_after
+    percent = 100 * saved / tokens_before if tokens_before else 0
+    logging.info(f"Prompt prep ({name}): {tokens_before:,} -> {tokens_after:,} input tokens ({percent:.0f}% saved)")
+
+
+def prepare_text(name, text, budget, model=None):
+    """
+    Returns text without filler words, cut to fit in budget tokens, and logs the savings.
+    """
+    tokens_before = count_tokens(text, model)
+    prepared = strip_fillers(text)
+    if count_tokens(prepared, model) > budget:
+        logging.warning(f"Prompt prep ({name}): input exceeds the {budget:,} token budget and is cut")
+        prepared = fit_text(prepared, budget, model)
+    log_savings(name, tokens_before, count_tokens(prepared, model))
+    return prepared
+
+
+def parse_cues(srt_content):
+    """
+    Returns the cues of an SRT document as Cue tuples (start and end in seconds).
+    """
+    cues = []
+    for block in re.split(r'\n\s*\n', srt_content.strip()):
+        lines = [line.strip() for line in block.strip().splitlines()]
+        if len(lines) < 2 or not lines[0].isdigit():
+            continue
+        timing = SRT_TIMING_PATTERN.match(lines[1])
+        if not timing:
+            continue
+        start, end = (srt_timestamp_to_seconds(timestamp) for timestamp in timing.groups())
+        cues.append(Cue(int(lines[0]), start, end, lines[1], ' '.join(lines[2:])))
+    return cues
+
+
+def format_offset(seconds):
+    """
+    Formats seconds as mm:ss, or h:mm:ss from one hour on.
+    """
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, secs = divmod(remainder, 60)
+    return f"{hours}:{minutes:02}:{secs:02}" if hours else f"{minutes:02}:{secs:02}"
+
+
+def cue_line(cue):
+    return f"#{cue.index} [{format_offset(cue.start)}] {strip_fillers(cue.text)}"
+
+
+def select_cues(cues, lines, extract, budget, model=None):
+    """
+    Returns the cue lines to send: all of them if they fit in budget tokens, otherwise the
+    consecutive cues that best match the words of extract, widened evenly on both sides up to
+    the budget.
+    """
+    costs = [count_tokens(line, model) + 1 for line in lines]
+    if sum(costs) <= budget:
+        return lines
+
+    extract_words = WORD_PATTERN.findall(extract.lower())
+    wanted = set(extract_words)
+    hits = [sum(word in wanted for word in WORD_PATTERN.findall(cue.text.lower())) for cue in cues]
+    words_per_cue = max(1.0, sum(len(cue.text.split()) for cue in cues) / max(1, len(cues)))
+    width = max(1, min(len(cues), round(len(extract_words) / words_per_cue)))
+    window_hits = [sum(hits[:width])]
+    for start in range(1, len(cues) - width + 1):
+        window_hits.append(window_hits[-1] - hits[start - 1] + hits[start + width - 1])
+    first = max(range(len(window_hits)), key=window_hits.__getitem__)
+    last = first + width - 1
+
+    total = sum(costs[first:last + 1])
+    while True:
+        grown = False
+        for index in (first - 1, last + 1):
+            if 0 <= index < len(cues) and total + costs[index] <= budget:
+                total += costs[index]
+                first, last = min(first, index), max(last, index)
+                grown = True
+        if not grown:
+            break
+    return lines[first:last + 1]
+
+
+def prepare_cues(name, subtitles, extract, budget, model=None):
+    """
+    Returns (cues, compact cue lines) for subtitles, an SRT document or a list of Cue tuples
+    (see `transcript_store.Transcript.cues`), cut to the budget around extract (see
+    `select_cues`), and logs the savings over the raw SRT.
+    """
+    if isinstance(subtitles, str):
+        srt_content, cues = subtitles, parse_cues(subtitles)
+    else:
+        cues = list(subtitles)
+        srt_content = '\n'.join(f"{cue.index}\n{cue.timing}\n{cue.text}\n" for cue in cues)
+    lines = select_cues(cues, [cue_line(cue) for cue in cues], extract, budget, model)
+    compact = '\n'.join(lines)
+    log_savings(name, count_tokens(srt_content, model), count_tokens(compact, model))
+    return cues, compact
+
+
+def expand_cue_range(answer, cues):
+    """
+    Returns the SRT document of the cues named by answer ("26-28", or a single id). Raises
+    ValueError if the answer names no cue range or unknown cues.
+    """
+    match = CUE_RANGE_PATTERN.search(answer) or SINGLE_CUE_PATTERN.match(answer)
+    if not match:
+        raise ValueError(f"Reply with the ids of the first and last matching cues, e.g. 26-28, not: {answer.strip()[:200]!r}")
+    first, last = int(match.group(1)), int(match.group(match.lastindex))
+    ids = [cue.index for cue in cues]
+    for cue_id in (first, last):
+        if cue_id not in ids:
+            raise ValueError(f"There is no cue #{cue_id}")
+    if last < first:
+        raise ValueError(f"The last cue #{last} comes before the first cue #{first}")
+    selected = cues[ids.index(first):ids.index(last) + 1]
+    return '\n'.join(f"{cue.index}\n{cue.timing}\n{cue.text}\n" for cue in selected)
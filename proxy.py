@@ -0,0 +1,187 @@
+"""
+Low-resolution proxy of a source video for visual analysis.
+
+The source is decoded once, at low resolution and frame rate, into a grayscale uint8 file
+that is opened as a memory-mapped NumPy array of shape (frames, height, width). Scene-cut
+detection and motion-weighted crop centers run vectorized on the proxy instead of on
+full-resolution frames, and their results feed the clipper's crop parameters.
+"""
+
+# Standard library imports
+import os
+import json
+import logging
+import subprocess
+from pathlib import Path
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+import media_info
+from artifacts import atomic_path, source_key
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PROXY_WIDTH = 160
+PROXY_FPS = 4
+# Frames compared per vectorized step, to bound memory on multi-hour sources
+ANALYSIS_CHUNK_FRAMES = 2048
+
+
+class Proxy:
+    def __init__(self, frames, fps, source_width, source_height):
+        self.frames = frames
+        self.fps = fps
+        self.source_width = source_width
+        self.source_height = source_height
+
+    def frame_range(self, start, end):
+        """
+        Returns the [first, last) proxy frame indices covering [start, end) seconds, so a shot
+        ending on a scene cut does not include the cut frame.
+        """
+        first = max(0, int(start * self.fps))
+        last = min(len(self.frames), int(np.ceil(end * self.fps)))
+        return first, last
+
+
+def build_proxy(input_video, cache_dir, width=PROXY_WIDTH, fps=PROXY_FPS):
+    """
+    Decodes input_video once into a low-resolution grayscale proxy in cache_dir and returns it
+    as a Proxy. The proxy is reused as long as the source file is unchanged.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(input_video).stem
+    frames_path = cache_dir / f"{stem}.proxy.gray"
+    meta_path = cache_dir / f"{stem}.proxy.json"
+    key = source_key(input_video)
+
+    if meta_path.exists() and frames_path.exists():
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        if meta['source'] == key and meta['width'] == width and meta['fps'] == fps:
+            return load_proxy(frames_path, meta)
+
+    source_width, source_height = media_info.video_size(input_video, cache_dir / media_info.PROBE_CACHE_NAME)
+    height = max(2, int(round(width * source_height / source_width / 2)) * 2)
+
+    logging.info(f"Building {width}x{height} @ {fps} fps analysis proxy for {input_video}")
+    with atomic_path(frames_path) as partial_frames_path:
+        cmd = [
+            'ffmpeg', '-v', 'error', '-y',
+            '-i', str(input_video),
+            '-an', '-sn',
+            '-vf', f"fps={fps},scale={width}:{height},format=gray",
+            '-f', 'rawvideo',
+            str(partial_frames_path),
+        ]
+        subprocess.run(cmd, check=True)
+
+    meta = {'source': key, 'width': width, 'height': height, 'fps': fps,
+            'source_width': source_width, 'source_height': source_height}
+    with atomic_path(meta_path) as partial_meta_path:
+        with open(partial_meta_path, 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+    return load_proxy(frames_path, meta)
+
+
+def load_proxy(frames_path, meta):
+    frame_size = meta['width'] * meta['height']
+    frame_count = os.path.getsize(frames_path) // frame_size
+    frames = np.memmap(frames_path, dtype=np.uint8, mode='r', shape=(frame_count, meta['height'], meta['width']))
+    return Proxy(frames, meta['fps'], meta['source_width'], meta['source_height'])
+
+
+def frame_differences(frames):
+    """
+    Returns the mean absolute difference between each frame and the previous one
+    (0 for the first frame), computed in chunks.
+    """
+    differences = np.zeros(len(frames), dtype=np.float32)
+    for chunk_start in range(1, len(frames), ANALYSIS_CHUNK_FRAMES):
+        chunk_end = min(len(frames), chunk_start + ANALYSIS_CHUNK_FRAMES)
+        current = frames[chunk_start:chunk_end].astype(np.int16)
+        previous = frames[chunk_start - 1:chunk_end - 1].astype(np.int16)
+        differences[chunk_start:chunk_end] = np.abs(current - previous).mean(axis=(1, 2))
+    return differences
+
+
+def detect_scene_cuts(proxy, threshold=None, min_gap=1.0):
+    """
+    Returns the times (in seconds) of scene cuts: frames whose difference to the previous frame
+    exceeds threshold (default: mean + 3 standard deviations, at least 12 grey levels).
+    Cuts closer than min_gap seconds to the previous cut are merged.
+    """
+    differences = frame_differences(proxy.frames)
+    if threshold is None:
+        threshold = max(12.0, float(differences.mean() + 3 * differences.std()))
+    candidates = np.flatnonzero(differences > threshold)
+
+    cuts = []
+    for index in candidates:
+        time = index / proxy.fps
+        if not cuts or time - cuts[-1] >= min_gap:
+            cuts.append(float(time))
+    return cuts
+
+
+def scene_cuts(input_video, proxy, cache_dir):
+    """
+    Returns the scene cuts of input_video (see `detect_scene_cuts`), detected on its proxy once
+    and cached in cache_dir. The cuts are reused as long as the source file and proxy are unchanged.
+    """
+    cuts_path = Path(cache_dir) / f"{Path(input_video).stem}.cuts.json"
+    key = {'source': source_key(input_video), 'width': proxy.frames.shape[2], 'fps': proxy.fps}
+    if cuts_path.exists():
+        with open(cuts_path, 'r', encoding='utf-8') as file:
+            cached = json.load(file)
+        if all(cached.get(name) == value for name, value in key.items()):
+            return cached['cuts']
+
+    cuts = detect_scene_cuts(proxy)
+    with atomic_path(cuts_path) as partial_cuts_path:
+        with open(partial_cuts_path, 'w', encoding='utf-8') as file:
+            json.dump(dict(key, cuts=cuts), file)
+    return cuts
+
+
+def motion_crop_center(proxy, start, end):
+    """
+    Returns the motion-weighted center (x, y) of the [start, end] seconds interval, as fractions
+    of the frame size, or None when there is no motion to follow (e.g. a static frame).
+    """
+    first, last = proxy.frame_range(start, end)
+    if last - first < 2:
+        return None
+
+    height, width = proxy.frames.shape[1:]
+    column_energy = np.zeros(width, dtype=np.float64)
+    row_energy = np.zeros(height, dtype=np.float64)
+    for chunk_start in range(first + 1, last, ANALYSIS_CHUNK_FRAMES):
+        chunk_end = min(last, chunk_start + ANALYSIS_CHUNK_FRAMES)
+        motion = np.abs(proxy.frames[chunk_start:chunk_end].astype(np.int16) -
+                        proxy.frames[chunk_start - 1:chunk_end - 1].astype(np.int16)).astype(np.float32)
+        # Ignore sensor noise and compression flicker
+        motion[motion < 8] = 0
+        column_energy += motion.sum(axis=(0, 1))
+        row_energy += motion.sum(axis=(0, 2))
+
+    total = column_energy.sum()
+    if total == 0:
+        return None
+    center_x = float((column_energy * (np.arange(width) + 0.5)).sum() / total / width)
+    center_y = float((row_energy * (np.arange(height) + 0.5)).sum() / total / height)
+    return center_x, center_y
+
+
+def clip_crop_center(proxy, start, end, scene_cuts=None):
+    """
+    Returns the crop center for a clip: the motion-weighted center of its longest shot
+    (split at scene_cuts), falling back to the whole clip.
+    """
+    boundaries = [start] + [cut for cut in scene_cuts or [] if start < cut < end] + [end]
+    shot_start, shot_end = max(zip(boundaries, boundaries[1:]), key=lambda shot: shot[1] - shot[0])
+    return motion_crop_center(proxy, shot_start, shot_end) or motion_crop_center(proxy, start, end)
@@ -0,0 +1,216 @@
+"""
+Shared request and token rate limits for LLM calls.
+
+Every call to a provider/model first takes one request and its estimated tokens from two
+token buckets that refill at the per-minute quota. All jobs in the process share the buckets,
+so concurrent jobs queue up at the quota instead of bursting into 429 responses. Set
+LLM_RATE_LIMIT_DB to a SQLite file and every process on the host shares them too.
+
+Limits default to DEFAULT_LIMITS and can be overridden per provider or per provider/model:
+
+    LLM_RATE_LIMITS='{"openai": {"rpm": 5000, "tpm": 800000}, "gemini/gemini-1.5-pro-exp-0801": {"rpm": 2}}'
+"""
+
+# Standard library imports
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from contextlib import closing
+
+# Third party imports
+
+# Local application imports
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_LIMITS = {
+    'openai': {'rpm': 500, 'tpm': 30000},
+    'gemini': {'rpm': 10, 'tpm': 1000000},
+}
+# Tokens reserved for the response when a call does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1024
+CHARS_PER_TOKEN = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def estimate_tokens(messages, params):
+    """
+    Rough token count of a chat call: the prompt characters plus the response budget.
+    """
+    prompt_chars = sum(len(message['content']) for message in messages)
+    return prompt_chars // CHARS_PER_TOKEN + params.get('max_tokens', DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucket:
+    """
+    A bucket of `capacity` tokens refilled at `rate` tokens per second, shared by the threads of
+    one process. A take larger than the capacity waits for a full bucket and leaves it in debt.
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, amount):
+        """
+        Takes amount tokens if available. Returns 0 on success, else the seconds to wait.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            needed = min(amount, self.capacity)
+            if self._tokens >= needed:
+                self._tokens -= amount
+                return 0.0
+            return (needed - self._tokens) / self.rate
+
+    def drain(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0)
+
+
+class SQLiteTokenBucket:
+    """
+    A TokenBucket whose state lives in a SQLite database, shared by every process on the host.
+    """
+
+    def __init__(self, db_path, key, capacity, rate):
+        self.db_path = str(db_path)
+        self.key = key
+        self.capacity = capacity
+        self.rate = rate
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def _update(self, func):
+        with closing(self._connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (self.key,)).fetchone()
+            tokens = self.capacity if row is None else min(self.capacity, row[0] + (now - row[1]) * self.rate)
+            tokens, result = func(tokens)
+            connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                               (self.key, tokens, now))
+            connection.execute('COMMIT')
+            return result
+
+    def try_take(self, amount):
+        def take(tokens):
+            needed = min(amount, self.capacity)
+            if tokens >= needed:
+                return tokens - amount, 0.0
+            return tokens, (needed - tokens) / self.rate
+        return self._update(take)
+
+    def drain(self):
+        self._update(lambda tokens: (min(tokens, 0.0), None))
+
+
+class RateLimiter:
+    """
+    Request-per-minute and token-per-minute buckets of one provider/model.
+    """
+
+    def __init__(self, name, rpm, tpm=None, db_path=None):
+        self.name = name
+
+        def bucket(kind, per_minute):
+            if db_path:
+                return SQLiteTokenBucket(db_path, f"{name}/{kind}", per_minute, per_minute / 60)
+            return TokenBucket(per_minute, per_minute / 60)
+
+        self.buckets = [bucket('requests', rpm)]
+        self.token_bucket = bucket('tokens', tpm) if tpm else None
+        if self.token_bucket:
+            self.buckets.append(self.token_bucket)
+
+    def acquire(self, tokens=0):
+        """
+        Blocks until one request and tokens can be spent within the quota.
+        """
+        if self.token_bucket and tokens > self.token_bucket.capacity:
+            logging.warning(f"Rate limit {self.name}: a call of ~{tokens:,} tokens exceeds the quota of "
+                            f"{self.token_bucket.capacity:,} tokens per minute and stalls every other caller")
+        waited = 0.0
+        for bucket in self.buckets:
+            amount = tokens if bucket is self.token_bucket else 1
+            while True:
+                wait = bucket.try_take(amount)
+                if not wait:
+                    break
+                time.sleep(wait)
+                waited += wait
+        if waited > 1:
+            logging.info(f"Rate limit {self.name}: waited {waited:.1f}s")
+        return waited
+
+    def throttle(self):
+        """
+        Empties the buckets after the provider rejected a call, so every caller pauses until they refill.
+        """
+        logging.warning(f"Rate limit {self.name}: provider returned 429, pausing callers")
+        for bucket in self.buckets:
+            bucket.drain()
+
+
+def configured_limits():
+    limits = {name: dict(values) for name, values in DEFAULT_LIMITS.items()}
+    for name, values in json.loads(os.getenv('LLM_RATE_LIMITS', '{}')).items():
+        limits.setdefault(name, {}).update(values)
+    return limits
+
+
+def model_limits(provider, model):
+    """
+    Returns the {'rpm', 'tpm'} limits of a provider/model, the model's overriding the provider's.
+    """
+    limits = configured_limits()
+    return dict(limits.get(provider, {}), **limits.get(f"{provider}/{model}", {}))
+
+
+def token_capacity(provider, model):
+    """
+    Returns the largest call, in tokens, that fits in the token quota of provider/model, or None
+    if its tokens are not limited.
+    """
+    return model_limits(provider, model).get('tpm')
+
+
+def get_limiter(provider, model):
+    """
+    Returns the shared limiter of a provider/model, or None if no limit is configured for it.
+    """
+    with _limiters_lock:
+        key = (provider, model)
+        if key not in _limiters:
+            values = model_limits(provider, model)
+            _limiters[key] = (RateLimiter(f"{provider}/{model}", values['rpm'], values.get('tpm'),
+                                          os.getenv('LLM_RATE_LIMIT_DB'))
+                              if values.get('rpm') else None)
+        return _limiters[key]
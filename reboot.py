@@ -2,6 +2,9 @@ import os
 from send2trash import send2trash
 import logging
 
+from artifact_store import remove_intermediates
+from workspace import default_workspace
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def move_files_to_trash(directory, exclude_files=None, file_extension=None):
@@ -43,29 +46,27 @@ def main():
         print("Operation cancelled.")
         return
 
-    clipper_output_dir = 'clipper_output'
-    whisper_output_dir = 'whisper_output'
-    crew_output_dir = 'crew_output'
-    input_files_dir = 'input_files'
-    subtitler_output_dir = 'subtitler_output'
+    workspace = default_workspace()
+    whisper_output_dir = str(workspace.whisper_output)
+    crew_output_dir = str(workspace.crew_output)
+    input_files_dir = str(workspace.input_files)
+    subtitler_output_dir = str(workspace.subtitler_output)
     api_response_file = 'api_response.json'
 
-    # Task 1: Move all files and the directory clipper_output to trash
-    move_files_to_trash(clipper_output_dir)
-
-    # Task 2: Move all .mp4 files in clipper_output to trash
-    move_files_to_trash(clipper_output_dir, file_extension='.mp4')
+    # Task 1: Delete the intermediates (trimmed clips, clip sections, audio downloads, analysis caches).
+    # They may live on a scratch filesystem without a trash, and are never worth restoring
+    remove_intermediates(workspace.root)
 
-    # Task 3: Move all files and the directory whisper_output to trash
+    # Task 2: Move all files and the directory whisper_output to trash
     move_files_to_trash(whisper_output_dir)
 
-    # Task 4: Move all files in crew_output to trash, excluding api_response.json, but do not move the directory itself
+    # Task 3: Move all files in crew_output to trash, excluding api_response.json, but do not move the directory itself
     move_files_to_trash(crew_output_dir, exclude_files=[api_response_file])
 
-    # Task 5: Move all mp4 files in input_files to trash, excluding PLACE_CLIPS_HERE
+    # Task 4: Move all mp4 files in input_files to trash, excluding PLACE_CLIPS_HERE
     move_files_to_trash(input_files_dir, exclude_files=['PLACE_CLIPS_HERE'], file_extension='.mp4')
 
-    # Task 6: Move all mp4 files in subtitler_output to trash if the directory exists
+    # Task 5: Move all mp4 files in subtitler_output to trash if the directory exists
     if os.path.exists(subtitler_output_dir):
         move_files_to_trash(subtitler_output_dir, file_extension='.mp4')
 
@@ -0,0 +1,208 @@
+"""
+Tail-latency control for LLM calls.
+
+`call_with_resilience` runs one call under a deadline. Failed attempts are retried after a
+jittered exponential backoff ("full jitter": a random delay up to base * 2**attempt, capped).
+When hedging is on, a second identical request is sent once the first has been running
+longer than a percentile of the recent latencies of the same model. The first answer wins.
+
+`complete_validated` checks each response with a validator and, when it is rejected, sends
+the model its previous answer and the validation error and asks for a corrected one. The
+validator is a callable that returns the parsed value or raises ValueError.
+
+Settings (environment variables):
+    LLM_CALL_DEADLINE      seconds per call including retries (default 300)
+    LLM_MAX_ATTEMPTS       attempts per call (default 4)
+    LLM_HEDGE_PERCENTILE   send a hedged request after this latency percentile, e.g. 95 (default off)
+"""
+
+# Standard library imports
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+
+# Third party imports
+
+# Local application imports
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_DEADLINE = 300.0
+DEFAULT_MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+# Latencies kept per model, and the number needed before hedging starts
+LATENCY_WINDOW = 100
+MIN_LATENCY_SAMPLES = 20
+DEFAULT_REPAIRS = 2
+
+# Client errors that another attempt cannot fix; 408 (timeout), 409 and 429 (rate limit) are retried
+RETRYABLE_CLIENT_STATUSES = {408, 409, 429}
+
+_random = random.Random()
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call has not succeeded within its deadline."""
+
+
+class InvalidResponseError(ValueError):
+    """Raised when every response of a validated call was rejected; keeps the last response."""
+
+    def __init__(self, message, response_text):
+        super().__init__(message)
+        self.response_text = response_text
+
+
+def is_retryable(error):
+    """
+    Returns False for errors that will fail again on retry: configuration errors, requests the
+    provider rejected as invalid, and errors that declare `retryable = False`.
+    """
+    if not getattr(error, 'retryable', True):
+        return False
+    status = getattr(error, 'status_code', None)
+    if status is not None and 400 <= status < 500 and status not in RETRYABLE_CLIENT_STATUSES:
+        return False
+    return not isinstance(error, (ValueError, TypeError, KeyError))
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+    Full-jitter delay before retry number attempt (0-based).
+    """
+    return _random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """
+    The most recent successful call latencies of one model.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, percent):
+        """
+        Returns the latency percentile, or None until MIN_LATENCY_SAMPLES calls have been seen.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+
+def _start(func):
+    """
+    Runs func on a daemon thread and returns a Future of its result. An attempt that outlives
+    its deadline is abandoned, not joined, so it can never block shutdown.
+    """
+    future = Future()
+
+    def run():
+        started = time.monotonic()
+        try:
+            future.set_result((func(), time.monotonic() - started))
+        except BaseException as e:  # pylint: disable=broad-except
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def _attempt(func, remaining, hedge_after):
+    """
+    Runs one attempt, plus a hedged duplicate if it is still running after hedge_after seconds.
+    Returns (result, latency) of the first success, or raises the last error.
+    """
+    started = time.monotonic()
+    futures = [_start(func)]
+    if hedge_after is not None and hedge_after < remaining:
+        done, _ = wait(futures, timeout=hedge_after)
+        if not done:
+            logging.info(f"LLM call still running after {hedge_after:.1f}s, sending a hedged request")
+            futures.append(_start(func))
+    error = None
+    while futures:
+        timeout = remaining - (time.monotonic() - started)
+        if timeout <= 0:
+            break
+        done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            futures.remove(future)
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    if error is not None and not futures:
+        raise error
+    raise DeadlineExceeded(f"LLM call did not finish within {remaining:.0f}s")
+
+
+def call_with_resilience(func, deadline=None, max_attempts=None, hedge_percentile=None, tracker=None):
+    """
+    Calls func until it succeeds, retrying retryable errors with jittered exponential backoff,
+    and raises DeadlineExceeded once deadline seconds have passed. With hedge_percentile and a
+    tracker, slow attempts are hedged (see module docstring).
+    """
+    deadline = float(os.getenv('LLM_CALL_DEADLINE', str(DEFAULT_DEADLINE))) if deadline is None else deadline
+    max_attempts = int(os.getenv('LLM_MAX_ATTEMPTS', str(DEFAULT_MAX_ATTEMPTS))) if max_attempts is None else max_attempts
+    if hedge_percentile is None and os.getenv('LLM_HEDGE_PERCENTILE'):
+        hedge_percentile = float(os.getenv('LLM_HEDGE_PERCENTILE'))
+    expires = time.monotonic() + deadline
+
+    for attempt in range(max_attempts):
+        hedge_after = tracker.percentile(hedge_percentile) if tracker and hedge_percentile else None
+        try:
+            result, latency = _attempt(func, expires - time.monotonic(), hedge_after)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:  # pylint: disable=broad-except
+            if not is_retryable(e) or attempt == max_attempts - 1:
+                raise
+            delay = backoff_delay(attempt)
+            if time.monotonic() + delay >= expires:
+                raise
+            logging.warning(f"LLM call failed ({e}); retry {attempt + 1} of {max_attempts - 1} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        if tracker is not None:
+            tracker.record(latency)
+        return result
+    raise ValueError(f"max_attempts must be at least 1, not {max_attempts}")
+
+
+def complete_validated(backend, messages, validate, max_repairs=DEFAULT_REPAIRS, **params):
+    """
+    Returns validate(response) for a backend call, re-asking up to max_repairs times with the
+    validation error when the response is rejected. Raises InvalidResponseError if every
+    response is invalid.
+    """
+    messages = list(messages)
+    for repair in range(max_repairs + 1):
+        response_text = backend.complete(messages, **params)
+        try:
+            return validate(response_text)
+        except ValueError as e:
+            if repair == max_repairs:
+                raise InvalidResponseError(str(e), response_text) from e
+            logging.warning(f"Invalid {backend.provider}/{backend.model} response ({e}); asking for a correction")
+            messages = messages + [
+                {'role': 'assistant', 'content': response_text},
+                {'role': 'user', 'content': f"Your answer is invalid: {e}\n"
+                                            f"Reply again with the complete corrected answer only, "
+                                            f"in exactly the format requested above."},
+            ]
+    raise ValueError(f"max_repairs must not be negative, not {max_repairs}")
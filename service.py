@@ -0,0 +1,313 @@
+"""
+Long-running service mode.
+
+Keeps the Whisper model, LLM clients and an ffmpeg worker pool warm across jobs and accepts
+jobs over a local HTTP API:
+
+    POST /jobs                       JSON {"url": ..., "aspect_ratio": "1"-"5" or "9:16,1:1", "sections_only": false,
+                                           "smart_crop": false, "snap_boundaries": false, "dedupe": false}
+    POST /jobs?filename=x.mp4        raw video upload; optional aspect_ratio, smart_crop, snap_boundaries,
+                                     dedupe and deadline (transcription turnaround in seconds) query parameters
+    GET  /jobs                       all jobs
+    GET  /jobs/<id>                  job status and artifact names
+    GET  /jobs/<id>/artifacts/<name> download a finished clip
+    GET  /health                     liveness check
+
+Every job runs in its own workspace under the jobs root.
+"""
+
+# Standard library imports
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Third party imports
+
+# Local application imports
+import app
+import pipeline
+import extracts
+import crew
+import llm_backends
+import local_transcribe
+import transcription_engines
+from clipper import resolve_profiles
+from artifacts import atomic_path
+from workspace import Workspace, DEFAULT_JOBS_ROOT
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class Job:
+    def __init__(self, workspace, kind, source, options):
+        self.id = workspace.job_id
+        self.workspace = workspace
+        self.kind = kind
+        self.source = source
+        self.options = options
+        self.status = 'queued'
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def artifacts(self):
+        output_dir = self.workspace.subtitler_output
+        if not output_dir.exists():
+            return []
+        return sorted(path.name for path in output_dir.glob('*.mp4'))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'kind': self.kind,
+            'source': self.source,
+            'options': self.options,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'artifacts': self.artifacts(),
+        }
+
+
+class JobService:
+    """
+    Runs pipeline jobs on a fixed number of job threads, sharing one warm Whisper model,
+    the cached LLM backends and one ffmpeg encode pool between them.
+    """
+
+    def __init__(self, jobs_root=DEFAULT_JOBS_ROOT, max_jobs=2, encode_workers=None):
+        self.jobs_root = jobs_root
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self.job_pool = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='job')
+        self.encode_pool = ThreadPoolExecutor(max_workers=encode_workers or max(1, (os.cpu_count() or 2) // 2),
+                                              thread_name_prefix='ffmpeg')
+
+    def warm(self, whisper_model=True):
+        """
+        Loads the Whisper model jobs will use (TRANSCRIBE_ENGINE and TRANSCRIBE_MODEL) and the LLM
+        clients before the first job arrives.
+        """
+        llm_backends.get_backend('openai', extracts.OPENAI_MODEL)
+        llm_backends.get_backend('gemini', crew.GEMINI_MODEL)
+        if whisper_model:
+            transcription_engines.get_engine(model_name=transcription_engines.default_model_name()).load()
+        logging.info("Service warm-up complete")
+
+    def _add(self, job):
+        with self._lock:
+            self.jobs[job.id] = job
+        logging.info(f"Queued job {job.id} ({job.source})")
+        self.job_pool.submit(self._run, job)
+        return job
+
+    def submit_url(self, url, aspect_ratio_choice='1', sections_only=False, smart_crop=False, snap_boundaries=False,
+                   topic=None, dedupe=False):
+        # An unknown profile fails the request (400) instead of the job
+        resolve_profiles(aspect_ratio_choice)
+        workspace = Workspace.create(self.jobs_root)
+        options = {'aspect_ratio': aspect_ratio_choice, 'sections_only': sections_only, 'smart_crop': smart_crop,
+                   'snap_boundaries': snap_boundaries, 'topic': topic, 'dedupe': dedupe}
+        return self._add(Job(workspace, 'url', url, options))
+
+    def submit_file(self, filename, stream, length, aspect_ratio_choice='1', smart_crop=False,
+                    snap_boundaries=False, deadline=None, topic=None, dedupe=False):
+        filename = os.path.basename(filename)
+        if not filename.endswith('.mp4'):
+            raise ValueError("Only .mp4 uploads are supported")
+        resolve_profiles(aspect_ratio_choice)
+        workspace = Workspace.create(self.jobs_root)
+        try:
+            with atomic_path(workspace.input_files / filename) as partial_path:
+                with open(partial_path, 'wb') as file:
+                    remaining = length
+                    while remaining > 0:
+                        chunk = stream.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            raise ValueError("Upload ended before Content-Length bytes were received")
+                        file.write(chunk)
+                        remaining -= len(chunk)
+        except ValueError:
+            # A truncated upload leaves no job behind
+            for folder in (workspace.root, workspace.scratch):
+                if folder is not None:
+                    shutil.rmtree(folder, ignore_errors=True)
+            raise
+        return self._add(Job(workspace, 'file', filename,
+                             {'aspect_ratio': aspect_ratio_choice, 'smart_crop': smart_crop,
+                              'snap_boundaries': snap_boundaries, 'deadline': deadline, 'topic': topic,
+                              'dedupe': dedupe}))
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _run(self, job):
+        job.status = 'running'
+        job.started = time.time()
+        workspace = job.workspace
+        try:
+            if job.kind == 'file':
+                input_folder = str(workspace.input_files)
+                whisper_output_folder = str(workspace.whisper_output)
+                pipeline.run_local_pipeline(workspace, job.options['aspect_ratio'],
+                                            transcribe=lambda: local_transcribe.local_whisper_process(
+                                                input_folder, whisper_output_folder,
+                                                whisper_output_folder=whisper_output_folder,
+                                                deadline=job.options.get('deadline')),
+                                            encode_pool=self.encode_pool,
+                                            smart_crop=job.options.get('smart_crop', False),
+                                            snap_boundaries=job.options.get('snap_boundaries', False),
+                                            topic=job.options.get('topic'),
+                                            dedupe=job.options.get('dedupe', False))
+            else:
+                pipeline.run_youtube_pipeline(job.source, workspace, job.options['aspect_ratio'],
+                                              sections_only=job.options.get('sections_only', False),
+                                              encode_pool=self.encode_pool,
+                                              smart_crop=job.options.get('smart_crop', False),
+                                              snap_boundaries=job.options.get('snap_boundaries', False),
+                                              topic=job.options.get('topic'),
+                                              dedupe=job.options.get('dedupe', False))
+            job.status = 'done'
+        except Exception as e:  # pylint: disable=broad-except
+            logging.exception(f"Job {job.id} failed")
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            logging.info(f"Job {job.id} {job.status} in {job.finished - job.started:.1f}s")
+
+    def shutdown(self):
+        self.job_pool.shutdown(wait=True)
+        self.encode_pool.shutdown(wait=True)
+
+
+def _query_flag(query, name, default):
+    if name not in query:
+        return default
+    return query[name][0].lower() in ('1', 'true', 'yes')
+
+
+def make_handler(service):
+    class ServiceHandler(BaseHTTPRequestHandler):
+        def _reply_json(self, status, payload):
+            body = json.dumps(payload, indent=2).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _reply_file(self, path):
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(path.stat().st_size))
+            self.send_header('Content-Disposition', f'attachment; filename="{path.name}"')
+            self.end_headers()
+            with open(path, 'rb') as file:
+                shutil.copyfileobj(file, self.wfile)
+
+        def do_GET(self):
+            parts = [part for part in urlparse(self.path).path.split('/') if part]
+            if parts == ['health']:
+                self._reply_json(200, {'status': 'ok', 'jobs': len(service.list())})
+            elif parts == ['jobs']:
+                self._reply_json(200, [job.to_dict() for job in service.list()])
+            elif len(parts) >= 2 and parts[0] == 'jobs':
+                job = service.get(parts[1])
+                if job is None:
+                    self._reply_json(404, {'error': f"Unknown job: {parts[1]}"})
+                elif len(parts) == 2:
+                    self._reply_json(200, job.to_dict())
+                elif len(parts) == 4 and parts[2] == 'artifacts' and parts[3] in job.artifacts():
+                    self._reply_file(job.workspace.subtitler_output / parts[3])
+                else:
+                    self._reply_json(404, {'error': f"Not found: {self.path}"})
+            else:
+                self._reply_json(404, {'error': f"Not found: {self.path}"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path.rstrip('/') != '/jobs':
+                self._reply_json(404, {'error': f"Not found: {self.path}"})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    request = json.loads(self.rfile.read(length).decode('utf-8'))
+                    if 'url' not in request:
+                        raise ValueError("Missing 'url'")
+                    job = service.submit_url(request['url'], str(request.get('aspect_ratio', '1')),
+                                             bool(request.get('sections_only', False)),
+                                             bool(request.get('smart_crop', False)),
+                                             bool(request.get('snap_boundaries', False)),
+                                             request.get('topic'),
+                                             bool(request.get('dedupe', False)))
+                else:
+                    query = parse_qs(url.query)
+                    if 'filename' not in query:
+                        raise ValueError("Missing 'filename' query parameter for upload")
+                    job = service.submit_file(query['filename'][0], self.rfile, length,
+                                              query.get('aspect_ratio', ['1'])[0],
+                                              _query_flag(query, 'smart_crop', False),
+                                              _query_flag(query, 'snap_boundaries', False),
+                                              float(query['deadline'][0]) if 'deadline' in query else None,
+                                              query.get('topic', [None])[0],
+                                              _query_flag(query, 'dedupe', False))
+            except ValueError as e:
+                self._reply_json(400, {'error': str(e)})
+                return
+            self._reply_json(202, job.to_dict())
+
+        def log_message(self, format, *args):
+            logging.info(f"service: {format % args}")
+
+    return ServiceHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run viral-clips-crew as a local job service.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--jobs-root', default=DEFAULT_JOBS_ROOT)
+    parser.add_argument('--max-jobs', type=int, default=2, help="Jobs running at the same time")
+    parser.add_argument('--encode-workers', type=int, default=None, help="Concurrent ffmpeg encodes")
+    parser.add_argument('--no-warm-model', action='store_true',
+                        help="Do not preload the Whisper model (e.g. for YouTube-transcript-only hosts)")
+    args = parser.parse_args()
+
+    app.check_required_vars()
+
+    service = JobService(args.jobs_root, args.max_jobs, args.encode_workers)
+    service.warm(whisper_model=not args.no_warm_model)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    logging.info(f"Service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down")
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,14 +9,29 @@ import logging
 # Third party imports
 
 # Local application imports
+import media_info
+from artifacts import atomic_path
+from clipper import clip_base_name, read_clip_lead
+from utils import shift_srt, srt_interval
+from workspace import default_workspace
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-def adjust_subtitle_timing(subtitle_path, output_path):
+def adjust_subtitle_timing(subtitle_path, output_path, lead_seconds=None):
     """
-    Adjusts subtitle timings to start from the beginning of the video.
+    Adjusts subtitle timings to start from the beginning of the video, or lead_seconds after it
+    when the clip was not cut on its first subtitle.
     """
+    if lead_seconds is not None:
+        with open(subtitle_path, 'r', encoding='utf-8') as file:
+            content = file.read()
+        interval = srt_interval(content)
+        with open(output_path, 'w', encoding='utf-8') as file:
+            file.write(shift_srt(content, lead_seconds - interval[0]) if interval else content)
+        logging.info(f"Subtitles timings adjusted: {output_path}")
+        return
+
     with open(subtitle_path, 'r', encoding='utf-8') as file:
         lines = file.readlines()
 
@@ -48,6 +63,18 @@ def adjust_subtitle_timing(subtitle_path, output_path):
     logging.info(f"Subtitles timings adjusted: {output_path}")
 
 
+def warn_if_subtitles_overrun(video_path, subtitle_path, probe_cache=None):
+    """
+    Warns when subtitles run past the end of the clip they are burned into, which means the
+    clip and its subtitles are out of sync.
+    """
+    clip_duration = media_info.duration(video_path, probe_cache)
+    with open(subtitle_path, 'r', encoding='utf-8') as file:
+        interval = srt_interval(file.read())
+    if clip_duration is not None and interval is not None and interval[1] > clip_duration + 1:
+        logging.warning(f"Subtitles end at {interval[1]:.1f}s but {video_path} is {clip_duration:.1f}s long")
+
+
 def convert_to_utf8(subtitle_path, output_path):
     """
     Converts subtitle file encoding to UTF-8.
@@ -67,22 +94,22 @@ def burn_subtitles(video_path, subtitle_path, output_video_path):
     """
     Uses ffmpeg to burn subtitles into the video.
     """
-    cmd = [
-        'ffmpeg',
-        '-i', video_path,
-        '-vf', f"subtitles={subtitle_path}",
-        '-c:a', 'copy',
-        output_video_path
-    ]
-    
     try:
-        subprocess.run(cmd, check=True)
+        with atomic_path(output_video_path) as partial_video_path:
+            cmd = [
+                'ffmpeg',
+                '-i', video_path,
+                '-vf', f"subtitles={subtitle_path}",
+                '-c:a', 'copy',
+                str(partial_video_path)
+            ]
+            subprocess.run(cmd, check=True)
         logging.info(f"Subtitles have been burned into the video: {output_video_path}")
     except subprocess.CalledProcessError as e:
         logging.error(f"Error burning subtitles: {e}")
 
 
-def process_video_and_subtitles(video_path, subtitle_path, output_folder):
+def process_video_and_subtitles(video_path, subtitle_path, output_folder, probe_cache=None):
     """
     Full processing of video and subtitles.
     """
@@ -94,7 +121,8 @@ def process_video_and_subtitles(video_path, subtitle_path, output_folder):
     utf8_subtitle_path = os.path.join(output_folder, base_name + '_utf8.srt')
     output_video_path = os.path.join(output_folder, base_name + '_subtitled.mp4')
 
-    adjust_subtitle_timing(subtitle_path, adjusted_subtitle_path)
+    adjust_subtitle_timing(subtitle_path, adjusted_subtitle_path, read_clip_lead(video_path))
+    warn_if_subtitles_overrun(video_path, adjusted_subtitle_path, probe_cache)
     convert_to_utf8(adjusted_subtitle_path, utf8_subtitle_path)
     burn_subtitles(video_path, utf8_subtitle_path, output_video_path)
 
@@ -104,9 +132,10 @@ def process_video_and_subtitles(video_path, subtitle_path, output_folder):
 
 
 if __name__ == "__main__":
-    trimmed_videos = glob.glob('clipper_output/*_trimmed.mp4')
-    subtitle_files = glob.glob('crew_output/*.srt')
-    output_folder = "subtitler_output"  # Ensure this is correctly set
+    workspace = default_workspace()
+    trimmed_videos = glob.glob(str(workspace.clipper_output / '*_trimmed.mp4'))
+    subtitle_files = glob.glob(str(workspace.crew_output / '*.srt'))
+    output_folder = str(workspace.subtitler_output)  # Ensure this is correctly set
 
     # Check if output_folder exists, create it if not
     if not os.path.exists(output_folder):
@@ -115,9 +144,9 @@ if __name__ == "__main__":
     subtitle_dict = {os.path.splitext(os.path.basename(s))[0]: s for s in subtitle_files}
 
     for trimmed_video in trimmed_videos:
-        base_name = os.path.splitext(os.path.basename(trimmed_video))[0].replace('_trimmed', '')
+        base_name = clip_base_name(os.path.splitext(os.path.basename(trimmed_video))[0])
         subtitle_file = subtitle_dict.get(base_name)
         if subtitle_file:
-            process_video_and_subtitles(trimmed_video, subtitle_file, output_folder)
+            process_video_and_subtitles(trimmed_video, subtitle_file, output_folder, workspace.probe_cache)
         else:
             logging.error(f"Subtitle file not found for {trimmed_video}")
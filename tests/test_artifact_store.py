@@ -0,0 +1,127 @@
+# Standard library imports
+import os
+import time
+import socket
+import sqlite3
+import subprocess
+import sys
+from contextlib import closing
+
+# Third party imports
+import pytest
+
+# Local application imports
+import artifact_store
+from artifact_store import ArtifactStore
+
+
+@pytest.fixture(autouse=True)
+def no_scratch(monkeypatch):
+    monkeypatch.delenv('VCC_SCRATCH', raising=False)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(tmp_path / 'artifacts.db')
+
+
+def intermediate(root, folder, name, size, age_seconds):
+    path = root / folder / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'x' * size)
+    used = time.time() - age_seconds
+    os.utime(path, (used, used))
+    return path
+
+
+@pytest.mark.parametrize('size, expected', [
+    ('512', 512),
+    ('512M', 512 * 1024 ** 2),
+    ('20G', 20 * 1024 ** 3),
+    ('1.5k', 1536),
+    ('2GB', 2 * 1024 ** 3),
+])
+def test_parse_size(size, expected):
+    assert artifact_store.parse_size(size) == expected
+
+
+def test_collect_deletes_least_recently_used_first(store, tmp_path):
+    job = tmp_path / 'job'
+    oldest = intermediate(job, 'clipper_output', 'a.mp4', 100, age_seconds=300)
+    older = intermediate(job, 'analysis', 'a.proxy.gray', 100, age_seconds=200)
+    newest = intermediate(job, 'input_files/sections', 'a.mp4', 100, age_seconds=100)
+
+    assert store.collect(150, [job]) == 200
+
+    assert not oldest.exists() and not older.exists()
+    assert newest.exists()
+
+
+def test_collect_keeps_everything_under_the_cap(store, tmp_path):
+    job = tmp_path / 'job'
+    clip = intermediate(job, 'clipper_output', 'a.mp4', 100, age_seconds=300)
+
+    assert store.collect(100, [job]) == 0
+    assert clip.exists()
+
+
+def test_collect_never_touches_final_outputs_or_partial_files(store, tmp_path):
+    job = tmp_path / 'job'
+    final = intermediate(job, 'subtitler_output', 'a_subtitled.mp4', 100, age_seconds=900)
+    partial = intermediate(job, 'clipper_output/.partial', 'b.mp4', 100, age_seconds=900)
+    intermediate(job, 'clipper_output', 'a.mp4', 100, age_seconds=300)
+
+    store.collect(0, [job])
+
+    assert final.exists() and partial.exists()
+
+
+def test_collect_skips_referenced_workspaces(store, tmp_path):
+    running, finished = tmp_path / 'running', tmp_path / 'finished'
+    running_clip = intermediate(running, 'clipper_output', 'a.mp4', 100, age_seconds=900)
+    finished_clip = intermediate(finished, 'clipper_output', 'a.mp4', 100, age_seconds=100)
+    store.acquire('running-job', running)
+
+    assert store.collect(0, [running, finished]) == 100
+
+    assert running_clip.exists()
+    assert not finished_clip.exists()
+
+    store.release('running-job')
+    store.collect(0, [running, finished])
+    assert not running_clip.exists()
+
+
+def test_collect_skips_referenced_scratch_folders(store, tmp_path, monkeypatch):
+    monkeypatch.setenv('VCC_SCRATCH', str(tmp_path / 'scratch'))
+    job = tmp_path / 'job'
+    scratch = artifact_store.scratch_dir(job)
+    clip = intermediate(scratch, 'clipper_output', 'a.mp4', 100, age_seconds=900)
+    store.acquire('job', job)
+
+    assert store.collect(0, [scratch]) == 0
+    assert clip.exists()
+
+
+def test_referenced_roots_drops_dead_processes(store, tmp_path):
+    finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                              capture_output=True, text=True, check=True)
+    dead_pid = int(finished.stdout)
+    with closing(sqlite3.connect(store.db_path, isolation_level=None)) as connection:
+        connection.execute('INSERT INTO refs (job_id, root, host, pid, acquired) VALUES (?, ?, ?, ?, ?)',
+                           ('crashed', str(tmp_path / 'crashed'), socket.gethostname(), dead_pid, time.time()))
+    store.acquire('live', tmp_path / 'live')
+
+    assert store.referenced_roots() == {str((tmp_path / 'live').resolve())}
+
+
+def test_scratch_dir_is_unique_per_workspace(tmp_path, monkeypatch):
+    assert artifact_store.scratch_dir(tmp_path / 'a' / 'job') is None
+
+    monkeypatch.setenv('VCC_SCRATCH', str(tmp_path / 'scratch'))
+    first = artifact_store.scratch_dir(tmp_path / 'a' / 'job')
+    second = artifact_store.scratch_dir(tmp_path / 'b' / 'job')
+
+    assert first.parent == second.parent == tmp_path / 'scratch'
+    assert first != second
+    assert first.name.startswith('job_')
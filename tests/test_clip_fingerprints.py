@@ -0,0 +1,128 @@
+# Standard library imports
+import os
+
+# Third party imports
+import numpy as np
+import pytest
+
+# Local application imports
+import clip_fingerprints
+from boundaries import ENVELOPE_RATE, Envelope
+from clip_fingerprints import FingerprintStore, clip_fingerprint, is_duplicate, link_outputs
+
+TEXT = ("Sight turned into insight when we stopped asking what the market wanted and started asking "
+        "what our customers were actually doing with the product every single day of the week")
+SRT = f"1\n00:00:01,000 --> 00:00:30,000\n{TEXT}\n\n2\n00:00:30,000 --> 00:00:45,000\nThanks for listening.\n"
+OTHER_TEXT = ("The recipe calls for two cups of flour, a pinch of salt and butter that has been left out "
+              "overnight so it is soft enough to fold into the dough without tearing it apart")
+
+
+def envelope(seed, seconds=60):
+    rng = np.random.default_rng(seed)
+    return Envelope(rng.random(int(seconds * ENVELOPE_RATE)).astype(np.float32), 0.1)
+
+
+def test_srt_text_drops_numbers_and_timings():
+    assert clip_fingerprints.srt_text(SRT) == f"{TEXT} Thanks for listening."
+
+
+def test_minhash_similarity_tracks_text_overlap():
+    signature = clip_fingerprints.minhash(TEXT)
+
+    assert clip_fingerprints.text_similarity(signature, clip_fingerprints.minhash(TEXT.upper())) == 1.0
+    edited = TEXT.replace("every single day", "every day")
+    assert clip_fingerprints.text_similarity(signature, clip_fingerprints.minhash(edited)) >= 0.7
+    assert clip_fingerprints.text_similarity(signature, clip_fingerprints.minhash(OTHER_TEXT)) < 0.2
+
+
+def test_similar_texts_share_an_lsh_band():
+    bands = clip_fingerprints.band_hashes(clip_fingerprints.minhash(TEXT))
+    other = clip_fingerprints.band_hashes(clip_fingerprints.minhash(TEXT + " Really."))
+
+    assert len(bands) == clip_fingerprints.LSH_BANDS
+    assert set(bands) & set(other)
+
+
+def test_audio_fingerprint_matches_with_small_offset():
+    source = envelope(1)
+    bits = clip_fingerprints.audio_fingerprint(source, 10, 40)
+
+    assert clip_fingerprints.audio_similarity(bits, clip_fingerprints.audio_fingerprint(source, 11, 41)) == 1.0
+    assert clip_fingerprints.audio_similarity(bits, clip_fingerprints.audio_fingerprint(envelope(2), 10, 40)) < 0.8
+
+
+def test_audio_fingerprint_needs_enough_audio():
+    assert clip_fingerprints.audio_fingerprint(envelope(1), 10, 11) is None
+
+
+def test_same_text_in_different_recordings_is_not_a_duplicate():
+    first = clip_fingerprint(SRT, envelope(1), (10, 40))
+
+    assert is_duplicate(first, clip_fingerprint(SRT, envelope(1), (10, 40)))
+    assert not is_duplicate(first, clip_fingerprint(SRT, envelope(2), (10, 40)))
+    # Without audio on one side, the text decides
+    assert is_duplicate(first, clip_fingerprint(SRT))
+    assert not is_duplicate(first, clip_fingerprint(OTHER_TEXT))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FingerprintStore(tmp_path / 'fingerprints.db')
+
+
+def rendered(tmp_path, name):
+    path = tmp_path / 'outputs' / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'mp4')
+    return path
+
+
+def test_store_finds_duplicate_rendered_in_requested_profiles(store, tmp_path):
+    vertical = rendered(tmp_path, 'clip_9x16.mp4')
+    clip_id = store.add(clip_fingerprint(SRT), '/videos/talk.mp4', 'clip', (1.0, 45.0), {'9:16': vertical})
+
+    duplicate = store.find_duplicate(clip_fingerprint(SRT), ['9:16'])
+
+    assert duplicate == {'id': clip_id, 'source': '/videos/talk.mp4', 'base_name': 'clip',
+                         'outputs': {'9:16': str(vertical)}}
+    assert store.find_duplicate(clip_fingerprint(SRT), ['9:16', '1:1']) is None
+    assert store.find_duplicate(clip_fingerprint(OTHER_TEXT), ['9:16']) is None
+    assert store.stats() == {'clips': 1}
+
+
+def test_store_skips_clips_whose_outputs_are_gone(store, tmp_path):
+    vertical = rendered(tmp_path, 'clip_9x16.mp4')
+    store.add(clip_fingerprint(SRT), '/videos/talk.mp4', 'clip', None, {'9:16': vertical})
+    vertical.unlink()
+
+    assert store.find_duplicate(clip_fingerprint(SRT), ['9:16']) is None
+
+
+def test_store_keeps_audio_fingerprint(store, tmp_path):
+    fingerprint = clip_fingerprint(SRT, envelope(1), (10, 40))
+    store.add(fingerprint, '/videos/talk.mp4', 'clip', (10, 40), {'original': rendered(tmp_path, 'clip.mp4')})
+
+    assert store.find_duplicate(clip_fingerprint(SRT, envelope(1), (10, 40)), ['original']) is not None
+    assert store.find_duplicate(clip_fingerprint(SRT, envelope(2), (10, 40)), ['original']) is None
+
+
+def test_link_outputs_links_each_profile(tmp_path):
+    output = rendered(tmp_path, 'clip_9x16.mp4')
+    target = tmp_path / 'job' / 'subtitler_output' / 'new_9x16.mp4'
+    duplicate = {'outputs': {'9:16': str(output)}}
+
+    assert link_outputs(duplicate, {'9:16': target}) == [str(target)]
+    assert os.path.samefile(target, output)
+    # Linking again is a no-op
+    assert link_outputs(duplicate, {'9:16': target}) == [str(target)]
+
+
+def test_link_outputs_replaces_stale_file(tmp_path):
+    output = rendered(tmp_path, 'clip.mp4')
+    target = tmp_path / 'job' / 'clip.mp4'
+    target.parent.mkdir()
+    target.write_bytes(b'stale')
+
+    link_outputs({'outputs': {'original': str(output)}}, {'original': target})
+
+    assert target.read_bytes() == b'mp4'
@@ -0,0 +1,122 @@
+# Third party imports
+import pytest
+
+# Local application imports
+import prompt_prep
+from prompt_prep import count_tokens, cue_line, expand_cue_range, fit_text, parse_cues, strip_fillers
+
+SRT = """1
+00:00:01,000 --> 00:00:02,500
+Hello there.
+
+2
+00:00:03,000 --> 00:00:04,000
+General
+Kenobi!
+
+3
+00:01:05,000 --> 00:01:06,000
+Bye.
+"""
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("So, um, I think, you know, it works.", "So I think it works."),
+    ("Uh, the answer is, I mean, yes.", "the answer is yes."),
+    ("[Music] Welcome back. [Applause]", "Welcome back."),
+    ("Hmm, okay mm-hmm right", "okay right"),
+])
+def test_strip_fillers_removes_fillers_hedges_and_caption_tags(text, expected):
+    assert strip_fillers(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("I I think the the the answer is yes.", "I think the answer is yes."),
+    ("it's it's great and and fine", "it's great and fine"),
+    ("no no no", "no"),
+])
+def test_strip_fillers_collapses_stutters(text, expected):
+    assert strip_fillers(text) == expected
+
+
+@pytest.mark.parametrize('text', [
+    "We had had enough.",
+    "That that is fine.",
+    "Bye-bye now.",
+    "Ahmed said umbrella.",
+    "Say it, you know what I mean.",
+])
+def test_strip_fillers_keeps_meaningful_words(text):
+    assert strip_fillers(text) == text
+
+
+def test_parse_cues_reads_numbers_times_and_joined_text():
+    cues = parse_cues(SRT)
+
+    assert [cue.index for cue in cues] == [1, 2, 3]
+    assert (cues[0].start, cues[0].end) == (1.0, 2.5)
+    assert cues[1].text == "General Kenobi!"
+    assert cues[2].timing == "00:01:05,000 --> 00:01:06,000"
+
+
+def test_parse_cues_skips_malformed_blocks():
+    assert parse_cues("not a cue\n\n7\nno timing here\n\n" + SRT)[0].index == 1
+
+
+def test_cue_line_is_compact():
+    assert cue_line(parse_cues(SRT)[2]) == "#3 [01:05] Bye."
+
+
+@pytest.mark.parametrize('answer, expected', [
+    ("1-2", [1, 2]),
+    ("Cues #2 to #3", [2, 3]),
+    ("2–3", [2, 3]),
+    ("3", [3]),
+])
+def test_expand_cue_range_returns_original_cues(answer, expected):
+    cues = parse_cues(SRT)
+    assert parse_cues(expand_cue_range(answer, cues)) == [cue for cue in cues if cue.index in expected]
+
+
+@pytest.mark.parametrize('answer, message', [
+    ("I could not find it", "Reply with the ids"),
+    ("4-5", "There is no cue #4"),
+    ("3-1", "comes before the first cue"),
+])
+def test_expand_cue_range_rejects_bad_answers(answer, message):
+    with pytest.raises(ValueError, match=message):
+        expand_cue_range(answer, parse_cues(SRT))
+
+
+def test_fit_text_cuts_at_word_boundary_within_budget():
+    text = ' '.join(f"word{number}" for number in range(500))
+
+    fitted = fit_text(text, 50)
+
+    assert count_tokens(fitted) <= 50
+    assert text.startswith(fitted)
+    assert text[len(fitted)] == ' '
+
+
+def test_fit_text_keeps_text_within_budget():
+    assert fit_text("short text", 50) == "short text"
+
+
+def test_select_cues_keeps_the_cues_around_the_extract():
+    cues = [prompt_prep.Cue(number, number, number + 1, '', f"filler sentence number {number}")
+            for number in range(1, 201)]
+    cues[149] = cues[149]._replace(text="the quick brown fox jumps over the lazy dog")
+    lines = [cue_line(cue) for cue in cues]
+
+    selected = prompt_prep.select_cues(cues, lines, "quick brown fox jumps", budget=100)
+
+    assert lines[149] in selected
+    assert sum(count_tokens(line) for line in selected) <= 100
+    assert selected == lines[lines.index(selected[0]):lines.index(selected[-1]) + 1]
+
+
+def test_token_budget_override(monkeypatch):
+    monkeypatch.setenv('LLM_TOKEN_BUDGETS', '{"crew": 4000}')
+
+    assert prompt_prep.token_budget('crew', 8000) == 4000
+    assert prompt_prep.token_budget('extracts', 100000) == 100000
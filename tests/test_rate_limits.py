@@ -0,0 +1,102 @@
+# Standard library imports
+import json
+
+# Third party imports
+import pytest
+
+# Local application imports
+import rate_limits
+from rate_limits import RateLimiter, SQLiteTokenBucket, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limits.time, 'monotonic', clock)
+    return clock
+
+
+def test_bucket_starts_full_and_refills_at_rate(clock):
+    bucket = TokenBucket(capacity=10, rate=2)
+
+    assert bucket.try_take(10) == 0
+    assert bucket.try_take(4) == pytest.approx(2.0)
+    clock.now += 2
+    assert bucket.try_take(4) == 0
+
+
+def test_bucket_never_refills_past_capacity(clock):
+    bucket = TokenBucket(capacity=10, rate=2)
+    clock.now += 3600
+
+    assert bucket.try_take(10) == 0
+    assert bucket.try_take(1) == pytest.approx(0.5)
+
+
+def test_oversized_take_waits_for_full_bucket_and_leaves_debt(clock):
+    bucket = TokenBucket(capacity=10, rate=1)
+    bucket.try_take(5)
+
+    assert bucket.try_take(25) == pytest.approx(5.0)
+    clock.now += 5
+    assert bucket.try_take(25) == 0
+    # 15 tokens of debt plus the one asked for
+    assert bucket.try_take(1) == pytest.approx(16.0)
+
+
+def test_drain_empties_bucket(clock):
+    bucket = TokenBucket(capacity=10, rate=1)
+    bucket.drain()
+    assert bucket.try_take(1) == pytest.approx(1.0)
+
+
+def test_sqlite_bucket_is_shared_between_instances(tmp_path):
+    db_path = tmp_path / 'rate_limits.db'
+    first = SQLiteTokenBucket(db_path, 'openai/gpt:tokens', capacity=100, rate=0.001)
+    second = SQLiteTokenBucket(db_path, 'openai/gpt:tokens', capacity=100, rate=0.001)
+    other_key = SQLiteTokenBucket(db_path, 'gemini/pro:tokens', capacity=100, rate=0.001)
+
+    assert first.try_take(80) == 0
+    assert second.try_take(80) > 0
+    assert other_key.try_take(80) == 0
+
+
+def test_limiter_takes_one_request_and_the_tokens(clock):
+    limiter = RateLimiter('openai/test', rpm=60, tpm=600)
+
+    assert limiter.acquire(100) == 0
+    assert limiter.buckets[0].try_take(60) == pytest.approx(1.0)
+    assert limiter.token_bucket.try_take(600) == pytest.approx(10.0)
+
+
+def test_model_limits_override_provider_limits(monkeypatch):
+    monkeypatch.setenv('LLM_RATE_LIMITS', json.dumps({
+        'openai': {'tpm': 800000},
+        'openai/gpt-4o-mini': {'rpm': 5000},
+    }))
+
+    assert rate_limits.model_limits('openai', 'gpt-4o') == {'rpm': 500, 'tpm': 800000}
+    assert rate_limits.model_limits('openai', 'gpt-4o-mini') == {'rpm': 5000, 'tpm': 800000}
+
+
+def test_token_capacity_is_tpm_or_none(monkeypatch):
+    monkeypatch.setenv('LLM_RATE_LIMITS', json.dumps({'local': {'rpm': 100}}))
+
+    assert rate_limits.token_capacity('openai', 'gpt-4o') == 30000
+    assert rate_limits.token_capacity('local', 'llama') is None
+    assert rate_limits.token_capacity('unknown', 'model') is None
+
+
+def test_estimate_tokens_counts_prompt_and_response_budget():
+    messages = [{'role': 'user', 'content': 'x' * 400}]
+
+    assert rate_limits.estimate_tokens(messages, {'max_tokens': 50}) == 150
+    assert rate_limits.estimate_tokens(messages, {}) == 100 + rate_limits.DEFAULT_COMPLETION_TOKENS
@@ -0,0 +1,102 @@
+# Standard library imports
+import json
+
+# Third party imports
+import pytest
+
+# Local application imports
+import transcript_store
+from prompt_prep import parse_cues
+
+RESULT = {
+    'text': " Hello there. General Kenobi! Ünïcode --> ok.",
+    'language': 'en',
+    'segments': [
+        {'start': 0.0, 'end': 1.5, 'text': " Hello there.",
+         'words': [{'word': " Hello", 'start': 0.0, 'end': 0.5}, {'word': " there.", 'start': 0.5, 'end': 1.5}]},
+        {'start': 2.0, 'end': 3.25, 'text': " General Kenobi!",
+         'words': [{'word': " General", 'start': 2.0, 'end': 2.6}, {'word': " Kenobi!", 'start': 2.6, 'end': 3.25}]},
+        {'start': 3661.0, 'end': 3662.004, 'text': " Ünïcode --> ok."},
+    ],
+}
+
+
+@pytest.fixture
+def transcript(tmp_path):
+    path = transcript_store.write_whisper_result(transcript_store.artifact_path(tmp_path, 'talk'), RESULT)
+    return transcript_store.load_transcript(path)
+
+
+def test_round_trip_keeps_segments(transcript):
+    assert len(transcript) == 3
+    assert transcript.language == 'en'
+    assert list(transcript.segments()) == [
+        (0.0, 1.5, "Hello there."),
+        (2.0, 3.25, "General Kenobi!"),
+        (3661.0, 3662.004, "Ünïcode -> ok."),
+    ]
+
+
+def test_round_trip_keeps_words(transcript):
+    assert list(transcript.word_segment) == [0, 0, 1, 1]
+    assert list(transcript.word_start_ms) == [0, 500, 2000, 2600]
+    assert list(transcript.word_end_ms) == [500, 1500, 2600, 3250]
+    assert [transcript.word_text_at(index) for index in range(4)] == [" Hello", " there.", " General", " Kenobi!"]
+
+
+def test_text_is_whisper_text(transcript):
+    assert transcript.text == RESULT['text']
+
+
+def test_to_srt_matches_cues(transcript):
+    srt = transcript.to_srt()
+
+    assert srt.startswith("1\n00:00:00,000 --> 00:00:01,500\nHello there.\n\n")
+    assert "01:01:01,000 --> 01:01:02,004" in srt
+    assert parse_cues(srt) == transcript.cues()
+
+
+def test_cues_are_numbered_from_the_first_segment(transcript):
+    cues = transcript.cues(1, 3)
+
+    assert [cue.index for cue in cues] == [1, 2]
+    assert cues[0].text == "General Kenobi!"
+
+
+def test_text_between_joins_overlapping_segments(transcript):
+    assert transcript.segment_range(1.0, 2.5) == (0, 2)
+    assert transcript.text_between(1.0, 2.5) == "Hello there. General Kenobi!"
+    assert transcript.text_between(10, 20) == ""
+
+
+def test_load_is_shared_until_rewritten(tmp_path):
+    path = transcript_store.write_whisper_result(tmp_path / 'talk.transcript', RESULT)
+    first = transcript_store.load_transcript(path)
+
+    assert transcript_store.load_transcript(path) is first
+
+    transcript_store.write_whisper_result(path, dict(RESULT, segments=RESULT['segments'][:1], text=" Hello there."))
+    assert transcript_store.load_transcript(path).text == " Hello there."
+
+
+def test_old_format_is_not_current(tmp_path):
+    path = transcript_store.write_whisper_result(tmp_path / 'talk.transcript', RESULT)
+    assert transcript_store.is_current(path)
+
+    meta = json.loads((path / 'meta.json').read_text(encoding='utf-8'))
+    (path / 'meta.json').write_text(json.dumps(dict(meta, version=1)), encoding='utf-8')
+
+    assert not transcript_store.is_current(path)
+    assert not transcript_store.is_current(tmp_path / 'missing.transcript')
+    with pytest.raises(ValueError, match="Unsupported transcript artifact version"):
+        transcript_store.load_transcript(path)
+
+
+def test_empty_transcript(tmp_path):
+    path = transcript_store.write_whisper_result(tmp_path / 'silence.transcript', {'text': '', 'segments': []})
+    transcript = transcript_store.load_transcript(path)
+
+    assert len(transcript) == 0
+    assert transcript.text == ''
+    assert transcript.to_srt() == ''
+    assert transcript.cues() == []
@@ -0,0 +1,138 @@
+# Standard library imports
+import sqlite3
+from contextlib import closing
+
+# Third party imports
+import pytest
+
+# Local application imports
+from work_queue import WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WorkQueue(tmp_path / 'queue.db')
+
+
+def test_lease_returns_oldest_task_of_requested_kind(queue):
+    queue.enqueue('encode', {'clip': 1})
+    transcribe_id = queue.enqueue('transcribe', {'workspace': 'a'})
+    queue.enqueue('transcribe', {'workspace': 'b'})
+
+    task = queue.lease('host-1', ['transcribe'])
+
+    assert task.id == transcribe_id
+    assert task.payload == {'workspace': 'a'}
+    assert task.attempts == 1
+
+
+def test_leased_task_is_not_handed_out_again(queue):
+    queue.enqueue('align', {})
+    assert queue.lease('host-1', ['align']) is not None
+    assert queue.lease('host-2', ['align']) is None
+
+
+def test_complete_requires_lease_owner(queue):
+    task_id = queue.enqueue('align', {})
+    queue.lease('host-1', ['align'])
+
+    assert not queue.complete(task_id, 'host-2', {'clips': []})
+    assert queue.complete(task_id, 'host-1', {'clips': []})
+    assert queue.stats() == [('align', 'done', 1)]
+
+
+def test_heartbeat_requires_lease_owner(queue):
+    task_id = queue.enqueue('align', {})
+    queue.lease('host-1', ['align'])
+
+    assert queue.heartbeat(task_id, 'host-1')
+    assert not queue.heartbeat(task_id, 'host-2')
+
+
+def test_failed_task_waits_for_backoff(queue):
+    task_id = queue.enqueue('encode', {})
+    queue.lease('host-1', ['encode'])
+
+    assert queue.fail(task_id, 'host-1', 'boom', backoff_seconds=3600) == 'pending'
+    assert queue.lease('host-1', ['encode']) is None
+
+
+def test_failed_task_is_retried_until_max_attempts(queue):
+    task_id = queue.enqueue('encode', {}, max_attempts=2)
+    queue.lease('host-1', ['encode'])
+    assert queue.fail(task_id, 'host-1', 'boom', backoff_seconds=0) == 'pending'
+
+    task = queue.lease('host-2', ['encode'])
+    assert task.id == task_id and task.attempts == 2
+    assert queue.fail(task_id, 'host-2', 'boom again', backoff_seconds=0) == 'failed'
+    assert queue.lease('host-2', ['encode']) is None
+
+
+def test_fail_by_other_worker_is_ignored(queue):
+    task_id = queue.enqueue('encode', {})
+    queue.lease('host-1', ['encode'])
+    assert queue.fail(task_id, 'host-2', 'not mine') is None
+
+
+def test_expired_lease_is_reclaimed(queue):
+    task_id = queue.enqueue('transcribe', {})
+    queue.lease('crashed-host', ['transcribe'], lease_seconds=-1)
+
+    task = queue.lease('host-2', ['transcribe'])
+
+    assert task.id == task_id
+    assert task.attempts == 2
+    # The crashed host lost its lease
+    assert not queue.complete(task_id, 'crashed-host')
+
+
+def test_expired_lease_fails_task_after_max_attempts(queue):
+    queue.enqueue('transcribe', {}, max_attempts=1)
+    queue.lease('crashed-host', ['transcribe'], lease_seconds=-1)
+
+    assert queue.lease('host-2', ['transcribe']) is None
+    assert queue.stats() == [('transcribe', 'failed', 1)]
+
+
+def test_dedupe_key_queues_task_once(queue):
+    first = queue.enqueue('encode', {'clip': 1}, dedupe_key='encode:job:video:1')
+    second = queue.enqueue('encode', {'clip': 1}, dedupe_key='encode:job:video:1')
+    other = queue.enqueue('encode', {'clip': 2}, dedupe_key='encode:job:video:2')
+
+    assert first == second
+    assert other != first
+    assert queue.stats() == [('encode', 'pending', 2)]
+
+
+def test_tasks_without_dedupe_key_are_never_merged(queue):
+    assert queue.enqueue('encode', {}) != queue.enqueue('encode', {})
+
+
+def test_migrates_queue_without_dedupe_key_column(tmp_path):
+    db_path = tmp_path / 'queue.db'
+    with closing(sqlite3.connect(db_path)) as connection:
+        connection.executescript("""
+            CREATE TABLE tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                not_before REAL NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                result TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            INSERT INTO tasks (kind, payload, max_attempts, created, updated)
+            VALUES ('transcribe', '{"workspace": "old"}', 3, 0, 0);
+        """)
+        connection.commit()
+
+    queue = WorkQueue(db_path)
+
+    assert queue.lease('host-1', ['transcribe']).payload == {'workspace': 'old'}
+    assert queue.enqueue('align', {}, dedupe_key='align:old') == queue.enqueue('align', {}, dedupe_key='align:old')
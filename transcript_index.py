@@ -0,0 +1,286 @@
+"""
+Local topic search over transcript windows.
+
+Each binary transcript (see transcript_store) is cut into overlapping windows of
+WINDOW_SECONDS every STRIDE_SECONDS. Each window becomes a hashed TF-IDF vector: unigrams and
+bigrams are hashed into DIMENSIONS signed buckets, so no vocabulary has to be stored. The
+vectors are kept as one L2-normalised float32 matrix. The index is cached in
+`<stem>.index/` next to the transcript and rebuilt when the transcript changes. It is loaded
+memory-mapped, so searching a whole archive of jobs touches one matrix at a time.
+
+    python transcript_index.py "remote work burnout" --workspace jobs/20240601_120000_ab12cd34
+    python transcript_index.py "remote work burnout" --archive jobs --limit 20
+"""
+
+# Standard library imports
+import os
+import re
+import json
+import zlib
+import heapq
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+import transcript_store
+from artifacts import atomic_path
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INDEX_SUFFIX = '.index'
+INDEX_VERSION = 1
+WINDOW_SECONDS = 60
+STRIDE_SECONDS = 20
+DIMENSIONS = 4096
+DEFAULT_LIMIT = 8
+# Candidates overlapping a better one by more than this fraction of the shorter interval are dropped
+MAX_OVERLAP = 0.5
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+STOP_WORDS = frozenset("""
+    a about an and are as at be been but by can do does for from had has have he her his how i if in into
+    is it its just like me my no not of on or our out she so that the their them then there these they
+    this to up was we were what when which who will with would you your yeah um uh oh okay gonna really
+""".split())
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def terms(text):
+    """
+    Returns the unigrams and bigrams of text, without stop words.
+    """
+    words = [word for word in WORD_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def _hashed_counts(text):
+    """
+    Returns (buckets, signed_counts) of the hashed terms of text.
+    """
+    counts = {}
+    for term in terms(text):
+        digest = zlib.crc32(term.encode('utf-8'))
+        bucket = digest % DIMENSIONS
+        counts[bucket] = counts.get(bucket, 0) + (1 if (digest // DIMENSIONS) % 2 else -1)
+    buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    return buckets, np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+
+
+def _sublinear(counts):
+    return np.sign(counts) * np.log1p(np.abs(counts))
+
+
+def transcript_windows(transcript, window_seconds=WINDOW_SECONDS, stride_seconds=STRIDE_SECONDS):
+    """
+    Returns (start_ms, end_ms, text) windows of whole segments, starting every stride_seconds.
+    """
+    if not len(transcript):
+        return []
+    windows = []
+    seen = set()
+    end_seconds = transcript.segment_end_ms[-1] / 1000
+    position = 0.0
+    while position < end_seconds:
+        first, last = transcript.segment_range(position, position + window_seconds)
+        if last > first and (first, last) not in seen:
+            seen.add((first, last))
+            windows.append((int(transcript.segment_start_ms[first]), int(transcript.segment_end_ms[last - 1]),
+                            ' '.join(transcript.segment_text_at(index) for index in range(first, last))))
+        position += stride_seconds
+    return windows
+
+
+class TranscriptIndex:
+    """
+    Hashed TF-IDF vectors of the windows of one transcript.
+    """
+
+    def __init__(self, path, transcript_path, vectors, start_ms, end_ms, idf):
+        self.path = path
+        self.transcript_path = transcript_path
+        self.vectors = vectors
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.idf = idf
+
+    def __len__(self):
+        return len(self.start_ms)
+
+    def query_vector(self, query):
+        buckets, counts = _hashed_counts(query)
+        vector = np.zeros(DIMENSIONS, dtype=np.float32)
+        vector[buckets] = _sublinear(counts) * self.idf[buckets]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def scores(self, query):
+        """
+        Returns the cosine similarity of every window to query.
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.float32)
+        return np.asarray(self.vectors @ self.query_vector(query))
+
+    def search(self, query, limit=DEFAULT_LIMIT, min_score=0.0):
+        """
+        Returns up to limit {'transcript', 'start_ms', 'end_ms', 'score', 'text'} matches, best
+        first, leaving out windows that mostly overlap a better match.
+        """
+        scores = self.scores(query)
+        matches = []
+        for index in np.argsort(-scores, kind='stable'):
+            if len(matches) == limit or scores[index] <= min_score:
+                break
+            start_ms, end_ms = int(self.start_ms[index]), int(self.end_ms[index])
+            if any(_overlap(start_ms, end_ms, match['start_ms'], match['end_ms']) > MAX_OVERLAP for match in matches):
+                continue
+            matches.append({'transcript': str(self.transcript_path), 'start_ms': start_ms, 'end_ms': end_ms,
+                            'score': float(scores[index])})
+        transcript = transcript_store.load_transcript(self.transcript_path)
+        for match in matches:
+            match['text'] = transcript.text_between(match['start_ms'] / 1000, match['end_ms'] / 1000)
+        return matches
+
+
+def _overlap(start, end, other_start, other_end):
+    shorter = min(end - start, other_end - other_start)
+    if shorter <= 0:
+        return 0.0
+    return max(0, min(end, other_end) - max(start, other_start)) / shorter
+
+
+def index_path(transcript_path):
+    transcript_path = Path(transcript_path)
+    return transcript_path.with_name(transcript_path.name[:-len(transcript_store.ARTIFACT_SUFFIX)] + INDEX_SUFFIX)
+
+
+def _transcript_key(transcript_path):
+    return {'path': os.path.abspath(transcript_path),
+            'mtime_ns': os.stat(Path(transcript_path) / 'meta.json').st_mtime_ns}
+
+
+def build_index(transcript_path, window_seconds=WINDOW_SECONDS, stride_seconds=STRIDE_SECONDS):
+    """
+    Builds and caches the index of the transcript artifact at transcript_path.
+    """
+    transcript = transcript_store.load_transcript(transcript_path)
+    windows = transcript_windows(transcript, window_seconds, stride_seconds)
+
+    vectors = np.zeros((len(windows), DIMENSIONS), dtype=np.float32)
+    for row, (_, _, text) in enumerate(windows):
+        buckets, counts = _hashed_counts(text)
+        vectors[row, buckets] = _sublinear(counts)
+    document_frequency = np.count_nonzero(vectors, axis=0)
+    idf = (np.log((1 + len(windows)) / (1 + document_frequency)) + 1).astype(np.float32)
+    vectors *= idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms > 0, norms, 1)
+
+    meta = {'version': INDEX_VERSION, 'transcript': _transcript_key(transcript_path), 'dimensions': DIMENSIONS,
+            'window_seconds': window_seconds, 'stride_seconds': stride_seconds, 'windows': len(windows)}
+    path = index_path(transcript_path)
+    with atomic_path(path) as partial_path:
+        partial_path.mkdir()
+        np.save(partial_path / 'vectors.npy', vectors)
+        np.save(partial_path / 'start_ms.npy', np.array([start for start, _, _ in windows], dtype=np.int64))
+        np.save(partial_path / 'end_ms.npy', np.array([end for _, end, _ in windows], dtype=np.int64))
+        np.save(partial_path / 'idf.npy', idf)
+        with open(partial_path / 'meta.json', 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+    logging.info(f"Indexed {len(windows)} windows of {transcript_path}")
+    return path
+
+
+def _is_current(path, transcript_path):
+    meta_path = Path(path) / 'meta.json'
+    if not meta_path.exists():
+        return False
+    with open(meta_path, 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    return (meta.get('version') == INDEX_VERSION and meta.get('dimensions') == DIMENSIONS
+            and meta.get('transcript') == _transcript_key(transcript_path))
+
+
+def load_index(transcript_path):
+    """
+    Returns the memory-mapped index of a transcript artifact, building it first if it is
+    missing or older than the transcript.
+    """
+    path = index_path(transcript_path)
+    if not _is_current(path, transcript_path):
+        build_index(transcript_path)
+    cache_key = (os.path.abspath(path), os.stat(path / 'meta.json').st_mtime_ns)
+    with _indexes_lock:
+        if cache_key not in _indexes:
+            _indexes[cache_key] = TranscriptIndex(
+                path, Path(transcript_path), np.load(path / 'vectors.npy', mmap_mode='r'),
+                np.load(path / 'start_ms.npy', mmap_mode='r'), np.load(path / 'end_ms.npy', mmap_mode='r'),
+                np.load(path / 'idf.npy'))
+        return _indexes[cache_key]
+
+
+def find_clips(transcript_path, query, limit=DEFAULT_LIMIT):
+    """
+    Returns the windows of one transcript that best match query, best first.
+    """
+    return load_index(transcript_path).search(query, limit)
+
+
+def archive_transcripts(root):
+    """
+    Yields every binary transcript under root: a workspace, or a folder of job workspaces.
+    """
+    yield from sorted(Path(root).glob(f'whisper_output/*{transcript_store.ARTIFACT_SUFFIX}'))
+    yield from sorted(Path(root).glob(f'*/whisper_output/*{transcript_store.ARTIFACT_SUFFIX}'))
+
+
+def search_archive(root, query, limit=DEFAULT_LIMIT):
+    """
+    Returns the best matches to query across all transcripts under root, best first.
+    """
+    best = []
+    for transcript_path in archive_transcripts(root):
+        if not (transcript_path / 'meta.json').exists():
+            continue
+        for match in find_clips(transcript_path, query, limit):
+            entry = (match['score'], match['transcript'], match['start_ms'], match)
+            if len(best) < limit:
+                heapq.heappush(best, entry)
+            elif entry[:3] > best[0][:3]:
+                heapq.heapreplace(best, entry)
+    return [match for *_, match in sorted(best, key=lambda entry: entry[:3], reverse=True)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find transcript passages about a topic.")
+    parser.add_argument('query')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--workspace', default=None, help="Search the transcript of one workspace (default: VCC_WORKSPACE)")
+    group.add_argument('--archive', default=None, help="Search every job workspace under this folder")
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    args = parser.parse_args()
+
+    if args.archive:
+        matches = search_archive(args.archive, args.query, args.limit)
+    else:
+        from workspace import Workspace, default_workspace
+
+        workspace = Workspace(args.workspace) if args.workspace else default_workspace()
+        _, srt_file = workspace.transcript_files()
+        artifact = workspace.transcript_artifact(srt_file.stem) if srt_file else None
+        if artifact is None:
+            parser.error(f"No binary transcript in {workspace.whisper_output}")
+        matches = find_clips(artifact, args.query, args.limit)
+    print(json.dumps(matches, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Columnar binary transcript artifact.
+
+Transcription writes `<stem>.transcript/` next to the .srt/.txt pair in whisper_output: one
+.npy file per column (segment and word start/end in milliseconds, byte offsets into the text
+blobs, the word-to-segment index) plus the UTF-8 text blobs (segments, words and the full
+text as Whisper returned it) and a small meta.json. Every
+column is opened memory-mapped, so loading a 3-hour transcript costs the same as a
+1-minute one. Loaded transcripts are shared by every stage of the process.
+
+The artifact is a directory of .npy files rather than one .npz, because members of an .npz
+archive cannot be memory-mapped.
+"""
+
+# Standard library imports
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from artifacts import atomic_path
+from prompt_prep import Cue
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ARTIFACT_SUFFIX = '.transcript'
+FORMAT_VERSION = 2
+
+COLUMNS = [
+    'segment_start_ms', 'segment_end_ms', 'segment_text_offsets', 'segment_text',
+    'word_start_ms', 'word_end_ms', 'word_text_offsets', 'word_text', 'word_segment', 'full_text',
+]
+
+_transcripts = {}
+_transcripts_lock = threading.Lock()
+
+
+def _srt_timestamp(milliseconds):
+    hours, remainder = divmod(int(milliseconds), 3600 * 1000)
+    minutes, remainder = divmod(remainder, 60 * 1000)
+    seconds, milliseconds = divmod(remainder, 1000)
+    return f"{hours:02}:{minutes:02}:{seconds:02},{milliseconds:03}"
+
+
+class Transcript:
+    """
+    A memory-mapped transcript. Segment and word times are in milliseconds.
+    """
+
+    def __init__(self, path, columns, meta):
+        self.path = path
+        self.language = meta.get('language')
+        self.segment_start_ms = columns['segment_start_ms']
+        self.segment_end_ms = columns['segment_end_ms']
+        self.segment_text_offsets = columns['segment_text_offsets']
+        self.segment_text = columns['segment_text']
+        self.word_start_ms = columns['word_start_ms']
+        self.word_end_ms = columns['word_end_ms']
+        self.word_text_offsets = columns['word_text_offsets']
+        self.word_text = columns['word_text']
+        self.word_segment = columns['word_segment']
+        self.full_text = columns['full_text']
+
+    def __len__(self):
+        return len(self.segment_start_ms)
+
+    def segment_text_at(self, index):
+        offsets = self.segment_text_offsets
+        return bytes(self.segment_text[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+    def word_text_at(self, index):
+        offsets = self.word_text_offsets
+        return bytes(self.word_text[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+    def segment_range(self, start_seconds, end_seconds):
+        """
+        Returns the (first, last) indices of the segments overlapping [start_seconds, end_seconds).
+        """
+        first = int(np.searchsorted(self.segment_end_ms, start_seconds * 1000, side='right'))
+        last = int(np.searchsorted(self.segment_start_ms, end_seconds * 1000, side='left'))
+        return first, max(first, last)
+
+    def segments(self, first=0, last=None):
+        """
+        Yields (start_seconds, end_seconds, text) for segments first..last.
+        """
+        last = len(self) if last is None else last
+        for index in range(first, last):
+            yield (self.segment_start_ms[index] / 1000, self.segment_end_ms[index] / 1000,
+                   self.segment_text_at(index))
+
+    def text_between(self, start_seconds, end_seconds):
+        return ' '.join(text for _, _, text in self.segments(*self.segment_range(start_seconds, end_seconds)))
+
+    @property
+    def text(self):
+        """
+        The full transcript text, as Whisper's result["text"].
+        """
+        return bytes(self.full_text).decode('utf-8')
+
+    def cues(self, first=0, last=None):
+        """
+        Returns segments first..last as prompt_prep Cue tuples, numbered like the cues of `to_srt`.
+        """
+        last = len(self) if last is None else last
+        return [Cue(number, self.segment_start_ms[index] / 1000, self.segment_end_ms[index] / 1000,
+                    f"{_srt_timestamp(self.segment_start_ms[index])} --> {_srt_timestamp(self.segment_end_ms[index])}",
+                    self.segment_text_at(index))
+                for number, index in enumerate(range(first, last), 1)]
+
+    def to_srt(self, first=0, last=None):
+        """
+        Renders segments first..last as an SRT document, in the layout of Whisper's SRT writer.
+        """
+        last = len(self) if last is None else last
+        cues = []
+        for number, index in enumerate(range(first, last), 1):
+            cues.append(f"{number}\n{_srt_timestamp(self.segment_start_ms[index])} --> "
+                        f"{_srt_timestamp(self.segment_end_ms[index])}\n{self.segment_text_at(index)}\n\n")
+        return ''.join(cues)
+
+
+def _text_column(texts):
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(text) for text in encoded])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def write_transcript(path, segments, words=(), language=None, text=None):
+    """
+    Writes a transcript artifact directory at path atomically.
+
+    Args:
+        segments: (start_ms, end_ms, text) tuples
+        words: (segment_index, start_ms, end_ms, text) tuples
+        language: Transcript language, if known
+        text: Full transcript text; defaults to the segment texts joined by spaces
+    """
+    segments, words = list(segments), list(words)
+    if text is None:
+        text = ' '.join(segment_text for _, _, segment_text in segments)
+    segment_text_offsets, segment_text = _text_column(text for _, _, text in segments)
+    word_text_offsets, word_text = _text_column(text for _, _, _, text in words)
+    columns = {
+        'segment_start_ms': np.array([start for start, _, _ in segments], dtype=np.int64),
+        'segment_end_ms': np.array([end for _, end, _ in segments], dtype=np.int64),
+        'segment_text_offsets': segment_text_offsets,
+        'segment_text': segment_text,
+        'word_start_ms': np.array([start for _, start, _, _ in words], dtype=np.int64),
+        'word_end_ms': np.array([end for _, _, end, _ in words], dtype=np.int64),
+        'word_text_offsets': word_text_offsets,
+        'word_text': word_text,
+        'word_segment': np.array([segment for segment, _, _, _ in words], dtype=np.int32),
+        'full_text': np.frombuffer(text.encode('utf-8'), dtype=np.uint8),
+    }
+    meta = {'version': FORMAT_VERSION, 'language': language, 'segments': len(segments), 'words': len(words)}
+
+    with atomic_path(path) as partial_path:
+        partial_path.mkdir()
+        for name, column in columns.items():
+            np.save(partial_path / f"{name}.npy", column)
+        with open(partial_path / 'meta.json', 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+    logging.info(f"Transcript artifact written: {path} ({len(segments)} segments, {len(words)} words)")
+    return Path(path)
+
+
+def write_whisper_result(path, result):
+    """
+    Writes a `model.transcribe`-shaped result, with SRT-style texts and millisecond times.
+    """
+    segments, words = [], []
+    for index, segment in enumerate(result['segments']):
+        segments.append((round(segment['start'] * 1000), round(segment['end'] * 1000),
+                         segment['text'].strip().replace('-->', '->')))
+        for word in segment.get('words') or []:
+            words.append((index, round(word['start'] * 1000), round(word['end'] * 1000), word['word']))
+    text = result.get('text')
+    if text is None:
+        text = ''.join(segment['text'] for segment in result['segments'])
+    return write_transcript(path, segments, words, result.get('language'), text)
+
+
+def load_transcript(path):
+    """
+    Returns the memory-mapped Transcript at path, shared with other callers until the artifact
+    is rewritten.
+    """
+    path = Path(path)
+    meta_path = path / 'meta.json'
+    cache_key = (os.path.abspath(path), os.stat(meta_path).st_mtime_ns)
+    with _transcripts_lock:
+        if cache_key not in _transcripts:
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            if meta.get('version') != FORMAT_VERSION:
+                raise ValueError(f"Unsupported transcript artifact version in {path}: {meta.get('version')}")
+            columns = {name: np.load(path / f"{name}.npy", mmap_mode='r') for name in COLUMNS}
+            _transcripts[cache_key] = Transcript(path, columns, meta)
+        return _transcripts[cache_key]
+
+
+def is_current(path):
+    """
+    Returns True if the artifact at path was written in the current format, so it can be loaded.
+    """
+    try:
+        with open(Path(path) / 'meta.json', 'r', encoding='utf-8') as file:
+            return json.load(file).get('version') == FORMAT_VERSION
+    except (OSError, ValueError):
+        return False
+
+
+def artifact_path(directory, stem):
+    return Path(directory) / f"{stem}{ARTIFACT_SUFFIX}"
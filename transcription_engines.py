@@ -0,0 +1,240 @@
+"""
+Transcription engines.
+
+Every engine wraps a model with a Whisper-style `transcribe(audio, **options)` and returns
+results shaped like openai-whisper's: {"text", "segments", "language"}, where each segment
+has id, start, end and text (and "words" with word timestamps). Engines stream the audio
+through `audio_stream`, so they share the same bounded memory use and output structure.
+
+    whisper         openai-whisper (fp32; fp16 on CUDA with TRANSCRIBE_FP16=1)
+    whisper-int8    openai-whisper with dynamically int8-quantized linear layers, CPU only
+    faster-whisper  CTranslate2 int8 via the optional faster-whisper package
+
+The engine is picked with the TRANSCRIBE_ENGINE environment variable (default: whisper).
+"""
+
+# Standard library imports
+import os
+import logging
+import threading
+
+# Third party imports (torch, whisper and faster_whisper are imported when a model loads)
+
+# Local application imports (audio_stream pulls in numpy, so it is imported when a transcription runs)
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_ENGINE = 'whisper'
+DEFAULT_MODEL = "medium.en"
+
+# Loaded engines are kept warm for the lifetime of the process (e.g. in service mode)
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def transcribe_stream(model, file, start=None, duration=None, **options):
+    """
+    Transcribes file (or the given range of it) chunk by chunk from `audio_stream.stream_audio`,
+    so memory stays flat for multi-hour inputs, and returns a result shaped like `model.transcribe`.
+    Segment times are shifted by each chunk's offset, and each chunk is prompted with the end of
+    the previous one's text to keep the context across chunks.
+    """
+    from audio_stream import stream_audio
+
+    text = []
+    segments = []
+    language = options.get("language")
+    for offset, samples in stream_audio(file, start=start, duration=duration):
+        prompt = "".join(text)[-200:] or options.get("initial_prompt")
+        result = model.transcribe(samples, **dict(options, initial_prompt=prompt))
+        language = language or result.get("language")
+        text.append(result["text"])
+        for segment in result["segments"]:
+            segments.append(shift_segment(segment, offset, len(segments)))
+    return {"text": "".join(text), "segments": segments, "language": language}
+
+
+def shift_segment(segment, offset, segment_id):
+    """
+    Returns a copy of a result segment moved offset seconds later and renumbered.
+    """
+    segment = dict(segment, id=segment_id, start=segment["start"] + offset, end=segment["end"] + offset)
+    if segment.get("words"):
+        segment["words"] = [dict(word, start=word["start"] + offset, end=word["end"] + offset)
+                            for word in segment["words"]]
+    return segment
+
+
+class TranscriptionEngine:
+    """
+    Base class of the engines: loads its model on first use and runs one transcription at a
+    time on it.
+    """
+
+    name = None
+
+    def __init__(self, model_name=DEFAULT_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._load_lock = threading.Lock()
+        # Whisper installs decoding hooks on the model, so one model runs one transcription at a time
+        self.transcribe_lock = threading.Lock()
+
+    def load_model(self):
+        """
+        Returns the loaded model, which must have a Whisper-style transcribe(audio, **options).
+        """
+        raise NotImplementedError
+
+    def decode_options(self):
+        return {}
+
+    def load(self):
+        """
+        Loads the model unless it is already loaded, and returns it.
+        """
+        with self._load_lock:
+            if self._model is None:
+                logging.info(f"Loading {self.name} model {self.model_name}")
+                self._model = self.load_model()
+            return self._model
+
+    @property
+    def model(self):
+        return self.load()
+
+    def transcribe(self, file, language="en", word_timestamps=False, start=None, duration=None):
+        model = self.model
+        with self.transcribe_lock:
+            return transcribe_stream(model, file, start=start, duration=duration, language=language,
+                                     word_timestamps=word_timestamps, **self.decode_options())
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+
+class WhisperEngine(TranscriptionEngine):
+    name = 'whisper'
+
+    def __init__(self, model_name=DEFAULT_MODEL):
+        super().__init__(model_name)
+        self.device = None
+        # Half precision is faster on CUDA but can change the transcript, so it is opt-in
+        self.fp16 = os.getenv('TRANSCRIBE_FP16', '0') == '1'
+
+    def load_model(self):
+        import torch
+        import whisper
+
+        # Use CUDA, if available
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        return whisper.load_model(self.model_name).to(self.device)
+
+    def decode_options(self):
+        return {"fp16": self.fp16 and self.device == "cuda", "verbose": False}
+
+
+class QuantizedWhisperEngine(WhisperEngine):
+    """
+    openai-whisper on CPU with its linear layers quantized to int8 at load time
+    (torch dynamic quantization). Needs no extra packages or converted weights.
+    """
+
+    name = 'whisper-int8'
+
+    def load_model(self):
+        import torch
+        import whisper
+
+        self.device = "cpu"
+        model = whisper.load_model(self.model_name, device="cpu")
+        # whisper's Linear subclass only adds dtype casting, which quantize_dynamic doesn't recognise
+        for module in model.modules():
+            if type(module) is whisper.model.Linear:
+                module.__class__ = torch.nn.Linear
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class _FasterWhisperModel:
+    """
+    Adapts a faster_whisper.WhisperModel to the openai-whisper transcribe interface.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def transcribe(self, audio, language=None, initial_prompt=None, word_timestamps=False, **_):
+        segments, info = self.model.transcribe(audio, language=language, initial_prompt=initial_prompt,
+                                               word_timestamps=word_timestamps, beam_size=5)
+        result_segments = []
+        for segment in segments:
+            result_segment = {
+                "id": len(result_segments),
+                "seek": segment.seek,
+                "start": segment.start,
+                "end": segment.end,
+                "text": segment.text,
+                "tokens": list(segment.tokens),
+                "temperature": segment.temperature,
+                "avg_logprob": segment.avg_logprob,
+                "compression_ratio": segment.compression_ratio,
+                "no_speech_prob": segment.no_speech_prob,
+            }
+            if segment.words:
+                result_segment["words"] = [{"word": word.word, "start": word.start, "end": word.end,
+                                            "probability": word.probability} for word in segment.words]
+            result_segments.append(result_segment)
+        return {"text": "".join(segment["text"] for segment in result_segments),
+                "segments": result_segments, "language": info.language}
+
+
+class FasterWhisperEngine(TranscriptionEngine):
+    """
+    CTranslate2 int8 inference through the optional faster-whisper package
+    (`poetry run pip install faster-whisper`). Uses the same model names as openai-whisper.
+    """
+
+    name = 'faster-whisper'
+
+    def load_model(self):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise ImportError("The faster-whisper engine needs the faster-whisper package "
+                              "(poetry run pip install faster-whisper)") from e
+        return _FasterWhisperModel(WhisperModel(self.model_name, device="cpu", compute_type="int8",
+                                                cpu_threads=os.cpu_count() or 4))
+
+
+ENGINES = {engine.name: engine for engine in (WhisperEngine, QuantizedWhisperEngine, FasterWhisperEngine)}
+
+
+def engine_name():
+    return os.getenv('TRANSCRIBE_ENGINE', DEFAULT_ENGINE).strip().lower()
+
+
+def default_model_name():
+    return os.getenv('TRANSCRIBE_MODEL', DEFAULT_MODEL)
+
+
+def get_engine(name=None, model_name=DEFAULT_MODEL):
+    """
+    Returns the shared engine for (name, model_name); name defaults to TRANSCRIBE_ENGINE.
+    """
+    name = name or engine_name()
+    if name not in ENGINES:
+        raise ValueError(f"Unknown transcription engine: {name} (expected one of {', '.join(ENGINES)})")
+    with _engines_lock:
+        if (name, model_name) not in _engines:
+            _engines[(name, model_name)] = ENGINES[name](model_name)
+        return _engines[(name, model_name)]
+
+
+def loaded_engines():
+    """
+    Returns ((name, model_name), engine) for the shared engines whose model is loaded.
+    """
+    with _engines_lock:
+        return [(key, engine) for key, engine in _engines.items() if engine.loaded]
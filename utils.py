@@ -1,16 +1,115 @@
-# Third party imports
-import lockfile
-def wait_for_file(filepath):
+# Standard library imports
+import re
+
+# Local application imports
+from artifacts import DEFAULT_WAIT_TIMEOUT, wait_for_artifact
+
+SRT_TIMESTAMP_PATTERN = re.compile(r'(\d{2}):(\d{2}):(\d{2}),(\d{3})')
+SRT_TIMING_PATTERN = re.compile(r'^(\d{2}:\d{2}:\d{2},\d{3}) --> (\d{2}:\d{2}:\d{2},\d{3})$')
+CODE_FENCE_PATTERN = re.compile(r'^```\w*\s*$', re.MULTILINE)
+
+
+def wait_for_file(filepath, timeout=DEFAULT_WAIT_TIMEOUT):
     """
-    This function waits for a file to be available before proceeding.
+    This function waits for a file to be committed before proceeding.
+    Files written with `artifacts.atomic_path` wake the waiter as soon as they are renamed into place.
 
     Args:
         filepath: Path to the file to wait for
+        timeout: Seconds to wait before giving up (default 10 minutes), or None to wait indefinitely
+    """
+    return wait_for_artifact(filepath, timeout=timeout)
+
+
+def srt_timestamp_to_seconds(timestamp):
+    """
+    Converts an SRT timestamp (HH:MM:SS,mmm) to seconds.
+
+    Args:
+        timestamp: SRT timestamp string
+    """
+    match = SRT_TIMESTAMP_PATTERN.search(timestamp)
+    if not match:
+        raise ValueError(f"Invalid SRT timestamp: {timestamp}")
+    hours, minutes, seconds, milliseconds = (int(group) for group in match.groups())
+    return hours * 3600 + minutes * 60 + seconds + milliseconds / 1000
+
+
+def seconds_to_srt_timestamp(seconds):
+    """
+    Converts seconds to an SRT timestamp (HH:MM:SS,mmm).
+
+    Args:
+        seconds: Time in seconds, negative values are clamped to zero
+    """
+    total_milliseconds = max(0, int(round(seconds * 1000)))
+    hours, remainder = divmod(total_milliseconds, 3600 * 1000)
+    minutes, remainder = divmod(remainder, 60 * 1000)
+    secs, milliseconds = divmod(remainder, 1000)
+    return f"{hours:02}:{minutes:02}:{secs:02},{milliseconds:03}"
+
+
+def srt_interval(srt_content):
+    """
+    Returns the (start, end) interval in seconds covered by an SRT document,
+    taken from its first and last timestamps, or None if it has no timestamps.
+
+    Args:
+        srt_content: Content of the SRT file
+    """
+    timestamps = [match.group(0) for match in SRT_TIMESTAMP_PATTERN.finditer(srt_content)]
+    if not timestamps:
+        return None
+    return srt_timestamp_to_seconds(timestamps[0]), srt_timestamp_to_seconds(timestamps[-1])
+
+
+def shift_srt(srt_content, offset_seconds):
+    """
+    Shifts every timestamp of an SRT document by offset_seconds (negative values move it earlier).
+
+    Args:
+        srt_content: Content of the SRT file
+        offset_seconds: Offset to add to each timestamp
     """
-    lock = lockfile.FileLock(filepath)
-    while not lock.i_am_locking():
-        try:
-            lock.acquire(timeout=1)  # wait for 1 second
-        except lockfile.LockTimeout:
-            pass
-    return True
\ No newline at end of file
+    return SRT_TIMESTAMP_PATTERN.sub(
+        lambda match: seconds_to_srt_timestamp(srt_timestamp_to_seconds(match.group(0)) + offset_seconds),
+        srt_content)
+
+
+def validate_srt(srt_content, min_seconds=None, max_seconds=None):
+    """
+    Checks that srt_content is a well-formed SRT document and returns it without surrounding
+    Markdown code fences or blank lines. Raises ValueError describing the first problem found.
+
+    Args:
+        srt_content: Content of the SRT file, e.g. an LLM response
+        min_seconds: Minimum time between the first and last timestamps, if any
+        max_seconds: Maximum time between the first and last timestamps, if any
+    """
+    cleaned = CODE_FENCE_PATTERN.sub('', srt_content).strip()
+    if not cleaned:
+        raise ValueError("The SRT is empty")
+
+    previous_start = 0.0
+    for number, block in enumerate(re.split(r'\n\s*\n', cleaned), 1):
+        lines = [line.strip() for line in block.strip().splitlines()]
+        if len(lines) < 3:
+            raise ValueError(f"Cue {number} needs an index line, a timing line and text, got: {block.strip()!r}")
+        if not lines[0].isdigit():
+            raise ValueError(f"Cue {number} does not start with a numeric index: {lines[0]!r}")
+        timing = SRT_TIMING_PATTERN.match(lines[1])
+        if not timing:
+            raise ValueError(f"Cue {number} has no 'HH:MM:SS,mmm --> HH:MM:SS,mmm' timing line: {lines[1]!r}")
+        start, end = (srt_timestamp_to_seconds(timestamp) for timestamp in timing.groups())
+        if end <= start:
+            raise ValueError(f"Cue {number} ends before it starts: {lines[1]}")
+        if start < previous_start:
+            raise ValueError(f"Cue {number} starts before the previous cue: {lines[1]}")
+        previous_start = start
+
+    start, end = srt_interval(cleaned)
+    if min_seconds is not None and end - start < min_seconds:
+        raise ValueError(f"The cues span {end - start:.1f}s, less than the required {min_seconds}s")
+    if max_seconds is not None and end - start > max_seconds:
+        raise ValueError(f"The cues span {end - start:.1f}s, more than the allowed {max_seconds}s")
+    return cleaned + '\n'
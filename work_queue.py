@@ -0,0 +1,418 @@
+"""
+Multi-host work distribution over a shared SQLite queue.
+
+Hosts lease transcription, alignment and encode tasks from one SQLite database on a shared
+filesystem; job workspaces live on the same filesystem. Leases expire unless the worker
+sends heartbeats, so tasks held by a crashed host are handed out again, and failed tasks
+are retried with a backoff up to max_attempts. A task that runs twice (after a lost lease or
+a retry) does not queue its follow-up tasks twice: they carry a dedupe key, unique per job, and
+enqueuing a key that is already queued is a no-op. Hosts can specialize by leasing only some
+task kinds, e.g. `--kinds transcribe` on big-CPU hosts and `--kinds encode` on many-core hosts.
+
+Transcribe tasks work on the .mp4 files already in the workspace's input_files folder; the queue
+does not download URLs, so fetch a URL into the workspace first (`VCC_WORKSPACE=<workspace> python ytdl.py`).
+
+    python work_queue.py --db /mnt/shared/queue.db submit --workspace /mnt/shared/jobs/talk --aspect-ratio 2
+    python work_queue.py --db /mnt/shared/queue.db worker --kinds transcribe,align,encode
+    python work_queue.py --db /mnt/shared/queue.db status
+
+SQLite relies on the filesystem's locking, so the shared filesystem must support POSIX locks
+(NFSv4 with locking enabled, CephFS, SMB with byte-range locks, ...).
+"""
+
+# Standard library imports
+import os
+import json
+import time
+import socket
+import logging
+import uuid
+import argparse
+import sqlite3
+import threading
+from pathlib import Path
+from contextlib import closing
+
+# Third party imports
+
+# Local application imports
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    not_before REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    dedupe_key TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_status_kind ON tasks (status, kind);
+"""
+# Created after the dedupe_key column has been added to queues from before it existed
+DEDUPE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS tasks_dedupe_key ON tasks (dedupe_key)"
+
+
+class Task:
+    def __init__(self, task_id, kind, payload, attempts):
+        self.id = task_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"Task({self.id}, {self.kind!r}, attempt {self.attempts})"
+
+
+class WorkQueue:
+    """
+    A task queue stored in a SQLite database. Every method opens its own connection, so one
+    WorkQueue can be used from several threads and many processes on many hosts.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.executescript(SCHEMA)
+            columns = [row['name'] for row in connection.execute('PRAGMA table_info(tasks)')]
+            if 'dedupe_key' not in columns:
+                connection.execute('ALTER TABLE tasks ADD COLUMN dedupe_key TEXT')
+            connection.execute(DEDUPE_INDEX)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _transaction(self, func):
+        connection = self._connect()
+        try:
+            # Take the write lock up front, so that two hosts can never lease the same task
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(connection, time.time())
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+            return result
+        finally:
+            connection.close()
+
+    def enqueue(self, kind, payload, max_attempts=DEFAULT_MAX_ATTEMPTS, dedupe_key=None):
+        """
+        Queues a task and returns its id. If a task with the same dedupe_key was queued before,
+        nothing is queued and the id of that task is returned.
+        """
+        def insert(connection, now):
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO tasks (kind, payload, max_attempts, created, updated, dedupe_key) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (kind, json.dumps(payload), max_attempts, now, now, dedupe_key))
+            if cursor.rowcount == 1:
+                return cursor.lastrowid, True
+            row = connection.execute('SELECT id FROM tasks WHERE dedupe_key = ?', (dedupe_key,)).fetchone()
+            return row['id'], False
+        task_id, inserted = self._transaction(insert)
+        if inserted:
+            logging.info(f"Enqueued {kind} task {task_id}")
+        else:
+            logging.info(f"Not enqueuing {kind} task: already queued as task {task_id} ({dedupe_key})")
+        return task_id
+
+    def lease(self, worker_id, kinds, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Leases the oldest available task of one of the given kinds, or returns None.
+        Expired leases are reclaimed first.
+        """
+        def take(connection, now):
+            self._reclaim_expired(connection, now)
+            placeholders = ','.join('?' for _ in kinds)
+            row = connection.execute(
+                f"SELECT id, kind, payload, attempts FROM tasks WHERE status = 'pending' "
+                f"AND not_before <= ? AND kind IN ({placeholders}) ORDER BY id LIMIT 1",
+                (now, *kinds)).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row['id']))
+            return Task(row['id'], row['kind'], json.loads(row['payload']), row['attempts'] + 1)
+        return self._transaction(take)
+
+    @staticmethod
+    def _reclaim_expired(connection, now):
+        expired = connection.execute(
+            "SELECT id, attempts, max_attempts, lease_owner FROM tasks "
+            "WHERE status = 'leased' AND lease_expires < ?", (now,)).fetchall()
+        for row in expired:
+            status = 'pending' if row['attempts'] < row['max_attempts'] else 'failed'
+            logging.warning(f"Lease of task {row['id']} held by {row['lease_owner']} expired; marking it {status}")
+            connection.execute(
+                "UPDATE tasks SET status = ?, lease_owner = NULL, lease_expires = NULL, "
+                "error = 'lease expired', updated = ? WHERE id = ?", (status, now, row['id']))
+
+    def heartbeat(self, task_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Extends a lease. Returns False if the worker no longer holds it.
+        """
+        def extend(connection, now):
+            cursor = connection.execute(
+                "UPDATE tasks SET lease_expires = ?, updated = ? "
+                "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (now + lease_seconds, now, task_id, worker_id))
+            return cursor.rowcount == 1
+        return self._transaction(extend)
+
+    def complete(self, task_id, worker_id, result=None):
+        def finish(connection, now):
+            cursor = connection.execute(
+                "UPDATE tasks SET status = 'done', result = ?, lease_owner = NULL, lease_expires = NULL, "
+                "updated = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (json.dumps(result), now, task_id, worker_id))
+            return cursor.rowcount == 1
+        return self._transaction(finish)
+
+    def fail(self, task_id, worker_id, error, backoff_seconds=RETRY_BACKOFF_SECONDS):
+        """
+        Records a failed attempt. The task is retried after a backoff until max_attempts is reached.
+        """
+        def record(connection, now):
+            row = connection.execute(
+                "SELECT attempts, max_attempts FROM tasks WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (task_id, worker_id)).fetchone()
+            if row is None:
+                return None
+            status = 'pending' if row['attempts'] < row['max_attempts'] else 'failed'
+            connection.execute(
+                "UPDATE tasks SET status = ?, error = ?, not_before = ?, lease_owner = NULL, "
+                "lease_expires = NULL, updated = ? WHERE id = ?",
+                (status, error, now + backoff_seconds * row['attempts'], now, task_id))
+            return status
+        return self._transaction(record)
+
+    def stats(self):
+        with closing(self._connect()) as connection:
+            rows = connection.execute('SELECT kind, status, COUNT(*) AS count FROM tasks GROUP BY kind, status')
+            return [(row['kind'], row['status'], row['count']) for row in rows]
+
+
+class Worker:
+    """
+    Leases tasks of the given kinds and runs them with handlers[kind](queue, payload),
+    sending heartbeats while a task runs.
+    """
+
+    def __init__(self, queue, handlers, kinds=None, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 poll_interval=2.0):
+        self.queue = queue
+        self.handlers = handlers
+        self.kinds = list(kinds or handlers)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+
+    def _heartbeat(self, task, done):
+        while not done.wait(self.lease_seconds / 3):
+            if not self.queue.heartbeat(task.id, self.worker_id, self.lease_seconds):
+                logging.warning(f"Lost the lease on {task}; another host may run it again")
+                return
+
+    def run_once(self):
+        """
+        Runs one task if one is available. Returns True if a task was run.
+        """
+        import artifact_store
+        from workspace import Workspace
+
+        task = self.queue.lease(self.worker_id, self.kinds, self.lease_seconds)
+        if task is None:
+            return False
+
+        logging.info(f"{self.worker_id} running {task}")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(task, done), daemon=True)
+        heartbeat.start()
+        try:
+            # Tasks hold a reference to their workspace, so its intermediates are not collected meanwhile
+            with artifact_store.job_reference(Workspace(task.payload['workspace'])):
+                result = self.handlers[task.kind](self.queue, task.payload)
+        except Exception as e:  # pylint: disable=broad-except
+            done.set()
+            status = self.queue.fail(task.id, self.worker_id, f"{type(e).__name__}: {e}")
+            logging.exception(f"{task} failed; task is now {status}")
+        else:
+            done.set()
+            if self.queue.complete(task.id, self.worker_id, result):
+                logging.info(f"{task} done")
+            else:
+                logging.warning(f"{task} finished after its lease was lost; its result is discarded")
+        heartbeat.join()
+        return True
+
+    def run(self):
+        logging.info(f"Worker {self.worker_id} leasing {', '.join(self.kinds)} tasks from {self.queue.db_path}")
+        while not self._stop.is_set():
+            if not self.run_once():
+                self._stop.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop.set()
+
+
+def _job_key(payload):
+    """
+    Identifies the submitted job a task belongs to, for the dedupe keys of its follow-up tasks.
+    """
+    return payload.get('job_id') or payload['workspace']
+
+
+def handle_transcribe(queue, payload):
+    """
+    Transcribes the videos in the workspace, then queues the alignment.
+    """
+    from local_transcribe import local_whisper_process
+    from workspace import Workspace
+
+    workspace = Workspace(payload['workspace']).ensure()
+    local_whisper_process(str(workspace.input_files), str(workspace.whisper_output),
+                          whisper_output_folder=str(workspace.whisper_output))
+    queue.enqueue('align', payload, dedupe_key=f"align:{_job_key(payload)}")
+
+
+def handle_align(queue, payload):
+    """
+    Selects and aligns the clips on the transcript, and queues one encode task per clip as soon
+    as that clip is aligned, so encode workers start before the slowest extract is done.
+    The smart_crop and snap_boundaries analysis of every clip runs here and is passed to its encode task.
+    Clips already rendered on this host are linked instead of queued (see `pipeline.dedupe_clips`).
+    """
+    import crew
+    import pipeline
+    from workspace import Workspace
+
+    workspace = Workspace(payload['workspace'])
+    video_files = sorted(workspace.input_files.glob('*.mp4'))
+    deduper = pipeline.stream_deduper(workspace, payload.get('dedupe', False), payload.get('aspect_ratio', '1'))
+    clips = []
+
+    def enqueue_clip(srt_file):
+        for pair in ((video_file, Path(srt_file)) for video_file in video_files):
+            analysis = pipeline.analyse_clips([pair], payload.get('aspect_ratio', '1'), workspace.analysis,
+                                              payload.get('smart_crop', False), payload.get('snap_boundaries', False))
+            keep, _ = deduper(pair, analysis)
+            if not keep:
+                continue
+            options = analysis.get(pair, {})
+            # Keyed on the extract number: a retried alignment names its .srt files anew
+            queue.enqueue('encode', dict(payload, video=str(pair[0]), srt=str(pair[1]),
+                                         crop_center=options.get('crop_center'), interval=options.get('interval')),
+                          dedupe_key=f"encode:{_job_key(payload)}:{pair[0]}:{crew.extract_number(pair[1])}")
+            clips.append(pair[1].name)
+
+    pipeline.select_and_align(workspace, payload.get('topic'), enqueue_clip)
+    return {'clips': clips}
+
+
+def handle_encode(_queue, payload):
+    """
+    Trims one clip, burns its subtitles in and records its fingerprint. Encoding is the last
+    step of a job, so it queues no follow-up tasks.
+    """
+    import clipper
+    import pipeline
+    import subtitler
+    from workspace import Workspace
+
+    workspace = Workspace(payload['workspace'])
+    trimmed_videos = clipper.main(payload['video'], payload['srt'], str(workspace.clipper_output),
+                                  payload.get('aspect_ratio', '1'), payload.get('crop_center'),
+                                  payload.get('interval'), workspace.probe_cache) or []
+    videos = []
+    for trimmed_video in map(Path, trimmed_videos):
+        subtitler.process_video_and_subtitles(str(trimmed_video), payload['srt'], str(workspace.subtitler_output),
+                                              workspace.probe_cache)
+        videos.append(str(workspace.subtitler_output / f"{trimmed_video.stem}_subtitled.mp4"))
+    if videos and payload.get('dedupe', False):
+        pair = (Path(payload['video']), Path(payload['srt']))
+        options = {'interval': payload.get('interval')}
+        pipeline.register_clips({pair: pipeline.fingerprint_clip(*pair, workspace.analysis, options)},
+                                payload.get('aspect_ratio', '1'), workspace.subtitler_output, {pair: options})
+    return {'videos': videos}
+
+
+HANDLERS = {
+    'transcribe': handle_transcribe,
+    'align': handle_align,
+    'encode': handle_encode,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distribute pipeline work over a shared SQLite queue.")
+    parser.add_argument('--db', required=True, help="Path of the queue database on the shared filesystem")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    submit_parser = subparsers.add_parser('submit', help="Queue a job for the videos in a workspace")
+    submit_parser.add_argument('--workspace', required=True, help="Job workspace on the shared filesystem")
+    submit_parser.add_argument('--aspect-ratio', default='1',
+                               help="Menu choice (1-5) or comma-separated render profiles, e.g. 9:16,1:1")
+    submit_parser.add_argument('--smart-crop', action='store_true',
+                               help="Crop around the motion in each clip instead of the frame center")
+    submit_parser.add_argument('--snap-boundaries', action='store_true',
+                               help="Move clip boundaries to the nearest pause instead of the first and last subtitle")
+    submit_parser.add_argument('--dedupe', action='store_true',
+                               help="Link clips already rendered on this host instead of rendering them again")
+    submit_parser.add_argument('--topic', default=None, help="Only select clips about this topic")
+    submit_parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    worker_parser = subparsers.add_parser('worker', help="Lease and run tasks")
+    worker_parser.add_argument('--kinds', default=','.join(HANDLERS), help="Comma-separated task kinds to run")
+    worker_parser.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS)
+
+    subparsers.add_parser('status', help="Show task counts")
+
+    args = parser.parse_args()
+    queue = WorkQueue(args.db)
+
+    if args.command == 'submit':
+        workspace_root = os.path.abspath(args.workspace)
+        queue.enqueue('transcribe', {'workspace': workspace_root, 'job_id': uuid.uuid4().hex,
+                                     'aspect_ratio': args.aspect_ratio,
+                                     'smart_crop': args.smart_crop, 'snap_boundaries': args.snap_boundaries,
+                                     'topic': args.topic, 'dedupe': args.dedupe},
+                      max_attempts=args.max_attempts)
+    elif args.command == 'worker':
+        kinds = [kind.strip() for kind in args.kinds.split(',') if kind.strip()]
+        unknown = [kind for kind in kinds if kind not in HANDLERS]
+        if unknown:
+            parser.error(f"Unknown task kinds: {', '.join(unknown)}")
+        worker = Worker(queue, HANDLERS, kinds, lease_seconds=args.lease_seconds)
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
+    else:
+        for kind, status, count in queue.stats():
+            print(f"{kind:12} {status:8} {count}")
+
+
+if __name__ == "__main__":
+    main()
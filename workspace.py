@@ -0,0 +1,130 @@
+# Standard library imports
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+# Third party imports
+
+# Local application imports
+from media_info import PROBE_CACHE_NAME
+from artifact_store import scratch_dir
+
+DEFAULT_JOBS_ROOT = 'jobs'
+
+
+class Workspace:
+    """
+    The folders used by a single pipeline job, all under one root directory.
+
+    `Workspace('.')` is the classic layout (./input_files, ./whisper_output, ...), while
+    `Workspace.create()` gives each job its own root so that many jobs can run on one
+    host without reading or overwriting each other's files.
+
+    With a scratch root (VCC_SCRATCH, see artifact_store), the trimmed clips and analysis
+    caches live in the workspace's own folder there.
+    """
+
+    def __init__(self, root='.'):
+        self.root = Path(root)
+        self.scratch = scratch_dir(self.root)
+
+    @classmethod
+    def create(cls, jobs_root=DEFAULT_JOBS_ROOT, job_id=None):
+        """
+        Creates a new workspace under jobs_root. The job id defaults to a timestamp plus a random suffix.
+        """
+        if job_id is None:
+            job_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        workspace = cls(Path(jobs_root) / job_id)
+        workspace.ensure()
+        return workspace
+
+    @property
+    def job_id(self):
+        return self.root.resolve().name
+
+    @property
+    def input_files(self):
+        return self.root / 'input_files'
+
+    @property
+    def sections(self):
+        return self.input_files / 'sections'
+
+    @property
+    def audio(self):
+        """
+        Audio-only downloads of sources without captions, transcribed locally.
+        """
+        return self.input_files / 'audio'
+
+    @property
+    def whisper_output(self):
+        return self.root / 'whisper_output'
+
+    @property
+    def crew_output(self):
+        return self.root / 'crew_output'
+
+    @property
+    def clipper_output(self):
+        return (self.scratch or self.root) / 'clipper_output'
+
+    @property
+    def subtitler_output(self):
+        return self.root / 'subtitler_output'
+
+    @property
+    def analysis(self):
+        """
+        Cached per-source analysis data (proxies, audio envelopes, ...).
+        """
+        return (self.scratch or self.root) / 'analysis'
+
+    @property
+    def probe_cache(self):
+        return self.analysis / PROBE_CACHE_NAME
+
+    def folders(self):
+        return [self.input_files, self.whisper_output, self.crew_output, self.clipper_output, self.subtitler_output]
+
+    def ensure(self):
+        """
+        Creates all workspace folders if they don't exist.
+        """
+        for folder in self.folders():
+            os.makedirs(folder, exist_ok=True)
+        return self
+
+    def transcript_files(self):
+        """
+        Returns the (txt, srt) transcript pair in whisper_output that share a file stem, preferring
+        the most recently written one, or (None, None) if there is no complete pair.
+        """
+        srt_files = {path.stem: path for path in self.whisper_output.glob('*.srt')}
+        pairs = [(txt_file, srt_files[txt_file.stem]) for txt_file in self.whisper_output.glob('*.txt')
+                 if txt_file.stem in srt_files]
+        if not pairs:
+            return None, None
+        return max(pairs, key=lambda pair: pair[1].stat().st_mtime)
+
+    def transcript_artifact(self, stem):
+        """
+        Returns the binary transcript artifact (see transcript_store) written next to the
+        transcript pair with this stem, or None if there is none or it was written in an older format.
+        """
+        import transcript_store
+
+        path = self.whisper_output / f"{stem}.transcript"
+        return path if transcript_store.is_current(path) else None
+
+    def __repr__(self):
+        return f"Workspace({str(self.root)!r})"
+
+
+def default_workspace():
+    """
+    Returns the workspace set with the VCC_WORKSPACE environment variable, or the current directory.
+    """
+    return Workspace(os.getenv('VCC_WORKSPACE', '.'))
@@ -1,14 +1,23 @@
 # Standard library imports
+import hashlib
 import logging
 import os
 import re
 from pathlib import Path
 
-# Third party imports
-from youtube_transcript_api import YouTubeTranscriptApi
-import yt_dlp
+# Third party imports (yt_dlp and youtube_transcript_api are imported on first use)
 
 # Local application imports
+from artifacts import atomic_write_text, mark_ready
+from utils import srt_interval, shift_srt
+from workspace import default_workspace
+
+# Seconds of context kept before and after each selected clip when downloading sections
+SECTION_PADDING = 5.0
+
+VIDEO_FORMAT = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
+# Enough for speech recognition; plain media files without a separate audio stream fall back to 'worst'
+AUDIO_FORMAT = 'bestaudio[abr<=?96]/worstaudio/worst'
 
 def extract_video_id(yt_vid_url):
     # Updated regex pattern to match various YouTube URL formats
@@ -21,12 +30,32 @@ def extract_video_id(yt_vid_url):
     else:
         return None
 
-def yt_vid_url_to_mp4(yt_vid_url, mp4_dir_save_path):
+def media_id(yt_vid_url):
+    """
+    Returns the YouTube video ID of a URL, or a stable ID derived from any other media URL
+    (e.g. a file on a local HTTP server), used to name its transcript and audio files.
+    """
+    return extract_video_id(yt_vid_url) or f"media_{hashlib.sha1(yt_vid_url.encode('utf-8')).hexdigest()[:12]}"
+
+def video_format(max_height=None):
+    """
+    Returns the yt-dlp format selector for the video, preferring formats no taller than
+    max_height (see `clipper.required_source_height`). Formats of unknown height still qualify,
+    and the uncapped selector is the last resort.
+    """
+    if max_height is None:
+        return VIDEO_FORMAT
+    return (f'bestvideo[ext=mp4][height<=?{max_height}]+bestaudio[ext=m4a]/best[ext=mp4][height<=?{max_height}]/'
+            f'best[height<=?{max_height}]/{VIDEO_FORMAT}')
+
+def yt_vid_url_to_mp4(yt_vid_url, mp4_dir_save_path, max_height=None):
+    import yt_dlp
+
     # Create the directory if it doesn't exist
     os.makedirs(mp4_dir_save_path, exist_ok=True)
 
     ydl_opts = {
-        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+        'format': video_format(max_height),
         'outtmpl': os.path.join(mp4_dir_save_path, '%(title)s.%(ext)s'),
         'restrictfilenames': True,
     }
@@ -44,8 +73,101 @@ def yt_vid_url_to_mp4(yt_vid_url, mp4_dir_save_path):
         video_file.rename(new_video_file)
         video_file = new_video_file
 
+    # yt-dlp renames its .part file into place once complete, so the video is ready now
+    mark_ready(video_file)
     return str(video_file)
 
+def yt_vid_url_to_section(yt_vid_url, start, end, mp4_dir_save_path, name, max_height=None):
+    """
+    Downloads only the [start, end] time range (in seconds) of a YouTube video using
+    yt-dlp section downloading. Cuts are forced on keyframes so that the section starts
+    exactly at `start` and rebased timestamps line up with the downloaded file.
+    """
+    import yt_dlp
+
+    os.makedirs(mp4_dir_save_path, exist_ok=True)
+
+    ydl_opts = {
+        'format': video_format(max_height),
+        'outtmpl': os.path.join(mp4_dir_save_path, f'{name}.%(ext)s'),
+        'restrictfilenames': True,
+        'download_ranges': yt_dlp.utils.download_range_func(None, [(start, end)]),
+        'force_keyframes_at_cuts': True,
+        'merge_output_format': 'mp4',
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.download([yt_vid_url])
+
+    video_file = Path(mp4_dir_save_path) / f'{name}.mp4'
+    if not video_file.exists():
+        # yt-dlp may have kept the original container extension
+        candidates = sorted(Path(mp4_dir_save_path).glob(f'{name}.*'))
+        if not candidates:
+            raise FileNotFoundError(f"yt-dlp did not produce a section file for {name}")
+        video_file = candidates[0].rename(video_file)
+
+    mark_ready(video_file)
+    return str(video_file)
+
+
+def yt_vid_url_to_audio(yt_vid_url, audio_dir_save_path, name):
+    """
+    Downloads only a low-bitrate audio stream, for local transcription of videos without
+    captions. The video itself is downloaded later, if at all. Returns the audio file path.
+    """
+    import yt_dlp
+
+    os.makedirs(audio_dir_save_path, exist_ok=True)
+
+    ydl_opts = {
+        'format': AUDIO_FORMAT,
+        'outtmpl': os.path.join(audio_dir_save_path, f'{name}.%(ext)s'),
+        'restrictfilenames': True,
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(yt_vid_url, download=True)
+        audio_file = Path(ydl.prepare_filename(info))
+
+    mark_ready(audio_file)
+    return str(audio_file)
+
+def download_clip_sections(yt_vid_url, srt_files, sections_dir, padding=SECTION_PADDING, max_height=None):
+    """
+    Downloads one padded section per selected clip SRT and writes a copy of the SRT with
+    timestamps rebased onto the section file.
+
+    Returns a list of (section_video_path, rebased_srt_path) pairs ready for the clipper.
+    """
+    os.makedirs(sections_dir, exist_ok=True)
+    sections = []
+
+    for srt_file in srt_files:
+        srt_file = Path(srt_file)
+        with open(srt_file, 'r', encoding='utf-8') as file:
+            subtitles = file.read()
+
+        interval = srt_interval(subtitles)
+        if interval is None:
+            logging.warning(f"No timestamps found in {srt_file}. Skipping section download.")
+            continue
+
+        section_start = max(0.0, interval[0] - padding)
+        section_end = interval[1] + padding
+        logging.info(f"Downloading section {section_start:.2f}s-{section_end:.2f}s for {srt_file.name}")
+
+        section_video = yt_vid_url_to_section(yt_vid_url, section_start, section_end, sections_dir,
+                                              f"{srt_file.stem}_section", max_height)
+
+        rebased_srt = Path(sections_dir) / srt_file.name
+        atomic_write_text(rebased_srt, shift_srt(subtitles, -section_start))
+
+        sections.append((section_video, str(rebased_srt)))
+
+    return sections
+
+
 def yt_vid_id_to_srt(transcript, yt_video_id, srt_save_path):
 
     srt_content = []
@@ -72,37 +194,90 @@ def yt_vid_id_to_srt(transcript, yt_video_id, srt_save_path):
     # Ensure the output directory exists
     os.makedirs(srt_save_path, exist_ok=True)
 
-    with open(os.path.join(srt_save_path, 'subtitles.srt'), 'w', encoding='utf-8') as file:
-        file.write('\n'.join(srt_content))
+    atomic_write_text(os.path.join(srt_save_path, f'{yt_video_id}.srt'), '\n'.join(srt_content))
 
 
 def yt_vid_id_to_txt(transcript, yt_video_id, txt_save_path):
     # Create the directory if it doesn't exist
-    os.makedirs(os.path.dirname(txt_save_path), exist_ok=True)
+    os.makedirs(txt_save_path, exist_ok=True)
 
     # Write the transcript to a .txt file as a single line
-    with open(os.path.join(txt_save_path, 'transcript.txt'), 'w', encoding='utf-8') as f:
-        full_transcript = ' '.join(entry['text'] for entry in transcript)
-        f.write(full_transcript)
+    full_transcript = ' '.join(entry['text'] for entry in transcript)
+    atomic_write_text(os.path.join(txt_save_path, f'{yt_video_id}.txt'), full_transcript)
+
+
+def fetch_transcript(yt_video_id):
+    """
+    Returns the YouTube transcript of a video, or None if it has none (or yt_video_id is None,
+    for media that is not on YouTube).
+    """
+    if yt_video_id is None:
+        return None
+
+    from youtube_transcript_api import YouTubeTranscriptApi, CouldNotRetrieveTranscript
+
+    # this creates YouTubeTranscriptApi object
+    try:
+        return YouTubeTranscriptApi.get_transcript(yt_video_id)
+    except CouldNotRetrieveTranscript as e:
+        logging.warning(f"No YouTube transcript for {yt_video_id}: {e.__class__.__name__}")
+        return None
+
+
+def yt_vid_id_to_artifact(transcript, yt_video_id, save_path):
+    import transcript_store
+
+    # Milliseconds are truncated, like the timestamps of the SRT file
+    segments = [(int(entry['start'] * 1000), int((entry['start'] + entry['duration']) * 1000), entry['text'])
+                for entry in transcript]
+    os.makedirs(save_path, exist_ok=True)
+    transcript_store.write_transcript(transcript_store.artifact_path(save_path, yt_video_id), segments)
+
+
+def write_transcript(transcript, yt_video_id, srt_dir_save_path, txt_dir_save_path):
+    yt_vid_id_to_srt(transcript, yt_video_id, srt_dir_save_path)
+    yt_vid_id_to_txt(transcript, yt_video_id, txt_dir_save_path)
+    yt_vid_id_to_artifact(transcript, yt_video_id, srt_dir_save_path)
+
+
+def transcribe_audio(yt_vid_url, audio_dir_save_path, output_dir):
+    """
+    Fallback for videos without a YouTube transcript: downloads only the audio and
+    transcribes it locally into output_dir, named after `media_id`.
+    """
+    import local_transcribe
+
+    audio_file = yt_vid_url_to_audio(yt_vid_url, audio_dir_save_path, media_id(yt_vid_url))
+    return local_transcribe.transcribe_main(audio_file, str(output_dir))
 
 
-def main(yt_vid_url, mp4_dir_save_path, srt_dir_save_path, txt_dir_save_path):
+def main(yt_vid_url, mp4_dir_save_path, srt_dir_save_path, txt_dir_save_path, download_video=True,
+         max_height=None):
+    """
+    Fetches the YouTube transcript and writes it as SRT and TXT, or transcribes the audio
+    locally if the video has no transcript. The full video (no taller than max_height, if
+    possible) is downloaded afterwards unless download_video is False, in which case only the
+    selected clip sections are fetched later with `download_clip_sections`.
+    """
     # Setup logging
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
     yt_video_id = extract_video_id(yt_vid_url)
 
-    # this creates YouTubeTranscriptApi object
-    transcript = YouTubeTranscriptApi.get_transcript(yt_video_id)
+    transcript = fetch_transcript(yt_video_id)
 
-    yt_vid_url_to_mp4(yt_vid_url, mp4_dir_save_path)
-    yt_vid_id_to_srt(transcript, yt_video_id, srt_dir_save_path)
-    yt_vid_id_to_txt(transcript,  yt_video_id, txt_dir_save_path)
+    if transcript is None:
+        transcribe_audio(yt_vid_url, os.path.join(mp4_dir_save_path, 'audio'), srt_dir_save_path)
+    else:
+        write_transcript(transcript, yt_video_id, srt_dir_save_path, txt_dir_save_path)
+    if download_video:
+        yt_vid_url_to_mp4(yt_vid_url, mp4_dir_save_path, max_height)
 
 if __name__ == "__main__":
     yt_vid_url = input("Enter the YouTube URL: ")
     yt_video_id = extract_video_id(yt_vid_url)
-    mp4_dir_save_path = "./input_files"
-    srt_dir_save_path = "./whisper_output"
-    txt_dir_save_path = "./whisper_output"
-    main(yt_vid_url, mp4_dir_save_path, srt_dir_save_path, txt_dir_save_path)
\ No newline at end of file
+    workspace = default_workspace()
+    mp4_dir_save_path = str(workspace.input_files)
+    srt_dir_save_path = str(workspace.whisper_output)
+    txt_dir_save_path = str(workspace.whisper_output)
+    main(yt_vid_url, mp4_dir_save_path, srt_dir_save_path, txt_dir_save_path)